@@ -94,7 +94,8 @@ class AlazarTechBoard(Device):
                               "trig_delay_samples", "trig_timeout_10usecs", "input_range",
                               "channels",
                               "chA_coupling_id", "chA_input_range", "chA_impedance_id", "chA_bw_limit",
-                              "chB_coupling_id", "chB_input_range", "chB_impedance_id", "chB_bw_limit"
+                              "chB_coupling_id", "chB_input_range", "chB_impedance_id", "chB_bw_limit",
+                              "sidecar_data_files"
                               ]
     })
     def __init__(self, name, server,
@@ -126,7 +127,8 @@ class AlazarTechBoard(Device):
                  chB_coupling_id         = ats.AC_COUPLING,
                  chB_input_range         = 4000,
                  chB_impedance_id        = ats.IMPEDANCE_1M_OHM,
-                 chB_bw_limit            = 0):
+                 chB_bw_limit            = 0,
+                 sidecar_data_files      = False): # Save traces to a file linked into the shot file, see labscript_devices.sidecar_files
         Device.__init__(self, name, None, None)
         self.name = name
         # This line makes BLACS think the device is connected to something
@@ -174,6 +176,7 @@ from blacs.tab_base_classes import MODE_MANUAL, MODE_TRANSITION_TO_BUFFERED, MOD
 from blacs.device_base_class import DeviceTab
 import os
 import copy
+from labscript_devices.sidecar_files import open_data_file
 
 # A BLACS tab for a purely remote device which does not need configuration of parameters in BLACS
 
@@ -585,7 +588,11 @@ class GuilessWorker(Worker):
         # Waits on the acquisition thread, and manages the lock
         self.wait_acquisition_complete()
         # Write data to HDF5 file
-        with h5py.File(self.h5file, 'r+') as hdf5_file:
+        with open_data_file(
+            self.h5file,
+            self.device_name,
+            sidecar=self.atsparam.get('sidecar_data_files', False),
+        ) as hdf5_file:
             grp = hdf5_file.create_group('/data/traces/'+self.device_name)
             if self.channels & ats.CHANNEL_A:
                 dsetA = grp.create_dataset(
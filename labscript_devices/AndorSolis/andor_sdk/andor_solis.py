@@ -41,6 +41,19 @@ finally:
     libpath = os.path.join(dll_dir, libname)
     andor_solis = ctypes.cdll.LoadLibrary(libpath)
 
+def _check_uint16_buffer(arr, shape):
+    """ Check that arr can be passed to the SDK as a buffer of 16-bit 
+        images of the given shape. """
+    if (
+        not isinstance(arr, np.ndarray)
+        or arr.dtype != np.uint16
+        or not arr.flags['C_CONTIGUOUS']
+        or tuple(arr.shape) != tuple(shape)
+    ):
+        raise ValueError(
+            f"Expected a C-contiguous uint16 array of shape {tuple(shape)}"
+        )
+
 class AndorException(Exception):
     """ Base class for andor exceptions"""
 
@@ -92,7 +105,7 @@ def uint_winapi(argtypes=[]):
             """ Third layer wraps the call and 
                 checks return status. """
             result = sdk_func(*[type_(arg) for type_, arg in zip(argtypes, args)])
-            check_status(result)
+            return check_status(result)
         return wrapped_call
     return args_decorator
 
@@ -305,16 +318,21 @@ def GetAcquiredData(shape):
     check_status(result)
     return np.ctypeslib.as_array(arr).reshape(shape)
 
-def GetAcquiredData16(shape):
+def GetAcquiredData16(shape, out=None):
     """ 16-bit version of the GetAcquiredData function. 
         The “array” must be large enough to hold the 
-        complete data set. """
+        complete data set. If out is given, it must be a 
+        C-contiguous uint16 array of the given shape, and 
+        the data are written to it instead of a new array. """
     andor_solis.GetAcquiredData16.restype = ctypes.c_uint
-    size = np.prod(shape)
-    arr = (ctypes.c_uint16 * size)()  # not 100% sure this should be unsigned.
-    result = andor_solis.GetAcquiredData16(ctypes.pointer(arr), ctypes.c_ulong(size))
+    if out is None:
+        out = np.empty(shape, dtype=np.uint16)
+    _check_uint16_buffer(out, shape)
+    result = andor_solis.GetAcquiredData16(
+        out.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16)), ctypes.c_ulong(out.size)
+    )
     check_status(result)
-    return np.ctypeslib.as_array(arr).reshape(shape)
+    return out
 
 def GetAcquiredFloatData(shape):
     """ This function is reserved """
@@ -1364,6 +1382,23 @@ def GetNumberAvailableImages():
     check_status(result)
     return int(first.value), int(last.value)
 
+def GetNumberNewImages():
+    """ This function will return information on the number of new images 
+        (i.e. images which have not yet been retrieved) in the circular 
+        buffer. This information can be used with GetImages to retrieve a 
+        series of the latest images. If any images are overwritten in the 
+        circular buffer they can no longer be retrieved and the information 
+        returned will treat overwritten images as having been retrieved. 
+        Wrapped function returns (first, last), or None if there are no 
+        new images. """
+    andor_solis.GetNumberNewImages.restype = ctypes.c_uint
+    first = ctypes.c_long()
+    last = ctypes.c_long()
+    result = andor_solis.GetNumberNewImages(ctypes.byref(first), ctypes.byref(last))
+    if check_status(result) == 'DRV_NO_NEW_DATA':
+        return None
+    return int(first.value), int(last.value)
+
 def GetImages(first, last, shape):
     """ This function will update the data array with the specified series 
         of images from the circular buffer. If the specified series is out of
@@ -1385,6 +1420,28 @@ def GetImages(first, last, shape):
     check_status(result)
     return np.ctypeslib.as_array(arr)
 
+def GetImages16(first, last, out):
+    """ 16-bit version of the GetImages function. The images first to
+        last (inclusive, counted from 1 at the start of the acquisition)
+        are written to out, which must be a C-contiguous uint16 array of
+        shape (last - first + 1, Ny, Nx), such as a slice of a 
+        preallocated buffer of the whole series. Returns the range of 
+        valid images (validfirst, validlast) written to out. """
+    andor_solis.GetImages16.restype = ctypes.c_uint
+    _check_uint16_buffer(out, (last - first + 1,) + out.shape[1:])
+    validfirst = ctypes.c_long()
+    validlast = ctypes.c_long()
+    result = andor_solis.GetImages16(
+        ctypes.c_long(first),
+        ctypes.c_long(last),
+        out.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16)),
+        ctypes.c_ulong(out.size),
+        ctypes.byref(validfirst),
+        ctypes.byref(validlast),
+    )
+    check_status(result)
+    return int(validfirst.value), int(validlast.value)
+
 def GetMostRecentImage(shape):
     """ This function will update the data array with the most recently 
         acquired image in any acquisition mode. The data are returned as 
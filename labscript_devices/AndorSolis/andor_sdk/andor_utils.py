@@ -63,6 +63,8 @@ class AndorCam(object):
         self.emccd = False
         self.emccd_gain = None
         self.armed = False
+        self.n_downloaded = 0
+        self._cancelled = False
         self.initialize_camera()
 
 
@@ -545,35 +547,52 @@ class AndorCam(object):
             attrs['height'] + attrs['bottom_start'] - 1,
         )
 
-    def acquire(self):
+    @property
+    def acquisition_shape(self):
+        """ Shape of the frames of one acquisition. For fast kinetics, 
+        (N_fast_kinetics, Ny//N, Nx). Otherwise, (N_exposures, Ny, Nx)."""
+        N = self.acquisition_attributes['number_kinetics']
+        if 'fast_kinetics' in self.acquisition_mode:
+            return (N, self.image_shape[0] // N, self.image_shape[1])
+        return (N, self.image_shape[0], self.image_shape[1])
+
+    def acquire(self, out=None):
         """ Carries down the acquisition, if the camera is armed and
-        waits for an acquisition event for acquisition timeout (has to be
-        in milliseconds), default to 5 seconds """
+        waits for acquisition events for acquisition timeout (has to be
+        in milliseconds), default to 5 seconds. If out, a uint16 array of 
+        shape acquisition_shape, is given, the frames of a kinetic series 
+        are downloaded into it as they are acquired, and the remaining 
+        frames once the acquisition is complete. The number of frames 
+        downloaded is then self.n_downloaded."""
     
         acquisition_timeout = self.acquisition_attributes['acquisition_timeout']
+        self.n_downloaded = 0
+        self._cancelled = False
 
-        def homemade_wait_for_acquisition():
-            self.acquisition_status = ''
+        def wait_for_acquisition():
+            # Sleep until acquisition events, rather than polling GetStatus:
             start_wait = time.time()
-            while self.acquisition_status != 'DRV_IDLE':
-                self.acquisition_status = GetStatus()
-                # TODO: Also count the number of acquired (buffered) images and
-                # stop when it matches the expected number of frames. 
-                t0 = time.time() - start_wait
-                if t0 > acquisition_timeout * ms:
+            self.acquisition_status = GetStatus()
+            while self.acquisition_status != 'DRV_IDLE' and not self._cancelled:
+                remaining = acquisition_timeout * ms - (time.time() - start_wait)
+                if remaining <= 0:
                     rich_print(
-                        "homemade_wait_for_acquisition: timeout occured",
+                        "wait_for_acquisition: timeout occured",
                         color='firebrick',
                     )
                     break
-                time.sleep(0.05)
+                WaitForAcquisitionTimeOut(int(np.ceil(remaining / ms)))
+                if out is not None and 'kinetic_series' in self.acquisition_mode:
+                    self.download_new_images(out)
+                self.acquisition_status = GetStatus()
             if self.chatty:
+                t0 = time.time() - start_wait
                 rich_print(
-                    f"Leaving homemade_wait with status {self.acquisition_status} ",
+                    f"Leaving wait_for_acquisition with status {self.acquisition_status} ",
                     color='goldenrod',
                 )
                 rich_print(
-                    f"homemade_wait_for_acquisition: elapsed time {t0/ms} ms, out of max {acquisition_timeout} ms",
+                    f"wait_for_acquisition: elapsed time {t0/ms} ms, out of max {acquisition_timeout} ms",
                     color='goldenrod',
                 )
                                                             
@@ -588,7 +607,7 @@ class AndorCam(object):
                         f"Waiting for {acquisition_timeout} ms for timeout ...",
                         color='yellow',
                     )
-                homemade_wait_for_acquisition()
+                wait_for_acquisition()
             
             # Last chance, check if the acquisition is finished, update
             # acquisition status otherwise, abort and raise an error
@@ -600,18 +619,44 @@ class AndorCam(object):
                 AbortAcquisition()
                 raise AndorException('Acquisition aborted due to timeout')
 
-    def download_acquisition(self):
-        """ Download buffered acquisition. For fast kinetics, returns a 3D
-        array of shape (N_fast_kinetics, Ny//N, Nx). Otherwise, returns array
-        of shape (N_exposures, Ny, Nx)."""
+            if out is not None:
+                if 'kinetic_series' in self.acquisition_mode:
+                    # Flush the frames acquired since the last event:
+                    self.download_new_images(out)
+                else:
+                    self.download_acquisition(out)
+
+    def download_new_images(self, out):
+        """ Download the frames of the current kinetic series that have been
+        acquired since the last call into the uint16 array out, of shape
+        acquisition_shape, and update self.n_downloaded. """
+        new_images = GetNumberNewImages()
+        if new_images is None:
+            return
+        first, last = new_images
+        last = min(last, len(out))
+        if first > self.n_downloaded + 1:
+            rich_print(
+                f"""------> Images {self.n_downloaded + 1}-{first - 1} were 
+                overwritten in the circular buffer before download.""",
+                color='firebrick',
+            )
+        first = max(first, self.n_downloaded + 1)
+        if last < first:
+            return
+        GetImages16(first, last, out[first - 1 : last])
+        self.n_downloaded = last
+
+    def download_acquisition(self, out=None):
+        """ Download buffered acquisition as 16-bit data. For fast kinetics, 
+        returns a 3D array of shape (N_fast_kinetics, Ny//N, Nx). Otherwise, 
+        returns array of shape (N_exposures, Ny, Nx). If out is given, the 
+        data are written to it instead of a new array."""
         
-        N = self.acquisition_attributes['number_kinetics']
-        if 'fast_kinetics' in self.acquisition_mode:
-            shape = (N, self.image_shape[0] // N, self.image_shape[1])
-        else:
-            shape = (N, self.image_shape[0], self.image_shape[1])
-
-        # self.abort_acquisition # This seems like a bad thing to do here...
+        shape = self.acquisition_shape
+        N = shape[0]
+        if out is None:
+            out = np.zeros(shape, dtype=np.uint16)
 
         # Lets see what we have in memory
         available_images = GetNumberAvailableImages()
@@ -621,35 +666,29 @@ class AndorCam(object):
             )
 
         if (available_images[1] - available_images[0]) + 1 == N:
-            # Special save format for FK frames
-            if 'fast_kinetics' in self.acquisition_mode:
-                data = GetAcquiredData(shape)
-                if self.chatty:
-                    print(
-                        f"Shape of the downloaded images in FK mode are {data.shape}"
-                    )
-            # Regular save format for other acquisition modes
-            else:
-                print("Shape passed to GetAcquiredData is", shape)
-                data = GetAcquiredData(shape)
-                # data = GetOldestImage16(shape)
-                print("Data shape and dtype is:", data.shape, data.dtype)
+            GetAcquiredData16(shape, out=out)
+            self.n_downloaded = N
+            if self.chatty:
+                print("Data shape and dtype is:", out.shape, out.dtype)
         else:
             print(
                 f"""------> Incorrect number of images to download: 
                 {available_images}, expecting: {N}."""
             )
-            data = np.zeros(shape)
+            out[...] = 0
+            self.n_downloaded = 0
 
         # Optional clear buffer
         # FreeInternalMemory()
 
-        return data
+        return out
 
     def abort_acquisition(self):
-        """Abort"""
+        """Abort, waking up a thread waiting for acquisition events"""
         if self.chatty:
             rich_print("Debug: Abort Called", color='yellow')
+        self._cancelled = True
+        CancelWait()
         AbortAcquisition()
 
     def shutdown(self):
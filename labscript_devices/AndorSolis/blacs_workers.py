@@ -10,6 +10,7 @@
 # the project for the full license.                                 #
 #                                                                   #
 #####################################################################
+import numpy as np
 from zprocess import rich_print
 from labscript_devices.IMAQdxCamera.blacs_workers import MockCamera, IMAQdxCameraWorker
 
@@ -69,34 +70,39 @@ class AndorCamera(object):
             print(f"FK mode Kinetics Number is {self.camera.number_fast_kinetics}.")
         print(f"    ---> Attempting to grab {n_images} acquisition(s).")
 
+        # Frames are downloaded as 16-bit data into a buffer preallocated for the
+        # whole shot, and images holds views of it rather than copies:
         if 'single' in self.camera.acquisition_mode:
+            buffer = np.zeros((n_images,) + self.camera.acquisition_shape, np.uint16)
             for image_number in range(n_images):
-                self.camera.acquire()
-                print(f"    {image_number}: Acquire complete")
-                downloaded = self.camera.download_acquisition()
-                print(f"    {image_number}: Download complete")
-                images.append(downloaded)
+                self.camera.acquire(out=buffer[image_number])
+                print(f"    {image_number}: Acquire and download complete")
+                images.append(buffer[image_number])
                 self.camera.armed = True
             self.camera.armed = False
             print(f"Got {len(images)} of {n_images} acquisition(s).")
         elif 'fast_kinetics' in self.camera.acquisition_mode:
             nacquisitions = n_images // self.camera.number_fast_kinetics
+            shape = self.camera.acquisition_shape
+            buffer = np.zeros((nacquisitions,) + shape, np.uint16)
             for image_number in range(nacquisitions):
-                self.camera.acquire()
-                print(f"    {image_number}: Acquire complete")
-                downloaded = self.camera.download_acquisition()
-                print(f"    {image_number}: Download complete")
-                images.extend(list(downloaded))
+                self.camera.acquire(out=buffer[image_number])
+                print(f"    {image_number}: Acquire and download complete")
+                images.extend(buffer[image_number])
                 self.camera.armed = True
             self.camera.armed = False # This last disarming may be redundant
             print(f"Got {len(images)} images in {nacquisitions} FK series acquisition(s).")    
         else: 
-            self.camera.acquire()
-            print(f"    Acquire complete")
-            downloaded = self.camera.download_acquisition()
-            print(f"    images {len(images)}-{len(images) + len(downloaded)}: Download complete")
-            images.extend(list(downloaded))
-            self.camera.armed = False
+            # Frames of a kinetic series are downloaded while it is acquired, so
+            # only the last ones remain to be downloaded once it is complete:
+            buffer = np.zeros(self.camera.acquisition_shape, np.uint16)
+            try:
+                self.camera.acquire(out=buffer)
+            finally:
+                n_downloaded = self.camera.n_downloaded
+                print(f"    images {len(images)}-{len(images) + n_downloaded}: Download complete")
+                images.extend(buffer[:n_downloaded])
+                self.camera.armed = False
             print(f"Got {len(images)} of {n_images} acquisition(s).")
    
 
@@ -11,6 +11,7 @@
 #                                                                   #
 #####################################################################
 from labscript_devices import BLACS_tab
+from labscript_devices.trigger_index import TriggerIndex
 from labscript import TriggerableDevice, LabscriptError, set_passed_properties
 import numpy as np
 
@@ -65,28 +66,20 @@ class Camera(TriggerableDevice):
                                  'and one was not specified for this exposure')
         if not duration > 0:
             raise LabscriptError("exposure_time must be > 0, not %s"%str(duration))
+        # The exposures of all cameras attached to the same trigger:
+        trigger_index = TriggerIndex.get(self.trigger_device)
         # Only ask for a trigger if one has not already been requested by 
         # another camera attached to the same trigger:
-        already_requested = False
-        for camera in self.trigger_device.child_devices:
-            if camera is not self:
-                for _, other_t, _, other_duration in camera.exposures:
-                    if t == other_t and duration == other_duration:
-                        already_requested = True
-        if not already_requested:
+        if not trigger_index.requested_by_other(self, t, duration):
             self.trigger_device.trigger(t, duration)
         # Check for exposures too close together (check for overlapping 
         # triggers already performed in self.trigger_device.trigger()):
         start = t
-        end = t + duration
-        for exposure in self.exposures:
-            _, other_t, _, other_duration = exposure
-            other_start = other_t
-            other_end = other_t + other_duration
-            if abs(other_start - end) < self.minimum_recovery_time or abs(other_end - start) < self.minimum_recovery_time:
-                raise LabscriptError('%s %s has two exposures closer together than the minimum recovery time: ' %(self.description, self.name) + \
-                                     'one at t = %fs for %fs, and another at t = %fs for %fs. '%(t,duration,start,duration) + \
-                                     'The minimum recovery time is %fs.'%self.minimum_recovery_time)
+        if trigger_index.find_too_close(self, t, duration, self.minimum_recovery_time) is not None:
+            raise LabscriptError('%s %s has two exposures closer together than the minimum recovery time: ' %(self.description, self.name) + \
+                                 'one at t = %fs for %fs, and another at t = %fs for %fs. '%(t,duration,start,duration) + \
+                                 'The minimum recovery time is %fs.'%self.minimum_recovery_time)
+        trigger_index.add(self, t, duration)
         self.exposures.append((name, t, frametype, duration))
         return duration
     
@@ -94,8 +87,9 @@ class Camera(TriggerableDevice):
         # Check that all Cameras sharing a trigger device have exposures when we have exposures:
         for camera in self.trigger_device.child_devices:
             if camera is not self:
+                other_exposures = set(camera.exposures)
                 for exposure in self.exposures:
-                    if exposure not in camera.exposures:
+                    if exposure not in other_exposures:
                         _, start, _, duration = exposure
                         raise LabscriptError('Cameras %s and %s share a trigger. ' % (self.name, camera.name) + 
                                              '%s has an exposure at %fs for %fs, ' % (self.name, start, duration) +
@@ -197,94 +191,53 @@ class CameraTab(DeviceTab):
 
 class CameraWorker(Worker):
     def init(self):
-        global socket; import socket
-        global zmq; import zmq
-        global zprocess; import zprocess
         global shared_drive; import labscript_utils.shared_drive as shared_drive
+        global camera_server_connection; import labscript_devices.camera_server_connection as camera_server_connection
         
         self.host = ''
         self.use_zmq = False
+        # One connection to the server, kept open between shots:
+        self.connection = None
         
     def update_settings_and_check_connectivity(self, host, use_zmq):
         self.host = host
         self.use_zmq = use_zmq
+        self.close_connection()
         if not self.host:
             return False
-        if not self.use_zmq:
-            return self.initialise_sockets(self.host, self.port)
-        else:
-            response = zprocess.zmq_get_string(self.port, self.host, data='hello')
-            if response == 'hello':
-                return True
+        timeout = 5 if self.use_zmq else 10
+        self.get_connection().request(['hello'], ['hello'], [timeout])
+        return True
+
+    def get_connection(self):
+        if self.connection is None:
+            if self.use_zmq:
+                connection_class = camera_server_connection.ZMQServerConnection
             else:
-                raise Exception('invalid response from server: ' + str(response))
-                
-    def initialise_sockets(self, host, port):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        assert port, 'No port number supplied.'
-        assert host, 'No hostname supplied.'
-        assert str(int(port)) == port, 'Port must be an integer.'
-        s.settimeout(10)
-        s.connect((host, int(port)))
-        s.send(b'hello\r\n')
-        response = s.recv(1024).decode('utf8')
-        s.close()
-        if 'hello' in response:
-            return True
-        else:
-            raise Exception('invalid response from server: ' + response)
+                connection_class = camera_server_connection.SocketServerConnection
+            self.connection = connection_class(self.host, self.port)
+        return self.connection
+
+    def close_connection(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
     
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
         h5file = shared_drive.path_to_agnostic(h5file)
         if not self.use_zmq:
-            return self.transition_to_buffered_sockets(h5file,self.host, self.port)
-        response = zprocess.zmq_get_string(self.port, self.host, data=h5file)
-        if response != 'ok':
-            raise Exception('invalid response from server: ' + str(response))
-        response = zprocess.zmq_get_string(self.port, self.host, timeout = 10)
-        if response != 'done':
-            raise Exception('invalid response from server: ' + str(response))
-        return {} # indicates final values of buffered run, we have none
-        
-    def transition_to_buffered_sockets(self, h5file, host, port):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(120)
-        s.connect((host, int(port)))
-        s.send(b'%s\r\n' % h5file.encode('utf8'))
-        response = s.recv(1024).decode('utf8')
-        if not 'ok' in response:
-            s.close()
-            raise Exception(response)
-        response = s.recv(1024).decode('utf8')
-        if not 'done' in response:
-            s.close()
-            raise Exception(response)
+            self.get_connection().request([h5file], ['ok', 'done'], [120, 120])
+        else:
+            # The empty string telling the server to proceed is sent without
+            # waiting for its 'ok', saving a round trip:
+            self.get_connection().request([h5file, ''], ['ok', 'done'], [5, 10])
         return {} # indicates final values of buffered run, we have none
         
     def transition_to_manual(self):
         if not self.use_zmq:
-            return self.transition_to_manual_sockets(self.host, self.port)
-        response = zprocess.zmq_get_string(self.port, self.host, 'done')
-        if response != 'ok':
-            raise Exception('invalid response from server: ' + str(response))
-        response = zprocess.zmq_get_string(self.port, self.host, timeout = 10)
-        if response != 'done':
-            raise Exception('invalid response from server: ' + str(response))
-        return True # indicates success
-        
-    def transition_to_manual_sockets(self, host, port):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(120)
-        s.connect((host, int(port)))
-        s.send(b'done\r\n')
-        response = s.recv(1024).decode('utf8')
-        if response != 'ok\r\n':
-            s.close()
-            raise Exception(response)
-        response = s.recv(1024).decode('utf8')
-        if not 'done' in response:
-            s.close()
-            raise Exception(response)
+            self.get_connection().request(['done'], ['ok', 'done'], [120, 120])
+        else:
+            self.get_connection().request(['done', ''], ['ok', 'done'], [5, 10])
         return True # indicates success
         
     def abort_buffered(self):
@@ -294,27 +247,13 @@ class CameraWorker(Worker):
         return self.abort()
     
     def abort(self):
-        if not self.use_zmq:
-            return self.abort_sockets(self.host, self.port)
-        response = zprocess.zmq_get_string(self.port, self.host, 'abort')
-        if response != 'done':
-            raise Exception('invalid response from server: ' + str(response))
-        return True # indicates success 
-        
-    def abort_sockets(self, host, port):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(120)
-        s.connect((host, int(port)))
-        s.send(b'abort\r\n')
-        response = s.recv(1024).decode('utf8')
-        if not 'done' in response:
-            s.close()
-            raise Exception(response)
+        timeout = 5 if self.use_zmq else 120
+        self.get_connection().request(['abort'], ['done'], [timeout])
         return True # indicates success 
     
     def program_manual(self, values):
         return {}
     
     def shutdown(self):
-        return
+        self.close_connection()
         
@@ -13,6 +13,10 @@
 
 from labscript import Device, PseudoclockDevice, Pseudoclock, ClockLine, config, LabscriptError, set_passed_properties, compiler, IntermediateDevice, WaitMonitor, DigitalOut
 from labscript_devices import runviewer_parser, BLACS_tab, BLACS_worker, labscript_device
+from labscript_devices.table_digest import create_dataset_with_digest, TableCache
+from labscript_devices.upload_image import create_upload_image, read_upload_image
+from labscript_devices.trace_cache import cached_traces
+from labscript_devices.clock_ticks import get_clock_ticks
 
 import numpy as np
 import labscript_utils.h5_lock, h5py
@@ -61,6 +65,24 @@ def add_instruction_to_bytearray(data, instruction, on, off, reps):
     data[offset+13] = reps[0]
     data[offset+14] = reps[3]
     data[offset+15] = reps[2]   
+
+# The layout of an instruction in the byte stream written to the FPGA: each
+# field is split into 16-bit little endian words, most significant word first.
+# This is the same layout as written by add_instruction_to_bytearray:
+PIPE_INSTRUCTION_DTYPE = np.dtype([('on_period', '<u2', 3), ('off_period', '<u2', 3), ('reps', '<u2', 2)])
+
+# Protocol of the upload image of the pulse program, written to pipe 0x80:
+PIPE_PROTOCOL = 'cicero-pipe-1'
+
+def pulse_program_to_bytearray(pulse_program):
+    # converts a PULSE_PROGRAM table to the byte stream written to the FPGA, 16 bytes per instruction
+    data = np.empty(len(pulse_program), dtype=PIPE_INSTRUCTION_DTYPE)
+    for name in ['on_period', 'off_period', 'reps']:
+        n_words = PIPE_INSTRUCTION_DTYPE[name].shape[0]
+        shifts = 16 * np.arange(n_words - 1, -1, -1, dtype=np.uint64)
+        values = pulse_program[name].astype(np.uint64)
+        data[name] = (values[:, np.newaxis] >> shifts) & 0xFFFF
+    return bytearray(data.tobytes())
     
         
 # Define a CiceroOpalKellyXEM3001Clock that only accepts one child clockline
@@ -247,7 +269,9 @@ class CiceroOpalKellyXEM3001(PseudoclockDevice):
             pulse_program[i]['on_period'] = instruction['on']
             pulse_program[i]['off_period'] = instruction['off']
             pulse_program[i]['reps'] = instruction['reps']
-        group.create_dataset('PULSE_PROGRAM', compression = config.compression, data=pulse_program)
+        create_dataset_with_digest(group, 'PULSE_PROGRAM', pulse_program, compression=config.compression)
+        # and the byte stream written to the FPGA:
+        create_upload_image(group, 'UPLOAD_IMAGE', pulse_program_to_bytearray(pulse_program), PIPE_PROTOCOL)
         
         self.set_property('is_master_pseudoclock', self.is_master_pseudoclock, location='device_properties')
         self.set_property('stop_time', self.stop_time, location='device_properties')
@@ -263,15 +287,10 @@ class RunviewerClass(object):
         self.device = device
         
             
+    @cached_traces
     def get_traces(self, add_trace, clock=None):
         if clock is not None:
-            times, clock_value = clock[0], clock[1]
-            clock_indices = np.where((clock_value[1:]-clock_value[:-1])==1)[0]+1
-            # If initial clock value is 1, then this counts as a rising edge (clock should be 0 before experiment)
-            # but this is not picked up by the above code. So we insert it!
-            if clock_value[0] == 1:
-                clock_indices = np.insert(clock_indices, 0, 0)
-            clock_ticks = times[clock_indices]
+            clock_ticks = get_clock_ticks(clock)
 
         
             
@@ -345,7 +364,7 @@ class CiceroOpalKellyXEM3001Tab(DeviceTab):
         self.primary_worker = "main_worker"
         
         # Set the capabilities of this device
-        self.supports_smart_programming(False) 
+        self.supports_smart_programming(True) 
         
         # Add button to force reflash
         self.flash_fpga_button = QPushButton('Flash FPGA firmware (this should be handled automatically by BLACS, if the device is not working correctly, try this button!)')
@@ -453,6 +472,11 @@ class CiceroOpalKellyXEM3001Worker(Worker):
         self.h5_file = None
     
         self.current_value = 0
+
+        # The pulse program and byte stream last written to the FPGA, so that
+        # unchanged programs are neither re-read from the shot file nor re-written:
+        self.table_cache = TableCache()
+        self.programmed_data = None
     
         # Initialise connection to OPAL KELLY Board
         self.dev = ok.okCFrontPanel()
@@ -481,6 +505,9 @@ class CiceroOpalKellyXEM3001Worker(Worker):
             raise RuntimeError('Cannot flash the FPGA for the current reference clock configuration as the .bit file is missing. Please ensure the correct bit file is available at %s'%fpga_path)
             
         self.logger.debug('Flashing FPGA bit file located at: %s'%fpga_path)
+        # Flashing clears the program memory:
+        self.table_cache.clear()
+        self.programmed_data = None
         self.dev.ConfigureFPGA(fpga_path)
         assert self.dev.IsFrontPanelEnabled(), 'Flashing of the FPGA failed. The device is not configured with the .bit file correctly'
 
@@ -508,7 +535,12 @@ class CiceroOpalKellyXEM3001Worker(Worker):
             
             # main data
             group = hdf5_file['devices/%s'%device_name]
-            pulse_program = group['PULSE_PROGRAM'][:]
+            # not re-read if unchanged since it was last programmed
+            pulse_program, pulse_program_changed = self.table_cache.read(group['PULSE_PROGRAM'], fresh)
+            # byte stream packed at compile time, if the shot file has it:
+            upload_image = None
+            if pulse_program_changed:
+                upload_image = read_upload_image(group, 'UPLOAD_IMAGE', PIPE_PROTOCOL)
             device_properties = labscript_utils.properties.get(hdf5_file, device_name, 'device_properties')
             self.connection_table_properties = labscript_utils.properties.get(hdf5_file, device_name, 'connection_table_properties')
             self.is_master_pseudoclock = device_properties['is_master_pseudoclock']
@@ -532,13 +564,18 @@ class CiceroOpalKellyXEM3001Worker(Worker):
         if self.wait_table is not None and not self.is_master_pseudoclock:
             raise RuntimeError('Something has gone wrong in labscript. You should not be able to configure this device as the wait monitor while it is a secondary pseudoclock. Please contact the developers on the mailing list.')
                 
-        # Create empty data array
-        data = bytearray(len(pulse_program)*16)
-        for i, instruction in enumerate(pulse_program):
-            add_instruction_to_bytearray(data, i, instruction['on_period'], instruction['off_period'], instruction['reps'])
-        
-        # program the FPGA
-        assert self.dev.WriteToPipeIn(0x80, data) == len(data)
+        # program the FPGA, unless the byte stream is identical to the one
+        # already written
+        if pulse_program_changed:
+            if upload_image is not None:
+                data = bytearray(upload_image)
+            else:
+                data = pulse_program_to_bytearray(pulse_program)
+            if fresh or data != self.programmed_data:
+                self.programmed_data = None
+                assert self.dev.WriteToPipeIn(0x80, data) == len(data)
+                self.programmed_data = data
+        self.table_cache.programmed()
 
         # If not the master pseudoclock, then we need to start the device
         # now so that the internal state machine can hit the first wait 
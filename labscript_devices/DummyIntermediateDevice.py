@@ -44,13 +44,21 @@ Usage
     start()
     stop(1)
 
+For load testing BLACS, the BLACS worker can emulate the time hardware takes to
+program and read back, and save synthetic acquired data of a given size to the
+shot file, see :class:`DummyIntermediateDevice`. Together with the
+`time_compression` of the
+:class:`~labscript_devices.DummyPseudoclock.labscript_devices.DummyPseudoclock`,
+this runs shots through BLACS at realistic table sizes much faster than in real
+time.
+
 Detailed Documentation
 ~~~~~~~~~~~~~~~~~~~~~~
 
 """
 
 from labscript_devices import labscript_device, BLACS_tab, BLACS_worker
-from labscript import IntermediateDevice, DigitalOut, AnalogOut, config
+from labscript import IntermediateDevice, DigitalOut, AnalogOut, config, set_passed_properties
 import numpy as np
 
 class DummyIntermediateDevice(IntermediateDevice):
@@ -61,7 +69,32 @@ class DummyIntermediateDevice(IntermediateDevice):
     # If this is updated, then you need to update generate_code to support whatever types you add
     allowed_children = [DigitalOut, AnalogOut]
 
-    def __init__(self, name, parent_device, BLACS_connection='dummy_connection', **kwargs):
+    @set_passed_properties(
+        property_names={
+            "device_properties": ["upload_latency", "readback_latency", "acquisition_samples"]
+        }
+    )
+    def __init__(self, name, parent_device, BLACS_connection='dummy_connection',
+                 upload_latency=0, readback_latency=0, acquisition_samples=0, **kwargs):
+        """Dummy intermediate device, for testing labscript and BLACS without
+        hardware.
+
+        Args:
+            name (str): python variable name to assign to the device.
+            parent_device (:class:`~labscript.ClockLine`): Clockline clocking
+                the device.
+            BLACS_connection (str, optional): Name of the BLACS tab.
+            upload_latency (float, optional): Time in seconds that the BLACS
+                worker waits in `transition_to_buffered` after reading the
+                output table, emulating programming the hardware.
+            readback_latency (float, optional): Time in seconds that the BLACS
+                worker waits in `transition_to_manual`, emulating reading back
+                from the hardware.
+            acquisition_samples (int, optional): Number of samples of synthetic
+                float64 data the BLACS worker saves to the dataset
+                ``data/<name>/acquisition`` of the shot file in
+                `transition_to_manual`. If zero, none is saved.
+        """
         self.BLACS_connection = BLACS_connection
         IntermediateDevice.__init__(self, name, parent_device, **kwargs)
 
@@ -102,15 +135,43 @@ class DummyIntermediateDeviceTab(DeviceTab):
 
 class DummyIntermediateDeviceWorker(Worker):
     def init(self):
-        pass
+        global time; import time
+        global h5py; import labscript_utils.h5_lock, h5py
+        global properties; import labscript_utils.properties as properties
+        self.h5file = None
+        self.acquisition = np.zeros(0)
 
     def program_manual(self, front_panel_values):
         return front_panel_values 
 
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
+        self.h5file = h5file
+        self.data_group = 'data/%s' % device_name
+        with h5py.File(h5file, 'r') as f:
+            # Simulation settings, absent in shot files compiled before they existed:
+            props = properties.get(f, device_name, 'device_properties')
+            upload_latency = props.get('upload_latency', 0)
+            self.readback_latency = props.get('readback_latency', 0)
+            acquisition_samples = props.get('acquisition_samples', 0)
+            # Read the output table as hardware would be programmed with it:
+            group = f['devices'][device_name]
+            if 'OUTPUTS' in group:
+                self.outputs = group['OUTPUTS'][:]
+        if len(self.acquisition) != acquisition_samples:
+            # Generated once and reused, so that saving it costs what saving
+            # acquired data would, but generating it costs nothing per shot:
+            self.acquisition = np.random.default_rng().normal(size=acquisition_samples)
+        time.sleep(upload_latency)
         return initial_values
 
     def transition_to_manual(self,abort = False):
+        if not abort:
+            time.sleep(self.readback_latency)
+            if len(self.acquisition):
+                with h5py.File(self.h5file, 'r+') as f:
+                    group = f.require_group(self.data_group)
+                    group.create_dataset('acquisition', data=self.acquisition)
+        self.h5file = None
         return True
 
     def abort_transition_to_buffered(self):
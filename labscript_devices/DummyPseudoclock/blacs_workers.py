@@ -25,20 +25,31 @@ class DummyPseudoclockWorker(Worker):
         with h5py.File(h5file, 'r') as f:
             props = properties.get(f, self.device_name, 'device_properties')
             self.stop_time = props.get('stop_time', None) # stop_time may be absent if we are not the master pseudoclock
+            # Simulation settings, absent in shot files compiled before they existed:
+            self.time_compression = props.get('time_compression', 1)
+            self.readback_latency = props.get('readback_latency', 0)
+            upload_latency = props.get('upload_latency', 0)
+            # Read the instructions as hardware would be programmed with them:
+            self.pulse_program = f['devices'][self.device_name]['PULSE_PROGRAM'][:]
+        time.sleep(upload_latency)
         return {}
-    
+
     def check_if_done(self):
         # Wait up to 1 second for the shot to be done, returning True if it is
-        # or False if not.
+        # or False if not. The shot lasts stop_time, compressed by
+        # time_compression.
         if getattr(self, 'start_time', None) is None:
             self.start_time = time.time()
-        timeout = min(self.start_time + self.stop_time - time.time(), 1)
+        duration = self.stop_time / self.time_compression
+        timeout = min(self.start_time + duration - time.time(), 1)
         if timeout < 0:
             return True
         time.sleep(timeout)
-        return self.start_time + self.stop_time < time.time()
+        return self.start_time + duration < time.time()
 
-    def transition_to_manual(self):
+    def transition_to_manual(self, abort=False):
+        if not abort:
+            time.sleep(self.readback_latency)
         self.start_time = None
         self.stop_time = None
         return True
@@ -47,4 +58,4 @@ class DummyPseudoclockWorker(Worker):
         return
 
     def abort_buffered(self):
-        return self.transition_to_manual()
+        return self.transition_to_manual(True)
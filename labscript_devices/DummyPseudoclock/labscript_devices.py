@@ -15,7 +15,14 @@
 # and labscript. The device is a PseudoclockDevice, and can be the sole device
 # in a connection table or experiment.
 
-from labscript import PseudoclockDevice, Pseudoclock, ClockLine, config, LabscriptError
+from labscript import (
+    PseudoclockDevice,
+    Pseudoclock,
+    ClockLine,
+    config,
+    LabscriptError,
+    set_passed_properties,
+)
 import numpy as np
 
 class _DummyPseudoclock(Pseudoclock):    
@@ -39,9 +46,44 @@ class DummyPseudoclock(PseudoclockDevice):
     allowed_children = [_DummyPseudoclock]
     max_instructions = 1e5
 
+    @set_passed_properties(
+        property_names={
+            "device_properties": [
+                "time_compression",
+                "upload_latency",
+                "readback_latency",
+            ]
+        }
+    )
     def __init__(
-        self, name='dummy_pseudoclock', BLACS_connection='dummy_connection', **kwargs
+        self,
+        name='dummy_pseudoclock',
+        BLACS_connection='dummy_connection',
+        time_compression=1,
+        upload_latency=0,
+        readback_latency=0,
+        **kwargs
     ):
+        """Dummy pseudoclock, for testing labscript and BLACS without hardware.
+
+        Args:
+            name (str): python variable name to assign to the pseudoclock.
+            BLACS_connection (str, optional): Name of the BLACS tab.
+            time_compression (float, optional): Factor by which shots run faster
+                than in real time in BLACS: a shot with a stop time of 10 s
+                completes after 10 ms with `time_compression=1000`, for load
+                testing the rest of the device stack at realistic shot lengths.
+            upload_latency (float, optional): Time in seconds that the BLACS
+                worker waits in `transition_to_buffered`, emulating programming
+                the hardware.
+            readback_latency (float, optional): Time in seconds that the BLACS
+                worker waits in `transition_to_manual`, emulating reading back
+                from the hardware.
+        """
+        if not time_compression > 0:
+            raise LabscriptError(
+                "time_compression must be > 0, not %s" % str(time_compression)
+            )
         self.BLACS_connection = BLACS_connection
         PseudoclockDevice.__init__(self, name, None, None, **kwargs)
         self._pseudoclock = _DummyPseudoclock(
@@ -2,6 +2,8 @@ import labscript_utils.h5_lock  # noqa: F401
 import h5py
 import numpy as np
 
+from labscript_devices.clock_ticks import get_clock_ticks
+
 
 class DummyPseudoclockParser(object):
     clock_resolution = 25e-9
@@ -15,14 +17,7 @@ class DummyPseudoclockParser(object):
 
     def get_traces(self, add_trace, clock=None):
         if clock is not None:
-            times, clock_value = clock[0], clock[1]
-            clock_indices = np.where((clock_value[1:] - clock_value[:-1]) == 1)[0] + 1
-            # If initial clock value is 1, then this counts as a rising edge
-            # (clock should be 0 before experiment) but this is not picked up
-            # by the above code. So we insert it!
-            if clock_value[0] == 1:
-                clock_indices = np.insert(clock_indices, 0, 0)
-            clock_ticks = times[clock_indices]
+            clock_ticks = get_clock_ticks(clock)
 
         # get the pulse program
         with h5py.File(self.path, 'r') as f:
@@ -21,6 +21,7 @@ from labscript_utils import dedent
 from enum import IntEnum
 
 from labscript_devices.IMAQdxCamera.blacs_workers import IMAQdxCameraWorker
+from labscript_devices.IMAQdxCamera.pixel_formats import PackedFrame
 
 # Don't import API yet so as not to throw an error, allow worker to run as a dummy
 # device, or for subclasses to import this module to inherit classes without requiring API
@@ -46,9 +47,15 @@ class FlyCapture2_Camera(object):
             Used by :obj:`_decode_image_data` to format images correctly.
         pixelFormat (str): Pixel format name for most recent acquisition.
             Used by :obj:`_decode_image_data` to format images correctly.
+        keep_packed (bool): Whether :obj:`_decode_image_data` returns images in
+            packed pixel formats as :obj:`PackedFrame` objects rather than unpacking
+            them.
         _abort_acquisition (bool): Abort flag that is polled during buffered
             acquisitions.
     """
+    # Packed FlyCapture2 pixel formats and their equivalent GigE Vision formats:
+    packed_pixel_formats = {'MONO12': 'Mono12Packed'}
+
     def __init__(self, serial_number):
         """Initialize FlyCapture2 API camera.
         
@@ -92,6 +99,8 @@ class FlyCapture2_Camera(object):
 
         self._abort_acquisition = False
         self.exception_on_failed_shot = True
+        # Whether to return frames in packed pixel formats without unpacking them:
+        self.keep_packed = False
 
         # check if GigE camera. If so, ensure max packet size is used
         cam_info = self.camera.getCameraInfo()
@@ -422,7 +431,14 @@ class FlyCapture2_Camera(object):
                 and :obj:`pixelFormat`.
         """
         pix_fmt = self.pixelFormat
-        if pix_fmt.startswith('MONO'):
+        if pix_fmt in self.packed_pixel_formats:
+            frame = PackedFrame(
+                np.frombuffer(img, dtype=np.uint8).copy(),
+                self.packed_pixel_formats[pix_fmt],
+                (self.height, self.width),
+            )
+            return frame if self.keep_packed else frame.unpack()
+        elif pix_fmt.startswith('MONO'):
             if pix_fmt.endswith('8'):
                 dtype = 'uint8'
             else:
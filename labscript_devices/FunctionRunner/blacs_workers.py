@@ -11,14 +11,21 @@
 #                                                                   #
 #####################################################################
 import os
+import threading
+import traceback
 from time import monotonic
 import numpy as np
 import labscript_utils.h5_lock
+import labscript_utils.properties
+from labscript_utils.ls_zprocess import Lock
+from labscript_utils.shared_drive import path_to_agnostic
 from labscript_utils.shot_utils import get_shot_globals
 import h5py
+import zmq
 from blacs.tab_base_classes import Worker
 import runmanager.remote
 from zprocess import rich_print
+from labscript_utils import dedent
 from .utils import deserialise_function
 
 BLUE = '#66D9EF'
@@ -26,6 +33,10 @@ PURPLE = '#AE81FF'
 GREEN = '#A6E22E'
 GREY = '#75715E' 
 
+# How long in seconds asynchronous stop functions may hold the lock on the shot file,
+# if stop_functions_timeout is not set:
+DEFAULT_STOP_FUNCTIONS_LOCK_TIMEOUT = 60
+
 def deserialise_function_table(function_table, device_name):
     table = []
     for t, name, source, args, kwargs in function_table:
@@ -51,13 +62,36 @@ class ShotContext(object):
         self.globals = get_shot_globals(h5_file)
 
 
+def run_stop_functions(function_table, shot_context):
+    rich_print("[running stop functions]", color=PURPLE)
+    while function_table:
+        t, name, function, args, kwargs = function_table.pop(0)
+        assert t == 'stop'
+        rich_print(f"  t={t}: {name}()",color=BLUE)
+        function(shot_context, t, *args, **kwargs)
+    rich_print("[finished stop functions]", color=PURPLE)
+
+
 class FunctionRunnerWorker(Worker):
+    def init(self):
+        self.function_table = None
+        # For running stop functions asynchronously:
+        self.stop_functions_thread = None
+        self.stop_functions_error = None
+        self.stop_functions_deadline = None
+
     def program_manual(self, values):
         return {}
 
     def transition_to_buffered(self, device_name, h5_file, initial_values, fresh):
+        self.wait_for_stop_functions()
         rich_print(f"====== new shot: {os.path.basename(h5_file)} ======", color=GREEN)
         with h5py.File(h5_file, 'r') as f:
+            properties = labscript_utils.properties.get(
+                f, self.device_name, 'device_properties'
+            )
+            self.async_stop_functions = properties.get('async_stop_functions', False)
+            self.stop_functions_timeout = properties.get('stop_functions_timeout', None)
             group = f[f'devices/{self.device_name}']
             if 'FUNCTION_TABLE' not in group:
                 self.function_table = None
@@ -89,18 +123,90 @@ class FunctionRunnerWorker(Worker):
         elif not self.function_table:
             rich_print("no stop functions", color=GREY)
             return True
-        rich_print("[running stop functions]", color=PURPLE)
-        while self.function_table:
-            t, name, function, args, kwargs = self.function_table.pop(0)
-            assert t == 'stop'
-            rich_print(f"  t={t}: {name}()",color=BLUE)
-            function(self.shot_context, t, *args, **kwargs)
-        rich_print("[finished stop functions]", color=PURPLE)
-
+        if self.async_stop_functions:
+            self.start_stop_functions_thread()
+        else:
+            run_stop_functions(self.function_table, self.shot_context)
         return True
 
+    def start_stop_functions_thread(self):
+        """Run the stop functions in a thread, returning once the thread holds the
+        lock on the shot file"""
+        function_table, self.function_table = self.function_table, []
+        if self.stop_functions_timeout is not None:
+            self.stop_functions_deadline = monotonic() + self.stop_functions_timeout
+        else:
+            self.stop_functions_deadline = None
+        lock_acquired = threading.Event()
+        self.stop_functions_thread = threading.Thread(
+            target=self.stop_functions_thread_mainloop,
+            args=(function_table, self.shot_context, lock_acquired),
+            daemon=True,
+        )
+        self.stop_functions_thread.start()
+        lock_acquired.wait()
+
+    def stop_functions_thread_mainloop(self, function_table, shot_context, lock_acquired):
+        # Hold the same lock on the shot file as h5_lock does whenever the file is open.
+        # Other processes opening the shot file, such as lyse, will then wait until the
+        # results of the stop functions have been saved. The lock is re-entrant within
+        # a thread, so the stop functions, running in this thread, can still open it.
+        # So that a slow or hung stop function cannot block BLACS, lyse and other
+        # programs needing the shot file indefinitely, the lock is acquired with a
+        # timeout, after which the zlock server releases it even if the stop functions
+        # are still running:
+        if self.stop_functions_timeout is not None:
+            lock_timeout = self.stop_functions_timeout
+        else:
+            lock_timeout = DEFAULT_STOP_FUNCTIONS_LOCK_TIMEOUT
+        try:
+            lock = Lock(path_to_agnostic(shot_context.h5_file))
+            lock.acquire(timeout=lock_timeout)
+        except Exception as e:
+            self.stop_functions_error = e
+            lock_acquired.set()
+            return
+        lock_acquired.set()
+        try:
+            run_stop_functions(function_table, shot_context)
+        except Exception as e:
+            traceback.print_exc()
+            self.stop_functions_error = e
+        finally:
+            try:
+                lock.release()
+            except zmq.ZMQError as e:
+                if 'not held' not in str(e):
+                    raise
+                msg = f"""Stop functions took longer than {lock_timeout}s, and the
+                    lock on the shot file was released before they finished. Other
+                    programs may have opened it before their results were saved."""
+                self.logger.warning(dedent(msg))
+
+    def wait_for_stop_functions(self):
+        """If stop functions of the previous shot are running asynchronously, wait
+        for them to finish, or until their timeout has elapsed, and raise an exception
+        if they raised one or did not finish in time"""
+        thread = self.stop_functions_thread
+        if thread is None:
+            return
+        if self.stop_functions_deadline is None:
+            thread.join()
+        else:
+            thread.join(max(self.stop_functions_deadline - monotonic(), 0))
+        if thread.is_alive():
+            msg = f"""Stop functions of the previous shot did not finish within
+                stop_functions_timeout={self.stop_functions_timeout}s"""
+            raise RuntimeError(dedent(msg))
+        self.stop_functions_thread = None
+        error, self.stop_functions_error = self.stop_functions_error, None
+        if error is not None:
+            msg = "A stop function of the previous shot raised an exception"
+            raise RuntimeError(msg) from error
+
     def shutdown(self):
-        return
+        if self.stop_functions_thread is not None:
+            self.stop_functions_thread.join(self.stop_functions_timeout)
 
     def abort_buffered(self):
         return self.transition_to_manual()
@@ -1,5 +1,5 @@
 import numpy as np
-from labscript import Device
+from labscript import Device, set_passed_properties
 from labscript_utils import dedent
 import labscript_utils.h5_lock, h5py
 from .utils import serialise_function
@@ -7,9 +7,46 @@ from .utils import serialise_function
 
 class FunctionRunner(Device):
     """A labscript device to run custom functions before, after, or during (not yet
-    implemented) the experiment in software time"""
-
-    def __init__(self, name, **kwargs):
+    implemented) the experiment in software time.
+
+    Functions added to run at t='stop' run during the transition to manual mode of
+    this device, unless `async_stop_functions` is True, in which case they run after
+    `transition_to_manual` has returned, concurrently with the transitions of other
+    devices and with BLACS moving on to the next shot."""
+
+    @set_passed_properties(
+        property_names={
+            "device_properties": ["async_stop_functions", "stop_functions_timeout"]
+        }
+    )
+    def __init__(
+        self, name, async_stop_functions=False, stop_functions_timeout=None, **kwargs
+    ):
+        """
+        Args:
+            name (str): device name.
+            async_stop_functions (bool, optional): If True, functions added to run at
+                t='stop' are run in a separate thread, and transition_to_manual returns
+                without waiting for them, allowing devices with a later `stop_order`
+                to transition to manual mode and BLACS to move on. The functions
+                therefore run after `transition_to_manual` has returned. The shot
+                file remains locked until the functions have completed, so that their
+                results are saved to it before other programs such as lyse open it,
+                but for no longer than `stop_functions_timeout`, or 60 seconds if
+                that is None, after which the lock is released with a warning. The
+                next shot does not start until they have completed. Whilst the lock
+                is held, other devices cannot open the shot file either, so devices
+                that save data or timing to it in their transition to manual mode,
+                such as cameras and analog inputs, wait for the stop functions if they
+                transition with or after this device. Give this device a later
+                `stop_order` than such devices for the asynchronous stop functions to
+                shorten the shot cycle.
+            stop_functions_timeout (float, optional): If `async_stop_functions` is
+                True, how long in seconds the stop functions may take. If they are
+                still running after this time when the next shot starts, an exception
+                is raised instead of waiting for them. If None, wait indefinitely.
+            **kwargs: Further keyword arguments passed to :obj:`labscript.Device`.
+        """
         Device.__init__(self, name=name, parent_device=None, connection=None, **kwargs)
         self.functions = []
         self.BLACS_connection = name
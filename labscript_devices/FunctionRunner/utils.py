@@ -13,6 +13,7 @@
 
 import inspect
 import textwrap
+from functools import lru_cache
 from types import FunctionType
 from labscript_utils import dedent
 from labscript_utils.properties import serialise, deserialise
@@ -46,6 +47,15 @@ def serialise_function(function, *args, **kwargs):
     return function.__name__, source, args, kwargs
 
 
+@lru_cache(maxsize=256)
+def _compile_function(name, source):
+    """Compile the source of a function serialised by serialise_function. The result
+    is cached, keyed by the name and source of the function, so that functions run in
+    every shot are only parsed and compiled once. The code object is executed in a
+    fresh namespace for each shot, so no state is shared between shots."""
+    return compile(source, '<string>', 'exec', dont_inherit=True,)
+
+
 def deserialise_function(
     name, source, args, kwargs, __name__=None, __file__='<string>'
 ):
@@ -56,7 +66,7 @@ def deserialise_function(
         name = name.decode('utf8')
     args = deserialise(args)
     kwargs = deserialise(kwargs)
-    code = compile(source, '<string>', 'exec', dont_inherit=True,)
+    code = _compile_function(name, source)
     namespace = {'__name__': __name__, '__file__': __file__}
     exec(code, namespace)
     return namespace[name], args, kwargs
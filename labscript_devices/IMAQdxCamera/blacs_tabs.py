@@ -113,6 +113,11 @@ class IMAQdxCameraTab(DeviceTab):
     # Subclasses may override this to False if camera attributes should be set every
     # shot even if the same values have previously been set:
     use_smart_programming = True
+    # Time in seconds without a shot after which the worker restores the manual mode
+    # camera attributes and any continuous acquisition. Until then, the camera keeps the
+    # configuration of the last shot, so that consecutive shots need not reconfigure
+    # it. Subclasses may override this:
+    manual_mode_restore_delay = 2.0
 
     def initialise_GUI(self):
         layout = self.get_tab_layout()
@@ -214,6 +219,17 @@ class IMAQdxCameraTab(DeviceTab):
             'main_worker', self.worker_class, worker_initialisation_kwargs
         )
         self.primary_worker = "main_worker"
+        self.statemachine_timeout_add(500, self.restore_manual_mode)
+
+    @define_state(MODE_MANUAL, False, delete_stale_states=True)
+    def restore_manual_mode(self):
+        yield (
+            self.queue_work(
+                self.primary_worker,
+                'restore_manual_mode',
+                self.manual_mode_restore_delay,
+            )
+        )
 
     @define_state(MODE_MANUAL, queue_state_indefinitely=True, delete_stale_states=True)
     def update_attributes(self):
@@ -29,6 +29,13 @@ import zmq
 from labscript_utils.ls_zprocess import Context
 from labscript_utils.shared_drive import path_to_local
 from labscript_utils.properties import set_attributes
+from labscript_devices.worker_timing import timed
+from labscript_devices.sidecar_files import open_data_file
+from labscript_devices.IMAQdxCamera.pixel_formats import (
+    PIXEL_FORMAT_ATTR,
+    SHAPE_ATTR,
+    PackedFrame,
+)
 
 # Don't import nv yet so as not to throw an error, allow worker to run as a dummy
 # device, or for subclasses to import this module to inherit classes without requiring
@@ -258,10 +265,18 @@ class IMAQdxCameraWorker(Worker):
     # as an instantiation argument, otherwise they may reimplement get_camera():
     interface_class = IMAQdx_Camera
 
+    # Names of attributes whose values may change without being set by the worker,
+    # such as sensor temperatures. These are read every shot, whereas the other
+    # attributes saved to the shot file are read again only when the attributes set by
+    # the worker change. Subclasses may override this:
+    volatile_attributes = ()
+
     def init(self):
         self.camera = self.get_camera()
         print("Setting attributes...")
         self.smart_cache = {}
+        self.attribute_snapshot = None
+        self.attributes_exception = None
         self.set_attributes_smart(self.camera_attributes)
         self.set_attributes_smart(self.manual_mode_camera_attributes)
         print("Initialisation complete")
@@ -276,6 +291,10 @@ class IMAQdxCameraWorker(Worker):
         self.continuous_stop = threading.Event()
         self.continuous_thread = None
         self.continuous_dt = None
+        # Whether the manual mode attributes and any continuous acquisition are yet to
+        # be restored since the last shot, and when the shot ended:
+        self.manual_mode_pending = False
+        self.shot_end_time = None
         self.image_socket = Context().socket(zmq.REQ)
         self.image_socket.connect(
             f'tcp://{self.parent_host}:{self.image_receiver_port}'
@@ -308,9 +327,27 @@ class IMAQdxCameraWorker(Worker):
         attributes_dict = {name: self.camera.get_attribute(name) for name in names}
         return attributes_dict
 
+    def get_attributes_snapshot(self, visibility_level):
+        """Return a dict of the attributes of the camera for the given visibility
+        level, as get_attributes_as_dict() does. The values read are kept, and are
+        reused as long as the attributes set by set_attributes_smart(), and the number
+        of images the camera was configured to acquire, are the same as when they were
+        read. Attributes in self.volatile_attributes are always read anew."""
+        key = (visibility_level, self.n_images, dict(self.smart_cache))
+        if self.attribute_snapshot is None or self.attribute_snapshot[0] != key:
+            attributes = self.get_attributes_as_dict(visibility_level)
+            self.attribute_snapshot = (key, attributes)
+        else:
+            attributes = self.attribute_snapshot[1]
+            for name in self.volatile_attributes:
+                if name in attributes:
+                    attributes[name] = self.camera.get_attribute(name)
+        return dict(attributes)
+
     def get_attributes_as_text(self, visibility_level):
         """Return a string representation of the attributes of the camera for
         the given visibility level"""
+        self.restore_manual_mode()
         attrs = self.get_attributes_as_dict(visibility_level)
         # Format it nicely:
         lines = [f'    {repr(key)}: {repr(value)},' for key, value in attrs.items()]
@@ -320,12 +357,15 @@ class IMAQdxCameraWorker(Worker):
     def snap(self):
         """Acquire one frame in manual mode. Send it to the parent via
         self.image_socket. Wait for a response from the parent."""
+        self.restore_manual_mode()
         image = self.camera.snap()
         self._send_image_to_parent(image)
 
     def _send_image_to_parent(self, image):
         """Send the image to the GUI to display. This will block if the parent process
         is lagging behind in displaying frames, in order to avoid a backlog."""
+        if isinstance(image, PackedFrame):
+            image = image.unpack()
         metadata = dict(dtype=str(image.dtype), shape=image.shape)
         self.image_socket.send_json(metadata, zmq.SNDMORE)
         self.image_socket.send(image, copy=False)
@@ -350,6 +390,7 @@ class IMAQdxCameraWorker(Worker):
     def start_continuous(self, dt):
         """Begin continuous acquisition in a thread with minimum repetition interval
         dt"""
+        self.restore_manual_mode()
         assert self.continuous_thread is None
         self.camera.configure_acquisition()
         self.continuous_thread = threading.Thread(
@@ -360,6 +401,12 @@ class IMAQdxCameraWorker(Worker):
 
     def stop_continuous(self, pause=False):
         """Stop the continuous acquisition thread"""
+        if not pause and self.manual_mode_pending and self.continuous_thread is None:
+            # Continuous acquisition was paused for a shot and is yet to be resumed.
+            # Restore manual mode without resuming it:
+            self.continuous_dt = None
+            self.restore_manual_mode()
+            return
         assert self.continuous_thread is not None
         self.continuous_stop.set()
         self.continuous_thread.join()
@@ -374,13 +421,14 @@ class IMAQdxCameraWorker(Worker):
         if not pause:
             self.continuous_dt = None
 
+    @timed
     def transition_to_buffered(self, device_name, h5_filepath, initial_values, fresh):
         if getattr(self, 'is_remote', False):
             h5_filepath = path_to_local(h5_filepath)
         if self.continuous_thread is not None:
             # Pause continuous acquistion during transition_to_buffered:
             self.stop_continuous(pause=True)
-        with h5py.File(h5_filepath, 'r') as f:
+        with self.timing.span('read_shot_file'), h5py.File(h5_filepath, 'r') as f:
             group = f['devices'][self.device_name]
             if not 'EXPOSURES' in group:
                 return {}
@@ -396,31 +444,69 @@ class IMAQdxCameraWorker(Worker):
             self.stop_acquisition_timeout = properties['stop_acquisition_timeout']
             self.exception_on_failed_shot = properties['exception_on_failed_shot']
             saved_attr_level = properties['saved_attribute_visibility_level']
+            self.sidecar_data_files = properties.get('sidecar_data_files', False)
             self.camera.exception_on_failed_shot = self.exception_on_failed_shot
+            self.camera.keep_packed = properties.get('packed_images', False)
         # Only reprogram attributes that differ from those last programmed in, or all of
         # them if a fresh reprogramming was requested:
         if fresh:
             self.smart_cache = {}
-        self.set_attributes_smart(camera_attributes)
-        # Get the camera attributes, so that we can save them to the H5 file:
-        if saved_attr_level is not None:
-            self.attributes_to_save = self.get_attributes_as_dict(saved_attr_level)
-        else:
-            self.attributes_to_save = None
+            self.attribute_snapshot = None
+        with self.timing.span('program_attributes'):
+            self.set_attributes_smart(camera_attributes)
         print(f"Configuring camera for {self.n_images} images.")
         self.camera.configure_acquisition(continuous=False, bufferCount=self.n_images)
         self.images = []
+        self.attributes_to_save = None
+        self.attributes_exception = None
         self.acquisition_thread = threading.Thread(
-            target=self.camera.grab_multiple,
-            args=(self.n_images, self.images),
-            daemon=True,
+            target=self.acquire, args=(saved_attr_level,), daemon=True
         )
         self.acquisition_thread.start()
         return {}
 
+    def acquire(self, saved_attr_level):
+        """Target of the acquisition thread. Get the camera attributes, so that we can
+        save them to the H5 file, and then acquire the images of the shot. Getting the
+        attributes once the camera is armed keeps it out of transition_to_buffered.
+        Any images acquired in the meantime are buffered by the camera."""
+        if saved_attr_level is not None:
+            try:
+                self.attributes_to_save = self.get_attributes_snapshot(saved_attr_level)
+            except Exception as e:
+                # Raised in transition_to_manual, once acquisition is complete:
+                self.attributes_exception = e
+        self.camera.grab_multiple(self.n_images, self.images)
+
+    def restore_manual_mode(self, idle_time=0):
+        """Set the manual mode camera attributes and resume any continuous acquisition
+        paused for a shot, if this has not been done since the last shot ended, and it
+        ended at least idle_time seconds ago. Until then, the camera keeps the
+        configuration of the shot, so that consecutive shots need not reconfigure it.
+        Called periodically by the BLACS tab in manual mode, and before acting on
+        requests from the user."""
+        if not self.manual_mode_pending:
+            return
+        if perf_counter() - self.shot_end_time < idle_time:
+            return
+        self.manual_mode_pending = False
+        print("Setting manual mode camera attributes.\n")
+        self.set_attributes_smart(self.manual_mode_camera_attributes)
+        if self.continuous_dt is not None and self.continuous_thread is None:
+            # If continuous manual mode acquisition was in progress before the buffered
+            # run, resume it:
+            self.start_continuous(self.continuous_dt)
+
+    def defer_manual_mode(self):
+        """Restore manual mode once idle, see restore_manual_mode()"""
+        self.manual_mode_pending = True
+        self.shot_end_time = perf_counter()
+
+    @timed
     def transition_to_manual(self):
         if self.h5_filepath is None:
             print('No camera exposures in this shot.\n')
+            self.defer_manual_mode()
             return True
         assert self.acquisition_thread is not None
         self.acquisition_thread.join(timeout=self.stop_acquisition_timeout)
@@ -439,9 +525,17 @@ class IMAQdxCameraWorker(Worker):
         print("Stopping acquisition.")
         self.camera.stop_acquisition()
 
+        if self.attributes_exception is not None:
+            exception = self.attributes_exception
+            self.attributes_exception = None
+            self.abort()
+            raise RuntimeError("Failed to get camera attributes") from exception
+
         print(f"Saving {len(self.images)}/{len(self.exposures)} images.")
 
-        with h5py.File(self.h5_filepath, 'r+') as f:
+        with self.timing.span('save_images'), open_data_file(
+            self.h5_filepath, self.device_name, sidecar=self.sidecar_data_files
+        ) as f:
             # Use orientation for image path, device_name if orientation unspecified
             if self.orientation is not None:
                 image_path = 'images/' + self.orientation
@@ -473,21 +567,43 @@ class IMAQdxCameraWorker(Worker):
 
             # Save images to the HDF5 file:
             for (name, frametype), imagelist in images.items():
-                data = imagelist[0] if len(imagelist) == 1 else np.array(imagelist)
                 print(f"Saving frame(s) {name}/{frametype}.")
                 group = image_group.require_group(name)
+                if imagelist and isinstance(imagelist[0], PackedFrame):
+                    # Save the packed bytes, and how to unpack them:
+                    frames = [frame.data for frame in imagelist]
+                    data = frames[0] if len(frames) == 1 else np.array(frames)
+                    dset = group.create_dataset(
+                        frametype, data=data, compression='gzip'
+                    )
+                    dset.attrs[PIXEL_FORMAT_ATTR] = imagelist[0].pixel_format
+                    dset.attrs[SHAPE_ATTR] = imagelist[0].shape
+                    continue
+                data = imagelist[0] if len(imagelist) == 1 else np.array(imagelist)
+                # Save images in the camera's dtype, such as uint8 for 8 bit pixel
+                # formats, unless it is not an unsigned integer type:
+                if np.issubdtype(np.asarray(data).dtype, np.unsignedinteger):
+                    dtype = np.asarray(data).dtype
+                else:
+                    dtype = 'uint16'
                 dset = group.create_dataset(
-                    frametype, data=data, dtype='uint16', compression='gzip'
+                    frametype, data=data, dtype=dtype, compression='gzip'
                 )
                 # Specify this dataset should be viewed as an image
                 dset.attrs['CLASS'] = np.bytes_('IMAGE')
                 dset.attrs['IMAGE_VERSION'] = np.bytes_('1.2')
                 dset.attrs['IMAGE_SUBCLASS'] = np.bytes_('IMAGE_GRAYSCALE')
                 dset.attrs['IMAGE_WHITE_IS_ZERO'] = np.uint8(0)
+            self.timing.save(f)
 
         # If the images are all the same shape, send them to the GUI for display:
         try:
-            image_block = np.stack(self.images)
+            image_block = np.stack(
+                [
+                    image.unpack() if isinstance(image, PackedFrame) else image
+                    for image in self.images
+                ]
+            )
         except ValueError:
             print("Cannot display images in the GUI, they are not all the same shape")
         else:
@@ -500,12 +616,7 @@ class IMAQdxCameraWorker(Worker):
         self.h5_filepath = None
         self.stop_acquisition_timeout = None
         self.exception_on_failed_shot = None
-        print("Setting manual mode camera attributes.\n")
-        self.set_attributes_smart(self.manual_mode_camera_attributes)
-        if self.continuous_dt is not None:
-            # If continuous manual mode acquisition was in progress before the bufferd
-            # run, resume it:
-            self.start_continuous(self.continuous_dt)
+        self.defer_manual_mode()
         return True
 
     def abort(self):
@@ -523,9 +634,8 @@ class IMAQdxCameraWorker(Worker):
         self.h5_filepath = None
         self.stop_acquisition_timeout = None
         self.exception_on_failed_shot = None
-        # Resume continuous acquisition, if any:
-        if self.continuous_dt is not None and self.continuous_thread is None:
-            self.start_continuous(self.continuous_dt)
+        # Restore manual mode, including any continuous acquisition, once idle:
+        self.defer_manual_mode()
         return True
 
     def abort_buffered(self):
@@ -12,7 +12,8 @@
 #####################################################################
 import sys
 from labscript_utils import dedent
-from labscript import TriggerableDevice, set_passed_properties
+from labscript import TriggerableDevice, LabscriptError, set_passed_properties
+from labscript_devices.trigger_index import TriggerIndex
 import numpy as np
 import labscript_utils.h5_lock
 import h5py
@@ -35,7 +36,9 @@ class IMAQdxCamera(TriggerableDevice):
                 "camera_attributes",
                 "stop_acquisition_timeout",
                 "exception_on_failed_shot",
-                "saved_attribute_visibility_level"
+                "saved_attribute_visibility_level",
+                "sidecar_data_files",
+                "packed_images",
             ],
         }
     )
@@ -56,6 +59,8 @@ class IMAQdxCamera(TriggerableDevice):
         stop_acquisition_timeout=5.0,
         exception_on_failed_shot=True,
         saved_attribute_visibility_level='intermediate',
+        sidecar_data_files=False,
+        packed_images=False,
         mock=False,
         **kwargs
     ):
@@ -146,6 +151,24 @@ class IMAQdxCamera(TriggerableDevice):
                 `'simple'`, `'intermediate'`, `'advanced'`, or `None`. If `None`, no
                 attributes will be saved.
 
+            sidecar_data_files (bool), default: `False`
+                Save images to a file of their own next to the shot file, with links
+                to them added to the shot file, so that saving large images does not
+                hold up other devices saving data to the shot file. The images are
+                accessed via the shot file as usual. See
+                :mod:`labscript_devices.sidecar_files`.
+
+            packed_images (bool), default: `False`
+                If the camera's pixel format, set in `camera_attributes`, packs 10 or
+                12 bit pixels into fewer bytes than 16 bits each, such as `'Mono12p'`,
+                save the packed bytes rather than unpacking the images. The dataset
+                attributes `'pixel_format'` and `'image_shape'` record how to unpack
+                them, and
+                :func:`labscript_devices.IMAQdxCamera.pixel_formats.read_image` returns
+                the unpacked images. Supported by the Pylon, Spinnaker and FlyCapture2
+                cameras. Otherwise, images are saved in the dtype in which the camera
+                returns them, such as uint8 for 8 bit pixel formats.
+
             mock (bool, optional), default: False
                 For testing purpses, simulate a camera with fake data instead of
                 communicating with actual hardware.
@@ -183,6 +206,66 @@ class IMAQdxCamera(TriggerableDevice):
         self.exposures = []
         TriggerableDevice.__init__(self, name, parent_device, connection, **kwargs)
 
+    def _shares_trigger_with_other_devices(self):
+        # Whether devices other than IMAQdxCameras are attached to the same trigger.
+        # Their triggers are only recorded by TriggerableDevice, not in the index:
+        return any(
+            not isinstance(device, IMAQdxCamera)
+            for device in self.trigger_device.child_devices
+        )
+
+    def trigger(self, t, duration):
+        """Request parent trigger device to produce a trigger. This is equivalent to
+        `TriggerableDevice.trigger`, except that if only IMAQdxCameras are attached to
+        the trigger, triggers are checked against those of the other cameras using a
+        :class:`~labscript_devices.trigger_index.TriggerIndex`, rather than by linear
+        search.
+        """
+        if self._shares_trigger_with_other_devices():
+            TriggerableDevice.trigger(self, t, duration)
+            return
+        trigger_index = TriggerIndex.get(self.trigger_device)
+        # Only ask for a trigger if one has not already been requested by another device
+        # attached to the same trigger:
+        if not trigger_index.requested_by_other(self, t, duration):
+            self.trigger_device.trigger(t, duration)
+
+        # Check for triggers too close together (check for overlapping triggers already
+        # performed in Trigger.trigger()):
+        start = t
+        other = trigger_index.find_too_close(self, t, duration, self.minimum_recovery_time)
+        if other is not None:
+            other_start, other_duration = other
+            raise ValueError(
+                f"{self.description} {self.name} has two triggers closer together "
+                f"than the minimum recovery time: one at t = {start:.15f}s for "
+                f"{duration}s, and another at t = {other_start:.15f}s for "
+                f"{other_duration}s. "
+                f"The minimum recovery time is {self.minimum_recovery_time}s."
+            )
+        trigger_index.add(self, t, duration)
+
+    def do_checks(self):
+        """Check that all devices sharing a trigger device have triggers when this
+        device has a trigger. This is equivalent to `TriggerableDevice.do_checks`, but
+        if only IMAQdxCameras are attached to the trigger, takes linear rather than
+        quadratic time in the number of triggers."""
+        if self._shares_trigger_with_other_devices():
+            TriggerableDevice.do_checks(self)
+            return
+        trigger_index = TriggerIndex.get(self.trigger_device)
+        for device in self.trigger_device.child_devices:
+            if device is not self:
+                for start, _, _, duration in self.exposures:
+                    if not trigger_index.has(device, start, duration):
+                        raise LabscriptError(
+                            f"TriggerableDevices {self.name} and {device.name} share a "
+                            f"trigger. {self.name} has a trigger at {start}s for "
+                            f"{duration}s, but there is no matching trigger for "
+                            f"{device.name}. Devices sharing a trigger must have "
+                            "identical trigger times and durations."
+                        )
+
     def expose(self, t, name, frametype='frame', trigger_duration=None):
         """Request an exposure at the given time. A trigger will be produced by the
         parent trigger object, with duration trigger_duration, or if not specified, of
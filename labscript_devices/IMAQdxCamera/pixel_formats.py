@@ -0,0 +1,129 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/IMAQdxCamera/pixel_formats.py                  #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Packed pixel formats of cameras.
+
+Cameras with 10 and 12 bit sensors can transfer pixels packed into 1.25 or 1.5
+bytes rather than padded to 16 bits. Camera interface classes that support it
+return frames in these formats from `grab()` as :class:`PackedFrame` objects
+when their `keep_packed` attribute is set, and the camera worker saves their
+packed bytes to the shot file, with the attributes :data:`PIXEL_FORMAT_ATTR`
+and :data:`SHAPE_ATTR` recording how to unpack them. :func:`read_image` returns
+the image in a dataset of the shot file, unpacking it if necessary::
+
+    from labscript_devices.IMAQdxCamera.pixel_formats import read_image
+
+    with h5py.File(shot_file, 'r') as f:
+        image = read_image(f['images/side/absorption/atoms'])
+
+Supported formats are the GenICam pixel formats ``'Mono10p'`` and
+``'Mono12p'``, in which pixels are packed contiguously, least significant bit
+first, and the GigE Vision formats ``'Mono10Packed'`` and ``'Mono12Packed'``,
+in which pairs of pixels are packed into three bytes.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+PIXEL_FORMAT_ATTR = 'pixel_format'
+SHAPE_ATTR = 'image_shape'
+
+# Bits per pixel of each packed format, and the number of bytes and pixels in each
+# group of pixels packed together:
+PACKED_FORMATS = {
+    'Mono10p': (10, 5, 4),
+    'Mono12p': (12, 3, 2),
+    'Mono10Packed': (10, 3, 2),
+    'Mono12Packed': (12, 3, 2),
+}
+
+
+class PackedFrame(namedtuple('PackedFrame', ['data', 'pixel_format', 'shape'])):
+    """A frame in a packed pixel format.
+
+    Args:
+        data (numpy.ndarray): The packed bytes, as a 1D uint8 array.
+        pixel_format (str): The pixel format, a key of :data:`PACKED_FORMATS`.
+        shape (tuple): Shape of the unpacked image, `(height, width)`.
+    """
+
+    def unpack(self):
+        """Return the unpacked image as a uint16 array"""
+        return unpack(self.data, self.pixel_format, self.shape)
+
+
+def _unpack_groups(groups, pixel_format):
+    # groups is an array of shape (..., bytes per group), of dtype uint16 or wider
+    if pixel_format == 'Mono10p':
+        word = sum(groups[..., i].astype(np.uint64) << np.uint64(8 * i) for i in range(5))
+        pixels = [(word >> np.uint64(10 * i)) & np.uint64(0x3FF) for i in range(4)]
+    elif pixel_format == 'Mono12p':
+        b0, b1, b2 = groups[..., 0], groups[..., 1], groups[..., 2]
+        pixels = [b0 | ((b1 & 0xF) << 8), (b1 >> 4) | (b2 << 4)]
+    elif pixel_format == 'Mono10Packed':
+        b0, b1, b2 = groups[..., 0], groups[..., 1], groups[..., 2]
+        pixels = [(b0 << 2) | (b1 & 0x3), (b2 << 2) | ((b1 >> 4) & 0x3)]
+    elif pixel_format == 'Mono12Packed':
+        b0, b1, b2 = groups[..., 0], groups[..., 1], groups[..., 2]
+        pixels = [(b0 << 4) | (b1 & 0xF), (b2 << 4) | (b1 >> 4)]
+    else:
+        raise ValueError(f"Unsupported packed pixel format {pixel_format}")
+    return np.stack(pixels, axis=-1).astype(np.uint16)
+
+
+def unpack(data, pixel_format, shape):
+    """Unpack frames in a packed pixel format.
+
+    Args:
+        data (numpy.ndarray): Packed bytes of one or more frames, of dtype uint8,
+            and of shape `(..., n_bytes)`.
+        pixel_format (str): The pixel format, a key of :data:`PACKED_FORMATS`.
+        shape (tuple): Shape of each unpacked frame.
+
+    Returns:
+        numpy.ndarray: The unpacked frames, of dtype uint16 and of shape
+        `data.shape[:-1] + shape`.
+    """
+    try:
+        _, group_bytes, group_pixels = PACKED_FORMATS[pixel_format]
+    except KeyError:
+        raise ValueError(f"Unsupported packed pixel format {pixel_format}") from None
+    data = np.asarray(data, dtype=np.uint8)
+    leading_shape = data.shape[:-1]
+    n_pixels = int(np.prod(shape))
+    n_groups = -(-n_pixels // group_pixels)
+    frames = data.reshape(-1, data.shape[-1])[:, : n_groups * group_bytes]
+    if frames.shape[1] < n_groups * group_bytes:
+        # Pad the last group if the number of pixels is not a multiple of its size:
+        padding = n_groups * group_bytes - frames.shape[1]
+        frames = np.pad(frames, ((0, 0), (0, padding)))
+    groups = frames.reshape(len(frames), n_groups, group_bytes).astype(np.uint16)
+    pixels = _unpack_groups(groups, pixel_format).reshape(len(frames), -1)
+    return pixels[:, :n_pixels].reshape(leading_shape + tuple(shape))
+
+
+def read_image(dataset):
+    """Return the image or images in a dataset saved by a camera worker,
+    unpacking them if they were saved in a packed pixel format.
+
+    Args:
+        dataset (h5py.Dataset): The dataset.
+
+    Returns:
+        numpy.ndarray: The image, or images if several were saved in the dataset.
+    """
+    data = dataset[()]
+    pixel_format = dataset.attrs.get(PIXEL_FORMAT_ATTR, None)
+    if pixel_format is None:
+        return data
+    if isinstance(pixel_format, bytes):
+        pixel_format = pixel_format.decode('utf8')
+    return unpack(data, pixel_format, tuple(dataset.attrs[SHAPE_ATTR]))
@@ -0,0 +1,64 @@
+"""Benchmark of compiling many camera exposures.
+
+Compiles a shot with 10,000 exposures split across several cameras, half of them
+sharing a trigger with another camera, and prints the time taken to request the
+exposures and to generate the shot file. Run with:
+
+    python benchmark_exposures.py [n_exposures]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from labscript import *
+from labscript_devices.DummyPseudoclock.labscript_devices import DummyPseudoclock
+from labscript_devices.DummyIntermediateDevice import DummyIntermediateDevice
+from labscript_devices.IMAQdxCamera.labscript_devices import IMAQdxCamera
+
+N_EXPOSURES = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+# Cameras on each trigger. Cameras sharing a trigger take the same exposures:
+CAMERAS_PER_TRIGGER = [2, 2, 1, 1]
+
+with tempfile.TemporaryDirectory() as tempdir:
+    labscript_init(os.path.join(tempdir, 'benchmark.h5'), new=True, overwrite=True)
+
+    DummyPseudoclock('pseudoclock')
+    DummyIntermediateDevice('intermediatedevice', parent_device=pseudoclock.clockline)
+
+    cameras = []
+    for i, n_cameras in enumerate(CAMERAS_PER_TRIGGER):
+        trigger = Trigger('trigger_%d' % i, intermediatedevice, 'do%d' % i)
+        cameras.append(
+            [
+                IMAQdxCamera(
+                    'camera_%d_%d' % (i, j),
+                    trigger,
+                    'trigger',
+                    serial_number=0x1000 * i + j,
+                    minimum_recovery_time=1e-6,
+                    mock=True,
+                )
+                for j in range(n_cameras)
+            ]
+        )
+
+    start()
+    start_time = time.perf_counter()
+    n_per_camera = N_EXPOSURES // sum(CAMERAS_PER_TRIGGER)
+    for i, trigger_cameras in enumerate(cameras):
+        for k in range(n_per_camera):
+            # Interleave exposures on different triggers:
+            t = 1e-3 + 1e-4 * k + 1e-5 * i
+            for camera in trigger_cameras:
+                camera.expose(t, 'frame_%d' % k, trigger_duration=2e-6)
+    expose_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    stop(1e-3 + 1e-4 * n_per_camera + 1e-3)
+    compile_time = time.perf_counter() - start_time
+
+    n = n_per_camera * sum(CAMERAS_PER_TRIGGER)
+    print('%d exposures on %d cameras' % (n, sum(CAMERAS_PER_TRIGGER)))
+    print('expose():  %.3f s' % expose_time)
+    print('stop():    %.3f s' % compile_time)
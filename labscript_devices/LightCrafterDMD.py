@@ -15,13 +15,13 @@
 import base64
 import os
 import struct
-import PIL.Image
-from io import BytesIO
     
 import labscript_utils.h5_lock, h5py
 
 # LABSCRIPT_DEVICES IMPORTS
 from labscript_devices import labscript_device, BLACS_tab, BLACS_worker, runviewer_parser
+from labscript_devices.table_digest import create_dataset_with_digest, TableCache
+from labscript_devices.worker_timing import timed
 
 # LABSCRIPT IMPORTS
 from labscript import Device, IntermediateDevice, LabscriptError, Output, config
@@ -40,14 +40,42 @@ from qtutils.qt.QtGui import *
 from qtutils.qt.QtCore import pyqtSignal as Signal
 
 
+# Combined size of the file header, info header and palette of a 1 bit BMP, and
+# the resolution written by PIL, which BMPs were previously encoded with:
+BMP_HEADER_SIZE = 14 + 40 + 8
+BMP_PIXELS_PER_METRE = 3780
+# Palette of black for zero bits and white for one bits:
+BMP_PALETTE = b'\x00\x00\x00\x00\xff\xff\xff\x00'
+
+
 def arr_to_bmp(arr):
     """Convert array to 1 bit BMP, white wherever the array is nonzero, and return a
     bytestring of the BMP data"""
-    binary_arr = 255 * (arr != 0).astype(np.uint8)
-    im = PIL.Image.fromarray(binary_arr, mode='L').convert('1')
-    f = BytesIO()
-    im.save(f, "BMP")
-    return f.getvalue()
+    arr = np.asarray(arr)
+    height, width = arr.shape
+    # BMP rows are stored bottom up, with each padded to a multiple of four bytes:
+    row_length = -(-width // 32) * 4
+    pixels = np.zeros((height, row_length), dtype=np.uint8)
+    packed = np.packbits(arr[::-1] != 0, axis=1)
+    pixels[:, : packed.shape[1]] = packed
+    file_header = struct.pack(
+        '<2sIHHI', b'BM', BMP_HEADER_SIZE + pixels.size, 0, 0, BMP_HEADER_SIZE
+    )
+    info_header = struct.pack(
+        '<IiiHHIIiiII',
+        40,
+        width,
+        height,
+        1,
+        1,
+        0,
+        pixels.size,
+        BMP_PIXELS_PER_METRE,
+        BMP_PIXELS_PER_METRE,
+        2,
+        2,
+    )
+    return file_header + info_header + BMP_PALETTE + pixels.tobytes()
 
 
 WIDTH = 608
@@ -102,15 +130,22 @@ class ImageSet(Output):
             raise LabscriptError("Your image %s is bitdepth %s, but it needs to be 1 for DMD output %s. Please re-save image in appropriate format."%(path,bitdepth,self.name))
         self.add_instruction(t, raw_data)
             
-    def expand_timeseries(self,all_times):
+    def expand_timeseries(self, all_times, flat_all_times_len=None):
         """We have to override the usual expand_timeseries, as it sees strings as iterables that need flattening!
         Luckily for us, we should only ever have individual data points, as we won't be ramping or anything,
         so this function is a lot simpler than the original, as we have more information about the output.
-        
+
+        Each distinct image is stored once, in self.images, in order of first use, and
+        self.raw_output is the index into self.images of the image at each time.
+
         Not 100% sure that this is enough to cover ramps on other devices sharing the clock, come here if there are issues!
         """
-        
-        self.raw_output = np.array(self.timeseries)
+        indices = {}
+        self.raw_output = np.array(
+            [indices.setdefault(image, len(indices)) for image in self.timeseries],
+            dtype=np.uint32,
+        )
+        self.images = list(indices)
         return
         
         
@@ -148,10 +183,12 @@ class LightCrafterDMD(IntermediateDevice):
         if len(output.raw_output) > self.max_instructions:
             raise LabscriptError("Too many images for the LightCrafter. Your shot contains %s images"%len(output.raw_output))
           
-        # Apparently you should use np.void for binary data in a h5 file. Then on the way out, we need to use data.tostring() to decode again.
-        out_table = np.void(output.raw_output)
+        # Apparently you should use np.void for binary data in a h5 file. Then on the way out, we need to use data.tobytes() to decode again.
+        # Each distinct image is stored once, with the index of the image to display for each instruction:
+        images = np.void(np.array(output.images))
         grp = self.init_device_group(hdf5_file)
-        grp.create_dataset('IMAGE_TABLE',compression=config.compression,data=out_table)
+        create_dataset_with_digest(grp, 'IMAGES', images, compression=config.compression)
+        create_dataset_with_digest(grp, 'IMAGE_INDICES', output.raw_output)
         
 @BLACS_tab
 class LightCrafterTab(DeviceTab):
@@ -237,55 +274,121 @@ class LightCrafterWorker(Worker):
                     'pattern': b'\x04',
                     }
     # Packets must be in the form [packet type (1 bit), command (2), flags (1), payload length (2), data (N), checksum (1)]
+
+    # Timeout for connecting and for each response, in seconds:
+    timeout = 10
+    # A command the device reports it is too busy to accept is resent after a delay
+    # starting at busy_backoff_initial and doubling up to busy_backoff_max, until
+    # busy_timeout has passed, all in seconds:
+    busy_backoff_initial = 0.0005
+    busy_backoff_max = 0.05
+    busy_timeout = 10
     
     def init(self):
         global socket; import socket
+        global select; import select
         global struct; import struct
+        global time; import time
         self.host, self.port = self.server.split(':')
         self.port = int(self.port)
         self.smart_cache = {'IMAGE_TABLE': ''}
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((self.host,self.port))
+        self.table_cache = TableCache()
+        self.sock = None
+        self.connect()
         # Initialise it to a static image display
         self.send(self.send_packet_type['write'], self.command['display_mode'], self.display_mode['static'])
         
         # self.program_manual({"None" : base64.b64encode(blank_bmp)})
         
-        
-        
+    def connect(self):
+        """Open the connection to the device, if it is not already open and usable.
+        The connection is kept open across shots."""
+        if self.sock is not None:
+            # Between commands the device sends nothing, so the socket being readable
+            # means the device has closed the connection, and it can't be reused:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable:
+                self.close()
+        if self.sock is None:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+            # Send each command as soon as it is written rather than waiting on the
+            # acknowledgement of the last, which the device delays:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            self.sock = sock
+        
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
     
     def send(self, type, command, data):
         packet = b''.join([type,command,self.flag['complete'],struct.pack('<H',len(data)),data])
         packet += struct.pack('<B',sum(bytearray(packet)) % 256) # add the checksum
-        self.sock.send(packet)
-        return self.receive()
+        delay = self.busy_backoff_initial
+        busy_start = None
+        try:
+            while True:
+                self.connect()
+                self.sock.sendall(packet)
+                recv = self.receive()
+                if recv != 'System Busy':
+                    break
+                # The device did not accept the command, and is usually ready again
+                # within milliseconds, so retry with increasing delays:
+                now = time.monotonic()
+                if busy_start is None:
+                    busy_start = now
+                elif now - busy_start > self.busy_timeout:
+                    raise Exception('Device still busy after %s seconds' % self.busy_timeout)
+                time.sleep(delay)
+                delay = min(2 * delay, self.busy_backoff_max)
+        except:
+            # The connection may be part way through a packet, so it can't be reused:
+            self.close()
+            raise
+        finally:
+            if busy_start is not None and hasattr(self, 'timing'):
+                self.timing.record('device_busy', time.monotonic() - busy_start)
+        return recv
+        
+    def _recv_exactly(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError('Device closed the connection')
+            data += chunk
+        return data
         
     def _receive(self):
         # This function assumes that we are getting a fresh packet, i.e. there is nothing waiting in the buffer
         # First we get the header bits, to see how big the payload will be:
-        header = self.sock.recv(6)
+        self.sock.settimeout(self.timeout)
+        header = self._recv_exactly(6)
         pkt_type = self.receive_packet_type[header[0:1]]
         command = header[1:3]
         flag = header[3:4]
         length = struct.unpack('<H',header[4:6])[0]
-        body = self.sock.recv(length + 1)
+        body = self._recv_exactly(length + 1)
         checksum = body[-1:]
         body = body[:-1]
         return {'header' : header, 'type' : pkt_type, 'command' : command, 'flag' : flag, 'length' : length, 'body' : body, 'checksum' : checksum}
         
     def receive(self):
+        """Receive the response to a command. Returns 'System Busy' if the device did
+        not accept the command because it was busy, in which case it should be sent
+        again."""
         recv = self._receive()
         # Check the type
-        while recv['type'] == "System Busy":
-            # the system is busy, guess we should try again in 5 seconds?
-            time.sleep(5)
-            recv = self._receive()
+        if recv['type'] == "System Busy":
+            return recv['type']
             
         if recv['type'] == "Error":
             # We have an error
             errors = ""
             for e in recv['body']:
-                errors+= self.error_messages[e] + "\n"
+                errors+= self.error_messages.get(bytes([e]), "Unknown error %d" % e) + "\n"
             
             raise Exception("Error(s) in receive packet: %s"%errors)
         
@@ -301,7 +404,7 @@ class LightCrafterWorker(Worker):
         if recv['type'] == 'Write response':
             return True
         else:
-            return body
+            return recv['body']
     
     
     
@@ -322,11 +425,20 @@ class LightCrafterWorker(Worker):
         self.send(self.send_packet_type['write'], self.command['static_image'], data)
         return {}
         
+    @timed
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
+        table_data = None
         with h5py.File(h5file, 'r') as hdf5_file:
             group = hdf5_file['/devices/'+device_name]
-            if 'IMAGE_TABLE' in group:
-                table_data = group['IMAGE_TABLE'][:]
+            # Not re-read if unchanged since they were last programmed:
+            if 'IMAGES' in group:
+                images, images_changed = self.table_cache.read(group['IMAGES'], fresh)
+                indices, indices_changed = self.table_cache.read(group['IMAGE_INDICES'], fresh)
+                table_data = images[indices]
+                table_changed = images_changed or indices_changed
+            elif 'IMAGE_TABLE' in group:
+                # Shot files compiled before images were deduplicated:
+                table_data, table_changed = self.table_cache.read(group['IMAGE_TABLE'], fresh)
         
         
         if table_data is not None:
@@ -338,29 +450,32 @@ class LightCrafterWorker(Worker):
             
             # bit depth, number of patterns, invert patterns?, trigger type, trigger delay (4 bytes), trigger period (4 bytes), exposure time (4 bytes), led select
             self.send(self.send_packet_type['write'], self.command['sequence_setting'],  struct.pack('<BBBBiiiB',1,padded_num_of_patterns,0,2,0,0,0,0))
-            if fresh or len(oldtable)!=len(table_data) or (oldtable != table_data).any():
-                for i in range(padded_num_of_patterns):
-                    if i < num_of_patterns:
-                        im = table_data[i]
-                    else:
-                        # Padding uses the final image:
-                        im = table_data[-1]
-                    self.send(self.send_packet_type['write'], self.command['pattern_definition'], struct.pack('<B',i) + im.tostring())
+            if table_changed and (fresh or len(oldtable)!=len(table_data) or (oldtable != table_data).any()):
+                with self.timing.span('upload_patterns'):
+                    for i in range(padded_num_of_patterns):
+                        if i < num_of_patterns:
+                            im = table_data[i]
+                        else:
+                            # Padding uses the final image:
+                            im = table_data[-1]
+                        self.send(self.send_packet_type['write'], self.command['pattern_definition'], struct.pack('<B',i) + im.tobytes())
                 
             self.send(self.send_packet_type['write'], self.command['display_pattern'], struct.pack('<H',0))
             self.send(self.send_packet_type['write'], self.command['start_pattern_sequence'], struct.pack('<B',1))
             self.smart_cache['IMAGE_TABLE'] = table_data
+            self.table_cache.programmed()
             
             
         # if response != 'ok':
             # raise Exception('Failed to transition to manual. Message from server was: %s'%response)
             
         
-        self.final_value = {"None" : base64.b64encode(table_data[-1].tostring())}
+        self.final_value = {"None" : base64.b64encode(table_data[-1].tobytes())}
         
         return self.final_value
         
         
+    @timed
     def transition_to_manual(self):
         # Turn off sequence
         self.send(self.send_packet_type['write'], self.command['start_pattern_sequence'], struct.pack('<B',0))
@@ -379,4 +494,4 @@ class LightCrafterWorker(Worker):
         return self.abort()
         
     def shutdown(self):
-        self.sock.close()
+        self.close()
@@ -33,11 +33,18 @@ from blacs.tab_base_classes import Worker
 
 from .utils import split_conn_port, split_conn_DO, split_conn_AI
 from .daqmx_utils import incomplete_sample_detection
+from .reductions import AcquisitionReducer
+from ..table_digest import TableCache
+from ..worker_timing import timed
+from ..sidecar_files import open_data_file
 
 
 class NI_DAQmxOutputWorker(Worker):
     def init(self):
         self.check_version()
+        # Output tables are written to new tasks every shot, but tables unchanged
+        # since the previous shot need not be read from the shot file again:
+        self.table_cache = TableCache()
         # Reset Device: clears previously added routes etc. Note: is insufficient for
         # some devices, which require power cycling to truly reset.
         DAQmxResetDevice(self.MAX_name)
@@ -140,13 +147,14 @@ class NI_DAQmxOutputWorker(Worker):
         with h5py.File(h5file, 'r') as hdf5_file:
             group = hdf5_file['devices'][device_name]
             try:
-                AO_table = group['AO'][:]
+                AO_table, _ = self.table_cache.read(group['AO'])
             except KeyError:
                 AO_table = None
             try:
-                DO_table = group['DO'][:]
+                DO_table, _ = self.table_cache.read(group['DO'])
             except KeyError:
                 DO_table = None
+        self.table_cache.programmed()
         return AO_table, DO_table
 
     def set_mirror_clock_terminal_connected(self, connected):
@@ -324,6 +332,7 @@ class NI_DAQmxOutputWorker(Worker):
 
         return final_values
 
+    @timed
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
         # Store the initial values in case we have to abort and restore them:
         self.initial_values = initial_values
@@ -332,7 +341,8 @@ class NI_DAQmxOutputWorker(Worker):
         self.stop_tasks()
 
         # Get the data to be programmed into the output tasks:
-        AO_table, DO_table = self.get_output_tables(h5file, device_name)
+        with self.timing.span('read_shot_file'):
+            AO_table, DO_table = self.get_output_tables(h5file, device_name)
 
         # Mirror the clock terminal, if applicable:
         self.set_mirror_clock_terminal_connected(True)
@@ -341,8 +351,9 @@ class NI_DAQmxOutputWorker(Worker):
         self.set_connected_terminals_connected(True)
 
         # Program the output tasks and retrieve the final values of each output:
-        DO_final_values = self.program_buffered_DO(DO_table)
-        AO_final_values = self.program_buffered_AO(AO_table)
+        with self.timing.span('program'):
+            DO_final_values = self.program_buffered_DO(DO_table)
+            AO_final_values = self.program_buffered_AO(AO_table)
 
         final_values = {}
         final_values.update(DO_final_values)
@@ -355,6 +366,7 @@ class NI_DAQmxOutputWorker(Worker):
 
         return final_values
 
+    @timed
     def transition_to_manual(self, abort=False):
         # Stop output tasks and call program_manual. Only call StopTask if not aborting.
         # Otherwise results in an error if output was incomplete. If aborting, call
@@ -428,6 +440,13 @@ class NI_DAQmxAcquisitionWorker(Worker):
         self.acquired_data = None
         self.buffered_rate = None
         self.buffered_chans = None
+        # Reductions of acquisitions by label, and the reducers of those reduced as
+        # the data arrives, by label, along with their channel's column:
+        self.reductions = {}
+        self.reducers = {}
+        # Whether to keep every chunk of raw data, and how many samples were read:
+        self.keep_raw_data = True
+        self.samples_acquired = 0
 
         # Hard coded for now. Perhaps we will add functionality to enable
         # and disable inputs in manual mode, and adjust the rate:
@@ -466,8 +485,12 @@ class NI_DAQmxAcquisitionWorker(Worker):
             # Select only the data read, and downconvert to 32 bit:
             data = self.read_array[: int(samples_read.value), :].astype(np.float32)
             if self.buffered_mode:
+                for column, reducer in self.reducers.values():
+                    reducer.feed(data[:, column], self.samples_acquired)
+                self.samples_acquired += len(data)
                 # Append to the list of acquired data:
-                self.acquired_data.append(data)
+                if self.keep_raw_data:
+                    self.acquired_data.append(data)
             else:
                 # TODO: Send it to the broker thingy.
                 pass
@@ -548,16 +571,22 @@ class NI_DAQmxAcquisitionWorker(Worker):
             self.task = None
             self.read_array = None
 
+    @timed
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
         self.logger.debug('transition_to_buffered')
 
         # read channels, acquisition rate, etc from H5 file
-        with h5py.File(h5file, 'r') as f:
+        with self.timing.span('read_shot_file'), h5py.File(h5file, 'r') as f:
             group = f['/devices/' + device_name]
             if 'AI' not in group:
                 # No acquisition
                 return {}
             AI_table = group['AI'][:]
+            if 'AI_REDUCTIONS' in group:
+                AI_reductions = group['AI_REDUCTIONS'][:]
+            else:
+                AI_reductions = []
+            waits_in_use = len(f['waits']) > 0
             device_properties = properties.get(f, device_name, 'device_properties')
 
         chans = [_ensure_str(c) for c in AI_table['connection']]
@@ -566,16 +595,45 @@ class NI_DAQmxAcquisitionWorker(Worker):
             self.buffered_chans = sorted(set(chans), key=split_conn_AI)
         self.h5_file = h5file
         self.buffered_rate = device_properties['acquisition_rate']
+        self.sidecar_data_files = device_properties.get('sidecar_data_files', False)
         if device_properties['start_delay_ticks']:
             # delay is defined in sample clock ticks, calculate in sec and save for later
             self.AI_start_delay = self.AI_start_delay_ticks*self.buffered_rate
         self.acquired_data = []
+        self.samples_acquired = 0
+        self.reductions = {
+            _ensure_str(label): (_ensure_str(mode), factor, keep_raw)
+            for label, mode, factor, keep_raw in AI_reductions
+        }
+        self.reducers = {}
+        if not waits_in_use:
+            # Sample indices of acquisitions are known in advance, so reduce them as
+            # the data arrives. Otherwise they are reduced once the durations of the
+            # waits are known:
+            for connection, label, t_start, t_end, _, _, _ in AI_table:
+                label = _ensure_str(label)
+                if label in self.reductions:
+                    mode, factor, _ = self.reductions[label]
+                    i_start, i_end = self.acquisition_indices(t_start, t_end)
+                    reducer = AcquisitionReducer(
+                        mode, factor, i_start, i_end, self.buffered_rate, self.AI_start_delay
+                    )
+                    column = self.buffered_chans.index(_ensure_str(connection))
+                    self.reducers[label] = (column, reducer)
+        # Raw data is not needed if every acquisition is reduced as it arrives and
+        # none keeps its raw trace:
+        self.keep_raw_data = any(
+            _ensure_str(label) not in self.reducers
+            or self.reductions[_ensure_str(label)][2]
+            for label in AI_table['label']
+        )
         # Stop the manual mode task and start the buffered mode task:
         self.stop_task()
         self.buffered_mode = True
         self.start_task(self.buffered_chans, self.buffered_rate)
         return {}
 
+    @timed
     def transition_to_manual(self, abort=False):
         self.logger.debug('transition_to_manual')
         #  If we were doing buffered mode acquisition, stop the buffered mode task and
@@ -592,6 +650,7 @@ class NI_DAQmxAcquisitionWorker(Worker):
 
         if abort:
             self.acquired_data = None
+            self.reducers = {}
             self.buffered_chans = None
             self.h5_file = None
             self.buffered_rate = None
@@ -602,20 +661,25 @@ class NI_DAQmxAcquisitionWorker(Worker):
             data_group.create_group(self.device_name)
             waits_in_use = len(hdf5_file['waits']) > 0
 
-        if self.buffered_chans is not None and not self.acquired_data:
+        if self.buffered_chans is not None and not self.samples_acquired:
             msg = """No data was acquired. Perhaps the acquisition task was not
                 triggered to start, is the device connected to a pseudoclock?"""
             raise RuntimeError(dedent(msg))
         # Concatenate our chunks of acquired data and recast them as a structured
         # array with channel names:
-        if self.acquired_data:
+        if self.samples_acquired:
             start_time = time.time()
-            dtypes = [(chan, np.float32) for chan in self.buffered_chans]
-            raw_data = np.concatenate(self.acquired_data).view(dtypes)
-            raw_data = raw_data.reshape((len(raw_data),))
+            if self.acquired_data:
+                dtypes = [(chan, np.float32) for chan in self.buffered_chans]
+                raw_data = np.concatenate(self.acquired_data).view(dtypes)
+                raw_data = raw_data.reshape((len(raw_data),))
+            else:
+                # Every acquisition was reduced as it arrived:
+                raw_data = None
             self.acquired_data = None
             self.buffered_chans = None
-            self.extract_measurements(raw_data, waits_in_use)
+            with self.timing.span('save_data'):
+                self.extract_measurements(raw_data, waits_in_use)
             self.h5_file = None
             self.buffered_rate = None
             msg = 'data written, time taken: %ss' % str(time.time() - start_time)
@@ -632,58 +696,98 @@ class NI_DAQmxAcquisitionWorker(Worker):
             # determined their durations before we proceed:
             self.wait_durations_analysed.wait(self.h5_file)
 
-        with h5py.File(self.h5_file, 'a') as hdf5_file:
+        with h5py.File(self.h5_file, 'r') as hdf5_file:
             if waits_in_use:
                 # get the wait start times and durations
                 waits = hdf5_file['/data/waits']
                 wait_times = waits['time']
                 wait_durations = waits['duration']
             try:
-                acquisitions = hdf5_file['/devices/' + self.device_name + '/AI']
+                acquisitions = hdf5_file['/devices/' + self.device_name + '/AI'][:]
             except KeyError:
                 # No acquisitions!
                 return
-            try:
-                measurements = hdf5_file['/data/traces']
-            except KeyError:
-                # Group doesn't exist yet, create it:
-                measurements = hdf5_file.create_group('/data/traces')
 
-            t0 = self.AI_start_delay
-            for connection, label, t_start, t_end, _, _, _ in acquisitions:
-                connection = _ensure_str(connection)
-                label = _ensure_str(label)
-                if waits_in_use:
-                    # add durations from all waits that start prior to t_start of
-                    # acquisition
-                    t_start += wait_durations[(wait_times < t_start)].sum()
-                    # compare wait times to t_end to allow for waits during an
-                    # acquisition
-                    t_end += wait_durations[(wait_times < t_end)].sum()
-                i_start = int(np.ceil(self.buffered_rate * (t_start - t0)))
-                i_end = int(np.floor(self.buffered_rate * (t_end - t0)))
-                # np.ceil does what we want above, but float errors can miss the
-                # equality:
-                if t0 + (i_start - 1) / self.buffered_rate - t_start > -2e-16:
-                    i_start -= 1
-                # We want np.floor(x) to yield the largest integer < x (not <=):
-                if t_end - t0 - i_end / self.buffered_rate < 2e-16:
-                    i_end -= 1
-                # IBS: we sometimes find that t_end (with waits) gives a time
-                # after the end of acquisition.  The following line
-                # will produce return a shorter than expected array if i_end
-                # is larger than the length of the array.
-                values = raw_data[connection][i_start : i_end + 1]
-                i_end = i_start + len(values) - 1 # re-measure i_end
-
-                t_i = t0 + i_start / self.buffered_rate
-                t_f = t0 + i_end / self.buffered_rate
-                times = np.linspace(t_i, t_f, len(values), endpoint=True)
-                dtypes = [('t', np.float64), ('values', np.float32)]
-                data = np.empty(len(values), dtype=dtypes)
-                data['t'] = times
-                data['values'] = values
-                measurements.create_dataset(label, data=data)
+        # Extract the measurements before opening the shot file for writing, so as
+        # not to hold its lock for longer than needed:
+        measurements = {}
+        raw_measurements = {}
+        t0 = self.AI_start_delay
+        for connection, label, t_start, t_end, _, _, _ in acquisitions:
+            connection = _ensure_str(connection)
+            label = _ensure_str(label)
+            if label in self.reducers:
+                # Reduced as the data arrived:
+                _, reducer = self.reducers[label]
+                measurements[label] = reducer.result()
+                if not self.reductions[label][2]:
+                    continue
+            if waits_in_use:
+                # add durations from all waits that start prior to t_start of
+                # acquisition
+                t_start += wait_durations[(wait_times < t_start)].sum()
+                # compare wait times to t_end to allow for waits during an
+                # acquisition
+                t_end += wait_durations[(wait_times < t_end)].sum()
+            i_start, i_end = self.acquisition_indices(t_start, t_end)
+            # IBS: we sometimes find that t_end (with waits) gives a time
+            # after the end of acquisition.  The following line
+            # will produce return a shorter than expected array if i_end
+            # is larger than the length of the array.
+            values = raw_data[connection][i_start : i_end + 1]
+            i_end = i_start + len(values) - 1 # re-measure i_end
+
+            t_i = t0 + i_start / self.buffered_rate
+            t_f = t0 + i_end / self.buffered_rate
+            times = np.linspace(t_i, t_f, len(values), endpoint=True)
+            dtypes = [('t', np.float64), ('values', np.float32)]
+            data = np.empty(len(values), dtype=dtypes)
+            data['t'] = times
+            data['values'] = values
+            if label not in self.reductions:
+                measurements[label] = data
+                continue
+            mode, factor, keep_raw = self.reductions[label]
+            if keep_raw:
+                raw_measurements[label] = data
+            if label not in self.reducers:
+                reducer = AcquisitionReducer(
+                    mode, factor, i_start, i_end, self.buffered_rate, t0
+                )
+                reducer.feed(values, i_start)
+                measurements[label] = reducer.result()
+        self.reducers = {}
+
+        with open_data_file(
+            self.h5_file, self.device_name, sidecar=self.sidecar_data_files
+        ) as hdf5_file:
+            group = hdf5_file.require_group('/data/traces')
+            for label, data in measurements.items():
+                dataset = group.create_dataset(label, data=data)
+                if label in self.reductions:
+                    mode, factor, _ = self.reductions[label]
+                    dataset.attrs['reduction'] = mode
+                    dataset.attrs['reduction_factor'] = factor
+            if raw_measurements:
+                group = hdf5_file.require_group('/data/raw_traces')
+                for label, data in raw_measurements.items():
+                    group.create_dataset(label, data=data)
+            self.timing.save(hdf5_file)
+
+    def acquisition_indices(self, t_start, t_end):
+        """Return the indices of the first and last samples of the acquired data
+        that fall within an acquisition from t_start to t_end"""
+        t0 = self.AI_start_delay
+        i_start = int(np.ceil(self.buffered_rate * (t_start - t0)))
+        i_end = int(np.floor(self.buffered_rate * (t_end - t0)))
+        # np.ceil does what we want above, but float errors can miss the
+        # equality:
+        if t0 + (i_start - 1) / self.buffered_rate - t_start > -2e-16:
+            i_start -= 1
+        # We want np.floor(x) to yield the largest integer < x (not <=):
+        if t_end - t0 - i_end / self.buffered_rate < 2e-16:
+            i_end -= 1
+        return i_start, i_end
 
     def abort_buffered(self):
         return self.transition_to_manual(True)
@@ -29,6 +29,9 @@ from labscript import (
 )
 from labscript_utils import dedent
 from .utils import split_conn_DO, split_conn_AO, split_conn_AI
+from .reductions import REDUCTION_MODES, REDUCTIONS_DTYPE
+from ..generate_code_cache import generate_code_cache
+from ..table_digest import create_dataset_with_digest
 import numpy as np
 import warnings
 
@@ -84,7 +87,11 @@ class NI_DAQmx(IntermediateDevice):
                 "wait_monitor_minimum_pulse_width",
                 "wait_monitor_supports_wait_completed_events",
             ],
-            "device_properties": ["acquisition_rate","start_delay_ticks"],
+            "device_properties": [
+                "acquisition_rate",
+                "start_delay_ticks",
+                "sidecar_data_files",
+            ],
         }
     )
     def __init__(
@@ -120,6 +127,8 @@ class NI_DAQmx(IntermediateDevice):
         supports_buffered_DO=False,
         supports_semiperiod_measurement=False,
         supports_simultaneous_AI_sampling=False,
+        cache_generate_code=False,
+        sidecar_data_files=False,
         **kwargs
     ):
         """Generic class for NI_DAQmx devices.
@@ -187,6 +196,14 @@ class NI_DAQmx(IntermediateDevice):
                 buffered output
             supports_semiperiod_measurement (bool, optional): True if device supports
                 semi-period measurements
+            cache_generate_code (bool, optional): Reuse the output tables from a
+                previous shot compiled in the same process if the outputs and
+                acquisitions are identical. See
+                :mod:`labscript_devices.generate_code_cache`.
+            sidecar_data_files (bool, optional): Save acquired traces to a file of
+                their own next to the shot file, with links to them added to the shot
+                file, so that saving them does not hold up other devices saving data
+                to the shot file. See :mod:`labscript_devices.sidecar_files`.
 
         """
 
@@ -274,6 +291,7 @@ class NI_DAQmx(IntermediateDevice):
         self.supports_buffered_DO = supports_buffered_DO
         self.supports_semiperiod_measurement = supports_semiperiod_measurement
         self.supports_simultaneous_AI_sampling = supports_simultaneous_AI_sampling
+        self.cache_generate_code = cache_generate_code
 
         if self.supports_buffered_DO and self.supports_buffered_AO:
             self.clock_limit = min(self.max_DO_sample_rate, self.max_AO_sample_rate)
@@ -310,6 +328,9 @@ class NI_DAQmx(IntermediateDevice):
 
         self.BLACS_connection = self.MAX_name
 
+        # Reductions of acquisitions, by label, see reduce_acquisition():
+        self.AI_reductions = {}
+
         # Cannot be set with set_passed_properties because of name mangling with the
         # initial double underscore:
         self.set_property('__version__', __version__, 'connection_table_properties')
@@ -418,6 +439,56 @@ class NI_DAQmx(IntermediateDevice):
                 raise LabscriptError(dedent(msg))
             np.clip(output.raw_output, vmin, vmax, out=output.raw_output)
 
+    def reduce_acquisition(self, label, mode, factor=0, keep_raw=False):
+        """Reduce the data of an acquisition in the BLACS worker as it is
+        acquired, rather than saving every sample.
+
+        The reduced data is saved to the shot file as ``/data/traces/<label>``,
+        in place of the raw trace, see
+        :mod:`labscript_devices.NI_DAQmx.reductions`.
+
+        Args:
+            label (str): Label of an acquisition of one of the device's
+                :obj:`AnalogIn` inputs.
+            mode (str): ``'boxcar'`` to save the mean of each window of
+                `factor` samples, ``'downsample'`` to save every `factor`'th
+                sample after an anti-aliasing filter, or ``'stats'`` to save
+                the mean, standard deviation, minimum and maximum of each
+                window of `factor` samples.
+            factor (int, optional): Number of samples per window or per sample
+                kept. With ``'stats'``, zero (the default) computes statistics
+                of the whole acquisition.
+            keep_raw (bool, optional): Also save the raw trace, as
+                ``/data/raw_traces/<label>``.
+        """
+        if mode not in REDUCTION_MODES:
+            msg = """Invalid reduction mode %s for acquisition %s, must be one of
+                %s"""
+            raise LabscriptError(dedent(msg) % (mode, label, ', '.join(REDUCTION_MODES)))
+        if factor != int(factor) or factor < 0 or (mode != 'stats' and factor < 1):
+            msg = """Reduction factor of acquisition %s must be a positive integer,
+                or zero for mode 'stats', not %s"""
+            raise LabscriptError(dedent(msg) % (label, str(factor)))
+        self.AI_reductions[label] = (mode, int(factor), bool(keep_raw))
+
+    def _make_AI_reductions_table(self, AI_table):
+        """Check the reductions declared refer to acquisitions, and create their
+        table"""
+        if not self.AI_reductions:
+            return None
+        labels = set() if AI_table is None else {l.decode() for l in AI_table['label']}
+        for label in self.AI_reductions:
+            if label not in labels:
+                msg = """Reduction declared for acquisition %s, but %s has no
+                    acquisition with that label"""
+                raise LabscriptError(dedent(msg) % (label, self.name))
+        table = np.empty(len(self.AI_reductions), dtype=REDUCTIONS_DTYPE)
+        for i, (label, (mode, factor, keep_raw)) in enumerate(
+            sorted(self.AI_reductions.items())
+        ):
+            table[i] = (label, mode, factor, keep_raw)
+        return table
+
     def _check_AI_not_too_fast(self, AI_table):
         """Check that analog input acquisition rates do not exceed maximums."""
         if AI_table is None:
@@ -607,20 +678,42 @@ class NI_DAQmx(IntermediateDevice):
         self._check_even_children(analogs, digitals)
         self._check_bounds(analogs)
 
-        AO_table = self._make_analog_out_table(analogs, times)
-        DO_table = self._make_digital_out_table(digitals, times)
         AI_table = self._make_analog_input_table(inputs)
 
+        AI_reductions_table = self._make_AI_reductions_table(AI_table)
+
         self._check_AI_not_too_fast(AI_table)
         self._check_wait_monitor_timeout_device_config()
 
-        grp = self.init_device_group(hdf5_file)
-        if AO_table is not None:
-            grp.create_dataset('AO', data=AO_table, compression=config.compression)
-        if DO_table is not None:
-            grp.create_dataset('DO', data=DO_table, compression=config.compression)
-        if AI_table is not None:
-            grp.create_dataset('AI', data=AI_table, compression=config.compression)
+        def generate():
+            AO_table = self._make_analog_out_table(analogs, times)
+            DO_table = self._make_digital_out_table(digitals, times)
+
+            grp = self.init_device_group(hdf5_file)
+            if AO_table is not None:
+                create_dataset_with_digest(
+                    grp, 'AO', AO_table, compression=config.compression
+                )
+            if DO_table is not None:
+                create_dataset_with_digest(
+                    grp, 'DO', DO_table, compression=config.compression
+                )
+            if AI_table is not None:
+                create_dataset_with_digest(
+                    grp, 'AI', AI_table, compression=config.compression
+                )
+            if AI_reductions_table is not None:
+                grp.create_dataset('AI_REDUCTIONS', data=AI_reductions_table)
+
+        # The output tables depend only on the raw outputs of the children (times
+        # only sets the length of the tables, which is that of the raw outputs):
+        inputs = [
+            {c: output.raw_output for c, output in analogs.items()},
+            {c: output.raw_output for c, output in digitals.items()},
+            AI_table,
+            AI_reductions_table,
+        ]
+        generate_code_cache.run(self, hdf5_file, inputs, generate)
 
 
 from .models import *
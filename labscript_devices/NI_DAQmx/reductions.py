@@ -0,0 +1,232 @@
+#####################################################################
+#                                                                   #
+# /NI_DAQmx/reductions.py                                           #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Reduction of analog input acquisitions as they are acquired.
+
+An acquisition declared with :meth:`NI_DAQmx.reduce_acquisition
+<labscript_devices.NI_DAQmx.labscript_devices.NI_DAQmx.reduce_acquisition>` is
+reduced by the acquisition worker with an :class:`AcquisitionReducer`, which is
+fed the samples of the acquisition a chunk at a time and only keeps as many as
+it needs to produce its output. The modes are:
+
+* ``'boxcar'``: the mean of each window of `factor` samples.
+* ``'downsample'``: every `factor`'th sample, after low-pass filtering with a
+  windowed sinc filter with its cutoff at the reduced Nyquist frequency, to
+  avoid aliasing.
+* ``'stats'``: the mean, standard deviation, minimum and maximum of each window
+  of `factor` samples, or of the whole acquisition if `factor` is zero.
+
+The last window of ``'boxcar'`` and ``'stats'`` may contain fewer samples than
+the others. Times in the output are those of the centre of each window, or of
+the sample kept.
+"""
+
+import numpy as np
+
+REDUCTION_MODES = ('boxcar', 'downsample', 'stats')
+REDUCTIONS_DTYPE = [
+    ('label', 'a256'),
+    ('mode', 'a256'),
+    ('factor', int),
+    ('keep_raw', bool),
+]
+TRACE_DTYPE = [('t', np.float64), ('values', np.float32)]
+STATS_DTYPE = [
+    ('t', np.float64),
+    ('mean', np.float32),
+    ('std', np.float32),
+    ('min', np.float32),
+    ('max', np.float32),
+]
+
+# Length of the downsampling filter, in multiples of the factor on each side of
+# the sample it is centred on:
+FILTER_HALF_WIDTH = 4
+
+
+def lowpass_filter(factor):
+    """Return the coefficients of a windowed sinc low-pass filter with unity
+    gain at DC and its cutoff at the Nyquist frequency of the signal
+    downsampled by `factor`."""
+    half = FILTER_HALF_WIDTH * factor
+    n = np.arange(-half, half + 1)
+    h = np.sinc(n / factor) * np.blackman(2 * half + 1)
+    return h / h.sum()
+
+
+class AcquisitionReducer(object):
+    """Reduces the samples of one acquisition, fed to it in chunks.
+
+    Args:
+        mode (str): One of :data:`REDUCTION_MODES`.
+        factor (int): Number of samples per window or per sample kept. Zero for
+            a single window spanning the whole acquisition in ``'stats'``
+            mode.
+        i_start (int): Index of the first sample of the acquisition in the
+            acquired data.
+        i_end (int): Index of the last sample of the acquisition.
+        rate (float): Sample rate.
+        t0 (float): Time of the sample with index zero.
+    """
+
+    def __init__(self, mode, factor, i_start, i_end, rate, t0):
+        if mode not in REDUCTION_MODES:
+            raise ValueError('Invalid reduction mode %s' % mode)
+        if not factor:
+            if mode != 'stats':
+                raise ValueError('Reduction mode %s requires a factor' % mode)
+            factor = max(1, i_end - i_start + 1)
+        self.mode = mode
+        self.factor = int(factor)
+        self.i_start = i_start
+        self.i_end = i_end
+        self.rate = rate
+        self.t0 = t0
+        # Number of samples of the acquisition received so far:
+        self.n_received = 0
+        self.outputs = []
+        if mode == 'downsample':
+            self.filter = lowpass_filter(self.factor)
+            self.half = FILTER_HALF_WIDTH * self.factor
+            # Samples not yet consumed, starting at acquisition index buffer_start,
+            # and the acquisition index of the next sample to output:
+            self.buffer = np.zeros(0, dtype=np.float64)
+            self.buffer_start = -self.half
+            self.next_output = 0
+            self.started = False
+        else:
+            # Accumulated count, sum, sum of squares, min and max of the samples of
+            # the current incomplete window:
+            self.partial = None
+
+    def feed(self, chunk, chunk_start):
+        """Add samples to the acquisition.
+
+        Args:
+            chunk (numpy.ndarray): Consecutive samples of the acquired channel.
+            chunk_start (int): Index of the first sample of the chunk in the
+                acquired data. Samples outside the acquisition are ignored.
+        """
+        first = max(self.i_start + self.n_received, chunk_start)
+        last = min(self.i_end, chunk_start + len(chunk) - 1)
+        if last < first:
+            return
+        samples = np.asarray(chunk[first - chunk_start : last - chunk_start + 1], dtype=np.float64)
+        self.n_received += len(samples)
+        if self.mode == 'downsample':
+            self._feed_downsample(samples)
+        else:
+            self._feed_windows(samples)
+
+    def _window_times(self, first_index, counts):
+        # Times of the centres of windows starting at acquisition index first_index:
+        starts = first_index + np.concatenate([[0], np.cumsum(counts)[:-1]])
+        return self.t0 + (self.i_start + starts + (counts - 1) / 2) / self.rate
+
+    def _emit_windows(self, first_index, n, s, ss, mn, mx):
+        n = np.asarray(n, dtype=np.float64)
+        mean = np.asarray(s) / n
+        std = np.sqrt(np.maximum(np.asarray(ss) / n - mean ** 2, 0))
+        if self.mode == 'boxcar':
+            output = np.empty(len(n), dtype=TRACE_DTYPE)
+            output['values'] = mean
+        else:
+            output = np.empty(len(n), dtype=STATS_DTYPE)
+            output['mean'] = mean
+            output['std'] = std
+            output['min'] = mn
+            output['max'] = mx
+        output['t'] = self._window_times(first_index, n)
+        self.outputs.append(output)
+
+    def _flush_partial(self):
+        n, s, ss, mn, mx, first_index = self.partial
+        self.partial = None
+        self._emit_windows(first_index, [n], [s], [ss], [mn], [mx])
+
+    def _feed_windows(self, samples):
+        index = self.n_received - len(samples)
+        if self.partial is not None:
+            n, s, ss, mn, mx, first_index = self.partial
+            head = samples[: self.factor - n]
+            self.partial = (
+                n + len(head),
+                s + head.sum(),
+                ss + (head ** 2).sum(),
+                min(mn, head.min()),
+                max(mx, head.max()),
+                first_index,
+            )
+            samples = samples[len(head) :]
+            index += len(head)
+            if self.partial[0] == self.factor:
+                self._flush_partial()
+        n_windows = len(samples) // self.factor
+        if n_windows:
+            windows = samples[: n_windows * self.factor].reshape(n_windows, self.factor)
+            self._emit_windows(
+                index,
+                np.full(n_windows, self.factor),
+                windows.sum(axis=1),
+                (windows ** 2).sum(axis=1),
+                windows.min(axis=1),
+                windows.max(axis=1),
+            )
+            samples = samples[n_windows * self.factor :]
+            index += n_windows * self.factor
+        if len(samples):
+            self.partial = (
+                len(samples),
+                samples.sum(),
+                (samples ** 2).sum(),
+                samples.min(),
+                samples.max(),
+                index,
+            )
+
+    def _feed_downsample(self, samples):
+        if not self.started:
+            # Extend the start of the acquisition with its first sample:
+            self.buffer = np.full(self.half, samples[0])
+            self.started = True
+        self.buffer = np.concatenate([self.buffer, samples])
+        buffer_end = self.buffer_start + len(self.buffer)
+        last_output = min(buffer_end - 1 - self.half, self.n_received - 1)
+        if last_output >= self.next_output:
+            indices = np.arange(self.next_output, last_output + 1, self.factor)
+            windows = np.lib.stride_tricks.sliding_window_view(self.buffer, len(self.filter))
+            output = np.empty(len(indices), dtype=TRACE_DTYPE)
+            output['values'] = windows[indices - self.half - self.buffer_start] @ self.filter
+            output['t'] = self.t0 + (self.i_start + indices) / self.rate
+            self.outputs.append(output)
+            self.next_output = indices[-1] + self.factor
+        # Keep only the samples needed for outputs yet to come:
+        keep_from = self.next_output - self.half
+        self.buffer = self.buffer[keep_from - self.buffer_start :]
+        self.buffer_start = keep_from
+
+    def result(self):
+        """Return the reduced acquisition, once all its samples have been fed.
+
+        Returns:
+            numpy.ndarray: Structured array with fields ``'t'`` and ``'values'``,
+            or for ``'stats'`` mode ``'t'``, ``'mean'``, ``'std'``, ``'min'`` and
+            ``'max'``.
+        """
+        if self.mode == 'downsample':
+            if self.n_received:
+                # Extend the end of the acquisition with its last sample:
+                self._feed_downsample(np.full(self.half, self.buffer[-1]))
+        elif self.partial is not None:
+            self._flush_partial()
+        dtype = STATS_DTYPE if self.mode == 'stats' else TRACE_DTYPE
+        if not self.outputs:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate(self.outputs)
@@ -5,6 +5,9 @@ import numpy as np
 import labscript_utils.properties as properties
 from labscript_utils import dedent
 
+from ..trace_cache import cached_traces
+from ..clock_ticks import get_clock_ticks
+
 
 class NI_DAQmxParser(object):
     def __init__(self, path, device):
@@ -12,6 +15,7 @@ class NI_DAQmxParser(object):
         self.name = device.name
         self.device = device
 
+    @cached_traces
     def get_traces(self, add_trace, clock=None):
 
         with h5py.File(self.path, 'r') as f:
@@ -42,15 +46,7 @@ class NI_DAQmxParser(object):
             static_AO = props['static_AO']
             static_DO = props['static_DO']
 
-        times, clock_value = clock[0], clock[1]
-
-        clock_indices = np.where((clock_value[1:] - clock_value[:-1]) == 1)[0] + 1
-        # If initial clock value is 1, then this counts as a rising edge (clock should
-        # be 0 before experiment) but this is not picked up by the above code. So we
-        # insert it!
-        if clock_value[0] == 1:
-            clock_indices = np.insert(clock_indices, 0, 0)
-        clock_ticks = times[clock_indices]
+        clock_ticks = get_clock_ticks(clock)
 
         traces = {}
 
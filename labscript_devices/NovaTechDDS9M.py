@@ -12,6 +12,9 @@
 #####################################################################
 
 from labscript_devices import runviewer_parser, BLACS_tab
+from labscript_devices.table_digest import create_dataset_with_digest, TableCache
+from labscript_devices.trace_cache import cached_traces
+from labscript_devices.clock_ticks import get_clock_ticks
 
 from labscript import IntermediateDevice, DDS, StaticDDS, Device, config, LabscriptError, set_passed_properties
 from labscript_utils.unitconversions import NovaTechDDS9mFreqConversion, NovaTechDDS9mAmpConversion
@@ -32,6 +35,10 @@ class NovaTechDDS9M(IntermediateDevice):
     'update_mode' -- synchronous or asynchronous\
     'baud_rate',  -- operating baud rate
     'default_baud_rate' -- assumed baud rate at startup
+    'pipeline_window' -- number of commands sent ahead of their responses when
+                         programming. The default of 1 waits for each response
+                         before sending the next command. Larger values are faster,
+                         but are only safe if the device can buffer the commands.
     """
     description = 'NT-DDS9M'
     allowed_children = [DDS, StaticDDS]
@@ -53,6 +60,7 @@ class NovaTechDDS9M(IntermediateDevice):
                 'update_mode',
                 'synchronous_first_line_repeat',
                 'phase_mode',
+                'pipeline_window',
             ]
         }
     )
@@ -66,6 +74,7 @@ class NovaTechDDS9M(IntermediateDevice):
         update_mode='synchronous',
         synchronous_first_line_repeat=False,
         phase_mode='continuous',
+        pipeline_window=1,
         **kwargs
     ):
         IntermediateDevice.__init__(self, name, parent_device, **kwargs)
@@ -83,6 +92,9 @@ class NovaTechDDS9M(IntermediateDevice):
         if not phase_mode in ['aligned', 'continuous']:
             raise LabscriptError('phase_mode must be \'aligned\' or \'continuous\'')
 
+        if not (isinstance(pipeline_window, int) and pipeline_window >= 1):
+            raise LabscriptError('pipeline_window must be an integer of at least 1')
+
         self.update_mode = update_mode
         self.phase_mode = phase_mode 
         self.synchronous_first_line_repeat = synchronous_first_line_repeat
@@ -225,8 +237,8 @@ class NovaTechDDS9M(IntermediateDevice):
             out_table = np.concatenate([out_table[0:1], out_table])
 
         grp = self.init_device_group(hdf5_file)
-        grp.create_dataset('TABLE_DATA',compression=config.compression,data=out_table) 
-        grp.create_dataset('STATIC_DATA',compression=config.compression,data=static_table) 
+        create_dataset_with_digest(grp, 'TABLE_DATA', out_table, compression=config.compression)
+        create_dataset_with_digest(grp, 'STATIC_DATA', static_table, compression=config.compression)
         self.set_property('frequency_scale_factor', 10, location='device_properties')
         self.set_property('amplitude_scale_factor', 1023, location='device_properties')
         self.set_property('phase_scale_factor', 45.511111111111113, location='device_properties')
@@ -239,6 +251,7 @@ from blacs.tab_base_classes import Worker, define_state
 from blacs.tab_base_classes import MODE_MANUAL, MODE_TRANSITION_TO_BUFFERED, MODE_TRANSITION_TO_MANUAL, MODE_BUFFERED  
 
 from blacs.device_base_class import DeviceTab
+from labscript_devices.worker_timing import timed
 
 @BLACS_tab
 class NovatechDDS9MTab(DeviceTab):
@@ -278,6 +291,7 @@ class NovatechDDS9MTab(DeviceTab):
         self.baud_rate = connection_table_properties.get('baud_rate', None)
         self.default_baud_rate = connection_table_properties.get('default_baud_rate', None)
         self.update_mode = connection_table_properties.get('update_mode', 'synchronous')
+        self.pipeline_window = connection_table_properties.get('pipeline_window', 1)
         
         # Backward compat:
         blacs_connection =  str(connection_object.BLACS_connection)
@@ -298,7 +312,8 @@ class NovatechDDS9MTab(DeviceTab):
                                                               'baud_rate': self.baud_rate,
                                                               'default_baud_rate': self.default_baud_rate,
                                                               'update_mode': self.update_mode,
-                                                              'phase_mode': self.phase_mode})
+                                                              'phase_mode': self.phase_mode,
+                                                              'pipeline_window': self.pipeline_window})
         self.primary_worker = "main_worker"
 
         # Set the capabilities of this device
@@ -311,7 +326,11 @@ class NovatechDDS9mWorker(Worker):
         global serial; import serial
         global socket; import socket
         global h5py; import labscript_utils.h5_lock, h5py
+        global SerialTransport; from labscript_devices.serial_transport import SerialTransport
         self.smart_cache = {'STATIC_DATA': None, 'TABLE_DATA': ''}
+        # Digest of the table last programmed, so that an unchanged table need
+        # not be read from the shot file and compared line by line:
+        self.table_cache = TableCache()
         
         if self.default_baud_rate is not None:
             initial_baud_rate = self.default_baud_rate
@@ -345,6 +364,10 @@ class NovatechDDS9mWorker(Worker):
             if not self.check_connection():
                 msg = 'Error: Failed to execute command %s' % bauds[self.baud_rate]
                 raise RuntimeError(msg)           
+
+        # Commands after the baud rate is settled go through a transport that sends
+        # up to pipeline_window commands ahead of their responses:
+        self.transport = SerialTransport(self.connection, window=self.pipeline_window)
         
         # Set phase mode method
         phase_mode_commands = {
@@ -358,28 +381,24 @@ class NovatechDDS9mWorker(Worker):
 
         self.phase_mode_command = phase_mode_commands[self.phase_mode]
 
-        self.connection.write(b'e d\r\n')
-        response = self.connection.readline()
-        if response == b'e d\r\n':
+        response = self.transport.query('e d')
+        if response == 'e d\r\n':
             # if echo was enabled, then the command to disable it echos back at us!
-            response = self.connection.readline()
-        if response != b"OK\r\n":
+            response = self.transport.readline()
+        if response != "OK\r\n":
             msg = 'Error: Failed to execute command: "e d", received "%s".' % response
             raise Exception(msg)
 
-        self.connection.write(b'I a\r\n')
-        if self.connection.readline() != b"OK\r\n":
+        if self.transport.query('I a') != "OK\r\n":
             raise Exception('Error: Failed to execute command: "I a"')
         
         # Ensure we are in single-tone mode:
-        self.connection.write(b'm 0\r\n')
-        if self.connection.readline() != b"OK\r\n":
+        if self.transport.query('m 0') != "OK\r\n":
             raise Exception('Error: Failed to execute command: "m 0"')
 
         # Set the phase mode:
-        self.connection.write(b'%s\r\n'%self.phase_mode_command)
-        if self.connection.readline() != b"OK\r\n":
-            raise Exception('Error: Failed to execute command: "%s"'%self.phase_mode.decode('utf8'))
+        if self.transport.query(self.phase_mode_command) != "OK\r\n":
+            raise Exception('Error: Failed to execute command: "%s"'%self.phase_mode_command.decode('utf8'))
         
         #return self.get_current_values()
         
@@ -399,9 +418,8 @@ class NovatechDDS9mWorker(Worker):
 
     def check_remote_values(self):
         # Get the currently output values:
-        self.connection.write(b'QUE\r\n')
         try:
-            response = [self.connection.readline() for i in range(5)]
+            response = self.transport.query('QUE', n_lines=5).splitlines()
         except socket.timeout:
             raise Exception('Failed to execute command "QUE". Cannot connect to device.')
         results = {}
@@ -424,23 +442,25 @@ class NovatechDDS9mWorker(Worker):
             for subchnl in ['freq','amp','phase']:     
                 # Program the sub channel
                 self.program_static(i,subchnl,front_panel_values['channel %d'%i][subchnl])
+        # Reading the output values also reads the responses to the commands above:
         return self.check_remote_values()
 
     def program_static(self,channel,type,value):
+        """Send a command setting a static value. The response is checked once it
+        is read, by the next command or by calling self.transport.flush()"""
         if type == 'freq':
-            command = b'F%d %.7f\r\n'%(channel,value/10.0**6)
+            command = b'F%d %.7f'%(channel,value/10.0**6)
         elif type == 'amp':
-            command = b'V%d %u\r\n'%(channel,int(value*1023+0.5))
+            command = b'V%d %u'%(channel,int(value*1023+0.5))
         elif type == 'phase':
-            command = b'P%d %u\r\n'%(channel,value*16384/360)
+            command = b'P%d %u'%(channel,value*16384/360)
         else:
             raise TypeError(type)
-        self.connection.write(command)
-        if self.connection.readline() != b"OK\r\n":
-            raise Exception('Error: Failed to execute command: %s' % command.decode('utf8'))
+        self.transport.send(command, expect="OK\r\n")
         # Now that a static update has been done, we'd better invalidate the saved STATIC_DATA:
         self.smart_cache['STATIC_DATA'] = None
      
+    @timed
     def transition_to_buffered(self,device_name,h5file,initial_values,fresh):
 
         # The "double clutch" trick: switching to table mode and back again, before
@@ -450,11 +470,9 @@ class NovatechDDS9mWorker(Worker):
         # be zero already at this point)
 
         # Transition to table mode:
-        self.connection.write(b'm t\r\n')
-        self.connection.readline()
+        self.transport.query('m t')
         # And back to manual mode
-        self.connection.write(b'm 0\r\n')
-        if self.connection.readline() != b"OK\r\n":
+        if self.transport.query('m 0') != "OK\r\n":
             raise Exception('Error: Failed to execute command: "m 0"')
 
 
@@ -464,32 +482,28 @@ class NovatechDDS9mWorker(Worker):
         self.final_values = {}
         static_data = None
         table_data = None
-        with h5py.File(h5file, 'r') as hdf5_file:
+        with self.timing.span('read_shot_file'), h5py.File(h5file, 'r') as hdf5_file:
             group = hdf5_file['/devices/'+device_name]
             # If there are values to set the unbuffered outputs to, set them now:
             if 'STATIC_DATA' in group:
                 static_data = group['STATIC_DATA'][:][0]
             # Now program the buffered outputs:
             if 'TABLE_DATA' in group:
-                table_data = group['TABLE_DATA'][:]
+                table_data, table_changed = self.table_cache.read(group['TABLE_DATA'], fresh)
         
         if static_data is not None:
             data = static_data
             if fresh or data != self.smart_cache['STATIC_DATA']:
                 self.logger.debug('Static data has changed, reprogramming.')
+                with self.timing.span('program_static'):
+                    self.transport.send(b'F2 %.7f'%(data['freq2']/10.0**7), expect="OK\r\n")
+                    self.transport.send(b'V2 %u'%(data['amp2']), expect="OK\r\n")
+                    self.transport.send(b'P2 %u'%(data['phase2']), expect="OK\r\n")
+                    self.transport.send(b'F3 %.7f'%(data['freq3']/10.0**7), expect="OK\r\n")
+                    self.transport.send(b'V3 %u'%data['amp3'], expect="OK\r\n")
+                    self.transport.send(b'P3 %u'%data['phase3'], expect="OK\r\n")
+                    self.transport.flush()
                 self.smart_cache['STATIC_DATA'] = data
-                self.connection.write(b'F2 %.7f\r\n'%(data['freq2']/10.0**7))
-                self.connection.readline()
-                self.connection.write(b'V2 %u\r\n'%(data['amp2']))
-                self.connection.readline()
-                self.connection.write(b'P2 %u\r\n'%(data['phase2']))
-                self.connection.readline()
-                self.connection.write(b'F3 %.7f\r\n'%(data['freq3']/10.0**7))
-                self.connection.readline()
-                self.connection.write(b'V3 %u\r\n'%data['amp3'])
-                self.connection.readline()
-                self.connection.write(b'P3 %u\r\n'%data['phase3'])
-                self.connection.readline()
                 
                 # Save these values into final_values so the GUI can
                 # be updated at the end of the run to reflect them:
@@ -505,24 +519,26 @@ class NovatechDDS9mWorker(Worker):
         # Now program the buffered outputs:
         if table_data is not None:
             data = table_data
-            for i, line in enumerate(data):
-                st = time.time()
-                oldtable = self.smart_cache['TABLE_DATA']
-                for ddsno in range(2):
-                    if fresh or i >= len(oldtable) or (line['freq%d'%ddsno],line['phase%d'%ddsno],line['amp%d'%ddsno]) != (oldtable[i]['freq%d'%ddsno],oldtable[i]['phase%d'%ddsno],oldtable[i]['amp%d'%ddsno]):
-                        self.connection.write(b't%d %04x %08x,%04x,%04x,ff\r\n'%(ddsno, i,line['freq%d'%ddsno],line['phase%d'%ddsno],line['amp%d'%ddsno]))
-                        self.connection.readline()
-                et = time.time()
-                tt=et-st
-                self.logger.debug('Time spent on line %s: %s'%(i,tt))
-            # Store the table for future smart programming comparisons:
-            try:
-                self.smart_cache['TABLE_DATA'][:len(data)] = data
-                self.logger.debug('Stored new table as subset of old table')
-            except: # new table is longer than old table
-                self.smart_cache['TABLE_DATA'] = data
-                self.logger.debug('New table is longer than old table and has replaced it.')
-                
+            if not table_changed:
+                self.logger.debug('Table data is unchanged, not reprogramming.')
+            else:
+                with self.timing.span('program_table'):
+                    oldtable = self.smart_cache['TABLE_DATA']
+                    for i, line in enumerate(data):
+                        for ddsno in range(2):
+                            if fresh or i >= len(oldtable) or (line['freq%d'%ddsno],line['phase%d'%ddsno],line['amp%d'%ddsno]) != (oldtable[i]['freq%d'%ddsno],oldtable[i]['phase%d'%ddsno],oldtable[i]['amp%d'%ddsno]):
+                                self.transport.send(b't%d %04x %08x,%04x,%04x,ff'%(ddsno, i,line['freq%d'%ddsno],line['phase%d'%ddsno],line['amp%d'%ddsno]))
+                    self.transport.flush()
+                self.logger.debug(self.transport.latency_report())
+                # Store the table for future smart programming comparisons:
+                try:
+                    self.smart_cache['TABLE_DATA'][:len(data)] = data
+                    self.logger.debug('Stored new table as subset of old table')
+                except: # new table is longer than old table
+                    self.smart_cache['TABLE_DATA'] = data
+                    self.logger.debug('New table is longer than old table and has replaced it.')
+                self.table_cache.programmed()
+
             # Get the final values of table mode so that the GUI can
             # reflect them after the run:
             self.final_values['channel 0'] = {}
@@ -535,12 +551,10 @@ class NovatechDDS9mWorker(Worker):
             self.final_values['channel 1']['phase'] = data[-1]['phase1']*360/16384.0
             
             # Transition to table mode:
-            self.connection.write(b'm t\r\n')
-            self.connection.readline()
+            self.transport.query('m t')
             if self.update_mode == 'synchronous':
                 # Transition to hardware synchronous updates:
-                self.connection.write(b'I e\r\n')
-                self.connection.readline()
+                self.transport.query('I e')
                 # We are now waiting for a rising edge to trigger the output
                 # of the second table pair (first of the experiment)
             elif self.update_mode == 'asynchronous':
@@ -559,12 +573,11 @@ class NovatechDDS9mWorker(Worker):
         # TODO: untested
         return self.transition_to_manual(True)
     
+    @timed
     def transition_to_manual(self,abort = False):
-        self.connection.write(b'm 0\r\n')
-        if self.connection.readline() != b"OK\r\n":
+        if self.transport.query('m 0') != "OK\r\n":
             raise Exception('Error: Failed to execute command: "m 0"')
-        self.connection.write(b'I a\r\n')
-        if self.connection.readline() != b"OK\r\n":
+        if self.transport.query('I a') != "OK\r\n":
             raise Exception('Error: Failed to execute command: "I a"')
         if abort:
             # If we're aborting the run, then we need to reset DDSs 2 and 3 to their initial values.
@@ -584,6 +597,7 @@ class NovatechDDS9mWorker(Worker):
             channel_values = values['channel %d'%ddsnumber]
             for subchnl in ['freq','amp','phase']:            
                 self.program_static(ddsnumber,subchnl,channel_values[subchnl])
+        self.transport.flush()
             
         # return True to indicate we successfully transitioned back to manual mode
         return True
@@ -607,19 +621,13 @@ class RunviewerClass(object):
         self.name = device.name
         self.device = device
             
+    @cached_traces
     def get_traces(self, add_trace, clock=None):
         if clock is None:
             # we're the master pseudoclock, software triggered. So we don't have to worry about trigger delays, etc
             raise Exception('No clock passed to %s. The NovaTechDDS9M must be clocked by another device.'%self.name)
         
-        times, clock_value = clock[0], clock[1]
-        
-        clock_indices = np.where((clock_value[1:]-clock_value[:-1])==1)[0]+1
-        # If initial clock value is 1, then this counts as a rising edge (clock should be 0 before experiment)
-        # but this is not picked up by the above code. So we insert it!
-        if clock_value[0] == 1:
-            clock_indices = np.insert(clock_indices, 0, 0)
-        clock_ticks = times[clock_indices]
+        clock_ticks = get_clock_ticks(clock)
         
         # get the data out of the H5 file
         data = {}
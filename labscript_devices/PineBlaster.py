@@ -13,6 +13,8 @@
 
 from labscript import PseudoclockDevice, Pseudoclock, ClockLine, config, LabscriptError, set_passed_properties
 from labscript_devices import runviewer_parser, BLACS_tab
+from labscript_devices.trace_cache import cached_traces
+from labscript_devices.clock_ticks import get_clock_ticks
 
 import numpy as np
 import labscript_utils.h5_lock, h5py
@@ -128,15 +130,10 @@ class RunviewerClass(object):
         self.device = device
         
             
+    @cached_traces
     def get_traces(self, add_trace, clock=None):
         if clock is not None:
-            times, clock_value = clock[0], clock[1]
-            clock_indices = np.where((clock_value[1:]-clock_value[:-1])==1)[0]+1
-            # If initial clock value is 1, then this counts as a rising edge (clock should be 0 before experiment)
-            # but this is not picked up by the above code. So we insert it!
-            if clock_value[0] == 1:
-                clock_indices = np.insert(clock_indices, 0, 0)
-            clock_ticks = times[clock_indices]
+            clock_ticks = get_clock_ticks(clock)
 
         
             
@@ -235,17 +232,22 @@ class PineblasterTab(DeviceTab):
 
 
 class PineblasterWorker(Worker):
+    # Number of instructions sent ahead of their responses. Kept small so as not to
+    # overrun the PineBlaster's serial receive buffer:
+    pipeline_window = 4
+
     def init(self):
         global h5py; import labscript_utils.h5_lock, h5py
         global serial; import serial
         global time; import time
+        global SerialTransport; from labscript_devices.serial_transport import SerialTransport
         self.smart_cache = []
     
         self.pineblaster = serial.Serial(self.usbport, 115200, timeout=1)
+        self.transport = SerialTransport(self.pineblaster, window=self.pipeline_window)
         # Device has a finite startup time:
         time.sleep(5)
-        self.pineblaster.write(b'hello\r\n')
-        response = self.pineblaster.readline().decode()
+        response = self.transport.query('hello')
         
         if response == 'hello\r\n':
             return
@@ -256,12 +258,11 @@ class PineblasterWorker(Worker):
             
             
     def shutdown(self):
-        self.pineblaster.close()
+        self.transport.close()
         
     def program_manual(self, values):    
         value = values['internal'] # there is only one value
-        self.pineblaster.write(b'go high\r\n' if value else b'go low\r\n')
-        response = self.pineblaster.readline().decode()
+        response = self.transport.query('go high' if value else 'go low')
         assert response == 'ok\r\n', 'PineBlaster said \'%s\', expected \'ok\''%repr(response)
         return {}
         
@@ -276,6 +277,9 @@ class PineblasterWorker(Worker):
             device_properties = labscript_utils.properties.get(hdf5_file, device_name, 'device_properties')
             self.is_master_pseudoclock = device_properties['is_master_pseudoclock']
             
+        # Send instructions without waiting for each response, and only update the
+        # smart cache once they have all been confirmed:
+        updated = []
         for i, instruction in enumerate(pulse_program):
             if i == len(self.smart_cache):
                 # Pad the smart cache out to be as long as the program:
@@ -283,28 +287,27 @@ class PineblasterWorker(Worker):
                 
             # Only program instructions that differ from what's in the smart cache:
             if self.smart_cache[i] != instruction:
-                self.pineblaster.write(b'set %d %d %d\r\n'%(i, instruction['period'], instruction['reps']))
-                response = self.pineblaster.readline().decode()
-                assert response == 'ok\r\n', 'PineBlaster said \'%s\', expected \'ok\''%repr(response)
-                self.smart_cache[i] = instruction
+                self.transport.send(b'set %d %d %d'%(i, instruction['period'], instruction['reps']), expect='ok\r\n')
+                updated.append(i)
+        self.transport.flush()
+        for i in updated:
+            self.smart_cache[i] = pulse_program[i]
                 
         if not self.is_master_pseudoclock:
             # Get ready for a hardware trigger:
-            self.pineblaster.write(b'hwstart\r\n')
-            response = self.pineblaster.readline().decode()
+            response = self.transport.query('hwstart')
             assert response == 'ok\r\n', 'PineBlaster said \'%s\', expected \'ok\''%repr(response)
             
         return {'internal':0} # always finish on 0
             
     def start_run(self):
         # Start in software:
-        self.pineblaster.write(b'start\r\n')
-        response = self.pineblaster.readline().decode()
+        response = self.transport.query('start')
         assert response == 'ok\r\n', 'PineBlaster said \'%s\', expected \'ok\''%repr(response)
     
     def status_monitor(self):
         # Wait to see if it's done within the timeout:
-        response = self.pineblaster.readline().decode()
+        response = self.transport.readline()
         if response:
             assert response == 'done\r\n'
             return True
@@ -315,7 +318,7 @@ class PineblasterWorker(Worker):
         if not self.is_master_pseudoclock:
             # If we're the master pseudoclock then this already happened
             # in status_monitor, so we don't need to do it again
-            response = self.pineblaster.readline().decode()
+            response = self.transport.readline()
             assert response == 'done\r\n', 'PineBlaster said \'%s\', expected \'ok\''%repr(response)
             # print 'done!'
         return True
@@ -327,7 +330,8 @@ class PineblasterWorker(Worker):
         return self.abort()
     
     def abort(self):
-        self.pineblaster.write(b'restart\r\n')
+        self.transport.discard_pending()
+        self.transport.write(b'restart\r\n')
         time.sleep(5)
         self.shutdown()
         self.init()
@@ -18,6 +18,11 @@ from blacs.tab_base_classes import Worker
 from labscript import LabscriptError
 from labscript_utils.connections import _ensure_str
 import labscript_utils.properties as properties
+from labscript_devices.table_digest import TableCache
+from labscript_devices.serial_transport import SerialTransport, SerialTransportError
+from labscript_devices.upload_image import read_upload_image
+from labscript_devices.worker_timing import timed
+from labscript_devices.PrawnBlaster.labscript_devices import SETB_PROTOCOL, setb_payload
 
 
 class PrawnBlasterWorker(Worker):
@@ -27,6 +32,10 @@ class PrawnBlasterWorker(Worker):
     with the hardware.
     """
 
+    # Number of commands sent ahead of their responses when programming. USB flow
+    # control stops the host from overrunning the PrawnBlaster's input buffer.
+    pipeline_window = 32
+
     def init(self):
         """Initialises the hardware communication.
 
@@ -43,6 +52,7 @@ class PrawnBlasterWorker(Worker):
         global struct; import struct
         global zprocess; import zprocess
         self.smart_cache = {}
+        self.table_cache = TableCache()
         self.cached_pll_params = {}
         # fmt: on
 
@@ -60,6 +70,7 @@ class PrawnBlasterWorker(Worker):
         self.min_version = (1, 1, 0)
         
         self.conn = serial.Serial(self.com_port, 115200, timeout=1)
+        self.transport = SerialTransport(self.conn, window=self.pipeline_window)
         self.check_status()
 
         # configure number of pseudoclocks
@@ -90,10 +101,7 @@ class PrawnBlasterWorker(Worker):
     def _read_full_buffer(self):
         '''Used to get any extra lines from device after a failed send_command'''
 
-        resp = self.conn.readlines()
-        str_resp = ''.join([st.decode() for st in resp])
-
-        return str_resp
+        return self.transport.readlines()
     
     def send_command(self, command, readlines=False):
         '''Sends the supplied string command and checks for a response.
@@ -108,15 +116,7 @@ class PrawnBlasterWorker(Worker):
         Returns:
             str: String response from the PrawnBlaster
         '''
-        command += '\r\n'
-        self.conn.write(command.encode())
-
-        if readlines:
-            str_resp = self._read_full_buffer()
-        else:
-            str_resp = self.conn.readline().decode()
-
-        return str_resp
+        return self.transport.query(command, n_lines=None if readlines else 1)
     
     def send_command_ok(self, command):
         '''Sends the supplied string command and confirms 'ok' response.
@@ -128,11 +128,10 @@ class PrawnBlasterWorker(Worker):
             LabscriptError: If response is not `ok\\r\\n`
         '''
 
-        resp = self.send_command(command)
-        if resp != 'ok\r\n':
-            # get complete error message
-            resp += self._read_full_buffer()
-            raise LabscriptError(f"Command '{command:s}' failed. Got response '{repr(resp)}'")
+        try:
+            self.transport.query(command, expect='ok\r\n')
+        except SerialTransportError as e:
+            raise LabscriptError(str(e))
     
     def get_version(self):
         version_str = self.send_command('version', readlines=True)
@@ -190,64 +189,8 @@ class PrawnBlasterWorker(Worker):
               not been read out yet.
         """
 
-        if (
-            self.started
-            and self.wait_table is not None
-            and self.current_wait < len(self.wait_table)
-        ):
-            # Try to read out wait. For now, we're only reading out waits from
-            # pseudoclock 0 since they should all be the same (requirement imposed by labscript)
-            response = self.send_command(f'getwait {0} {self.current_wait}')
-            if response != "wait not yet available\r\n":
-                # Parse the response from the PrawnBlaster
-                wait_remaining = int(response)
-                # Divide by two since the clock_resolution is for clock pulses, which
-                # have twice the clock_resolution of waits
-                # Technically, waits also only have a resolution of `clock_resolution`
-                # but the PrawnBlaster firmware accepts them in half of that so that
-                # they are easily converted to seconds via the clock frequency.
-                # Maybe this was a mistake, but it's done now.
-                clock_resolution = self.device_properties["clock_resolution"] / 2
-                input_response_time = self.device_properties["input_response_time"]
-                timeout_length = round(
-                    self.wait_table[self.current_wait]["timeout"] / clock_resolution
-                )
-
-                if wait_remaining == (2 ** 32 - 1):
-                    # The wait hit the timeout - save the timeout duration as wait length
-                    # and flag that this wait timedout
-                    self.measured_waits[self.current_wait] = (
-                        timeout_length * clock_resolution
-                    )
-                    self.wait_timeout[self.current_wait] = True
-                else:
-                    # Calculate wait length
-                    # This is a measurement of between the end of the last pulse and the
-                    # retrigger signal. We obtain this by subtracting off the time it takes
-                    # to detect the pulse in the ASM code once the trigger has hit the input
-                    # pin (stored in input_response_time)
-                    self.measured_waits[self.current_wait] = (
-                        (timeout_length - wait_remaining) * clock_resolution
-                    ) - input_response_time
-                    self.wait_timeout[self.current_wait] = False
-
-                self.logger.info(
-                    f"Wait {self.current_wait} finished. Length={self.measured_waits[self.current_wait]:.9f}s. Timed-out={self.wait_timeout[self.current_wait]}"
-                )
-
-                # Inform any interested parties that a wait has completed:
-                self.wait_completed.post(
-                    self.h5_file,
-                    data=_ensure_str(self.wait_table[self.current_wait]["label"]),
-                )
-
-                # increment the wait we are looking for!
-                self.current_wait += 1
-
-                # post message if all waits are done
-                if len(self.wait_table) == self.current_wait:
-                    self.logger.info("All waits finished")
-                    self.all_waits_finished.post(self.h5_file)
+        if self.started and self.wait_table is not None:
+            self.read_waits()
 
         # Determine if we are still waiting for wait information
         waits_pending = False
@@ -260,6 +203,86 @@ class PrawnBlasterWorker(Worker):
         run_status, clock_status = self.read_status()
         return run_status, clock_status, waits_pending
 
+    def read_waits(self):
+        """Reads out the durations of all waits completed since the last call.
+
+        Waits complete in order, so the pending waits are queried in batches of
+        up to :attr:`pipeline_window` pipelined `getwait` commands, stopping at the
+        first wait not yet available. Reading any number of completed waits
+        therefore costs about one round trip per batch, rather than one status
+        check per wait.
+        """
+        while self.current_wait < len(self.wait_table):
+            # For now, we're only reading out waits from pseudoclock 0 since they
+            # should all be the same (requirement imposed by labscript)
+            stop = min(self.current_wait + self.pipeline_window, len(self.wait_table))
+            responses = [
+                self.transport.send(f'getwait {0} {i}')
+                for i in range(self.current_wait, stop)
+            ]
+            for response in responses:
+                response = response.result()
+                if response == "wait not yet available\r\n":
+                    # Later waits are not available either, discard their responses:
+                    self.transport.flush()
+                    return
+                self._record_wait(int(response))
+
+    def _record_wait(self, wait_remaining):
+        """Records the duration of the current wait and posts events about it.
+
+        Args:
+            wait_remaining (int): Response of the PrawnBlaster to `getwait`, the
+                number of half clock cycles remaining before the wait's timeout.
+        """
+        # Divide by two since the clock_resolution is for clock pulses, which
+        # have twice the clock_resolution of waits
+        # Technically, waits also only have a resolution of `clock_resolution`
+        # but the PrawnBlaster firmware accepts them in half of that so that
+        # they are easily converted to seconds via the clock frequency.
+        # Maybe this was a mistake, but it's done now.
+        clock_resolution = self.device_properties["clock_resolution"] / 2
+        input_response_time = self.device_properties["input_response_time"]
+        timeout_length = round(
+            self.wait_table[self.current_wait]["timeout"] / clock_resolution
+        )
+
+        if wait_remaining == (2 ** 32 - 1):
+            # The wait hit the timeout - save the timeout duration as wait length
+            # and flag that this wait timedout
+            self.measured_waits[self.current_wait] = (
+                timeout_length * clock_resolution
+            )
+            self.wait_timeout[self.current_wait] = True
+        else:
+            # Calculate wait length
+            # This is a measurement of between the end of the last pulse and the
+            # retrigger signal. We obtain this by subtracting off the time it takes
+            # to detect the pulse in the ASM code once the trigger has hit the input
+            # pin (stored in input_response_time)
+            self.measured_waits[self.current_wait] = (
+                (timeout_length - wait_remaining) * clock_resolution
+            ) - input_response_time
+            self.wait_timeout[self.current_wait] = False
+
+        self.logger.info(
+            f"Wait {self.current_wait} finished. Length={self.measured_waits[self.current_wait]:.9f}s. Timed-out={self.wait_timeout[self.current_wait]}"
+        )
+
+        # Inform any interested parties that a wait has completed:
+        self.wait_completed.post(
+            self.h5_file,
+            data=_ensure_str(self.wait_table[self.current_wait]["label"]),
+        )
+
+        # increment the wait we are looking for!
+        self.current_wait += 1
+
+        # post message if all waits are done
+        if len(self.wait_table) == self.current_wait:
+            self.logger.info("All waits finished")
+            self.all_waits_finished.post(self.h5_file)
+
     def read_status(self):
         """Reads the status of the PrawnBlaster.
 
@@ -301,6 +324,7 @@ class PrawnBlasterWorker(Worker):
 
         return values
 
+    @timed
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
         """Configures the PrawnBlaster for buffered execution.
 
@@ -325,12 +349,25 @@ class PrawnBlasterWorker(Worker):
         #                        betwen now and when we actually send the start signal
         # fmt: on
 
-        # Get data from HDF5 file
+        # Get data from HDF5 file. Pulse programs unchanged since they were last
+        # programmed are not re-read.
         pulse_programs = []
-        with h5py.File(h5file, "r") as hdf5_file:
+        pulse_programs_changed = []
+        upload_images = []
+        with self.timing.span("read_shot_file"), h5py.File(h5file, "r") as hdf5_file:
             group = hdf5_file[f"devices/{device_name}"]
             for i in range(self.num_pseudoclocks):
-                pulse_programs.append(group[f"PULSE_PROGRAM_{i}"][:])
+                pulse_program, changed = self.table_cache.read(
+                    group[f"PULSE_PROGRAM_{i}"], fresh
+                )
+                pulse_programs.append(pulse_program)
+                pulse_programs_changed.append(changed)
+                # The setb payload packed at compile time, if the shot file has it:
+                upload_images.append(
+                    read_upload_image(group, f"UPLOAD_IMAGE_{i}", SETB_PROTOCOL)
+                    if changed
+                    else None
+                )
                 self.smart_cache.setdefault(i, [])
             self.device_properties = labscript_utils.properties.get(
                 hdf5_file, device_name, "device_properties"
@@ -370,75 +407,87 @@ class PrawnBlasterWorker(Worker):
                 )
         clock_frequency = self.device_properties["clock_frequency"]
 
-        # Now set the clock details
-        response = self.send_command_ok(f"setclock {clock_mode} {clock_frequency}")
-
-        # Program instructions
-        for pseudoclock, pulse_program in enumerate(pulse_programs):
-            total_inst = len(pulse_program)
-            # check if it is more efficient to fully refresh
-            if not fresh and self.smart_cache[pseudoclock] is not None:
-                # get more convenient handles to smart cache arrays
-                curr_inst = self.smart_cache[pseudoclock]
-
-                # if arrays aren't of same shape, only compare up to smaller array size
-                n_curr = len(curr_inst)
-                n_new = len(pulse_program)
-                if n_curr > n_new:
-                    # technically don't need to reprogram current elements beyond end of new elements
-                    new_inst = np.sum(curr_inst[:n_new] != pulse_program)
-                elif n_curr < n_new:
-                    n_diff = n_new - n_curr
-                    val_diffs = np.sum(curr_inst != pulse_program[:n_curr])
-                    new_inst = val_diffs + n_diff
+        # Time taken to run the pulse programs, excluding waits, for which there is
+        # no need to poll for the end of the shot:
+        self.run_time = self.device_properties["clock_resolution"] * max(
+            np.sum(pulse_program["half_period"].astype(np.int64) * pulse_program["reps"])
+            for pulse_program in pulse_programs
+        )
+
+        with self.timing.span("program"):
+            # Now set the clock details
+            response = self.send_command_ok(f"setclock {clock_mode} {clock_frequency}")
+
+            # Program instructions
+            for pseudoclock, pulse_program in enumerate(pulse_programs):
+                if not pulse_programs_changed[pseudoclock]:
+                    # Identical to the program already on the device
+                    continue
+                total_inst = len(pulse_program)
+                # check if it is more efficient to fully refresh
+                if not fresh and self.smart_cache[pseudoclock] is not None:
+                    # get more convenient handles to smart cache arrays
+                    curr_inst = self.smart_cache[pseudoclock]
+
+                    # if arrays aren't of same shape, only compare up to smaller array size
+                    n_curr = len(curr_inst)
+                    n_new = len(pulse_program)
+                    if n_curr > n_new:
+                        # technically don't need to reprogram current elements beyond end of new elements
+                        new_inst = np.sum(curr_inst[:n_new] != pulse_program)
+                    elif n_curr < n_new:
+                        n_diff = n_new - n_curr
+                        val_diffs = np.sum(curr_inst != pulse_program[:n_curr])
+                        new_inst = val_diffs + n_diff
+                    else:
+                        new_inst = np.sum(curr_inst != pulse_program)
+
+                    if new_inst / total_inst > 0.1:
+                        fresh = True
+
+                if (fresh or self.smart_cache[pseudoclock] is None):
+                    print('binary programming')
+                    self.transport.query(
+                        "setb %d %d %d" % (pseudoclock, 0, len(pulse_program)),
+                        expect="ready\r\n",
+                    )
+                    payload = upload_images[pseudoclock]
+                    if payload is None:
+                        payload = setb_payload(pulse_program)
+                    self.transport.send_data(payload, expect="ok\r\n").result()
+                    self.smart_cache[pseudoclock] = pulse_program
                 else:
-                    new_inst = np.sum(curr_inst != pulse_program)
-
-                if new_inst / total_inst > 0.1:
-                    fresh = True
-
-            if (fresh or self.smart_cache[pseudoclock] is None):
-                print('binary programming')
-                self.conn.write(b"setb %d %d %d\r\n" % (pseudoclock, 0, len(pulse_program)))
-                response = self.conn.readline().decode()
-                assert (
-                    response == "ready\r\n"
-                ), f"PrawnBlaster said '{response}', expected 'ready'"
-                program_array = np.array([pulse_program['half_period'],
-                                          pulse_program['reps']], dtype='<u4').T
-                self.conn.write(program_array.tobytes())
-                response = self.conn.readline().decode()
-                assert (
-                    response == "ok\r\n"
-                ), f"PrawnBlaster said '{response}', expected 'ok'"
-                self.smart_cache[pseudoclock] = pulse_program
-            else:
-                print('incremental programming')
-                for i, instruction in enumerate(pulse_program):
-                    if i == len(self.smart_cache[pseudoclock]):
-                        # Pad the smart cache out to be as long as the program:
-                        self.smart_cache[pseudoclock].append(None)
-
-                    # Only program instructions that differ from what's in the smart cache:
-                    if self.smart_cache[pseudoclock][i] != instruction:
-                        self.conn.write(
-                            b"set %d %d %d %d\r\n"
-                            % (
-                                pseudoclock,
-                                i,
-                                instruction["half_period"],
-                                instruction["reps"],
+                    print('incremental programming')
+                    # Send the changed instructions without waiting for each response,
+                    # and only update the smart cache once they have all been confirmed:
+                    updated = []
+                    for i, instruction in enumerate(pulse_program):
+                        if i == len(self.smart_cache[pseudoclock]):
+                            # Pad the smart cache out to be as long as the program:
+                            self.smart_cache[pseudoclock].append(None)
+
+                        # Only program instructions that differ from what's in the smart cache:
+                        if self.smart_cache[pseudoclock][i] != instruction:
+                            self.transport.send(
+                                b"set %d %d %d %d"
+                                % (
+                                    pseudoclock,
+                                    i,
+                                    instruction["half_period"],
+                                    instruction["reps"],
+                                ),
+                                expect="ok\r\n",
                             )
-                        )
-                        response = self.conn.readline().decode()
-                        assert (
-                            response == "ok\r\n"
-                        ), f"PrawnBlaster said '{response}', expected 'ok'"
-                        self.smart_cache[pseudoclock][i] = instruction
+                            updated.append(i)
+                    self.transport.flush()
+                    for i in updated:
+                        self.smart_cache[pseudoclock][i] = pulse_program[i]
+            self.table_cache.programmed()
 
         if not self.is_master_pseudoclock:
             # Start the Prawnblaster and have it wait for a hardware trigger
-            self.wait_for_trigger()
+            with self.timing.span("arm"):
+                self.wait_for_trigger()
 
         # All outputs end on 0
         final = {}
@@ -464,6 +513,8 @@ class PrawnBlasterWorker(Worker):
         # Set to wait for trigger:
         self.logger.info("sending hwstart")
         self.send_command_ok("hwstart")
+        # The shot cannot end before the pulse programs have run after this point:
+        self.earliest_end_time = time.monotonic() + self.run_time
 
         running = False
         while not running:
@@ -482,6 +533,7 @@ class PrawnBlasterWorker(Worker):
         # set started = True
         self.started = True
 
+    @timed
     def transition_to_manual(self):
         """Transition the PrawnBlaster back to manual mode from buffered execution at
         the end of a shot.
@@ -490,8 +542,32 @@ class PrawnBlasterWorker(Worker):
             bool: `True` if transition to manual is successful.
         """
 
+        # If PrawnBlaster is master pseudoclock, then it will have it's status checked
+        # in the BLACS tab status check before any transition to manual is called.
+        # However, if it's not the master pseudoclock, we need to check here instead!
+        with self.timing.span("wait_for_completion"):
+            if not self.is_master_pseudoclock:
+                # The shot lasts at least the run time of the pulse programs, so don't
+                # poll before then:
+                remaining = self.earliest_end_time - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                # Wait until shot completes
+                while True:
+                    run_status, clock_status = self.read_status()
+                    if run_status == 0:
+                        break
+                    if run_status in [3, 4, 5]:
+                        raise RuntimeError(
+                            f"Prawnblaster status returned run-status={run_status} during transition to manual"
+                        )
+                    time.sleep(0.01)
+                if self.wait_table is not None:
+                    # Read out any waits not yet read by a status check:
+                    self.read_waits()
+
         if self.wait_table is not None:
-            with h5py.File(self.h5_file, "a") as hdf5_file:
+            with self.timing.span("save_waits"), h5py.File(self.h5_file, "a") as hdf5_file:
                 # Work out how long the waits were, save em, post an event saying so
                 dtypes = [
                     ("label", "a256"),
@@ -510,30 +586,16 @@ class PrawnBlasterWorker(Worker):
                 self.logger.info(str(data))
 
                 hdf5_file.create_dataset("/data/waits", data=data)
+                self.timing.save(hdf5_file)
 
             self.wait_durations_analysed.post(self.h5_file)
 
-        # If PrawnBlaster is master pseudoclock, then it will have it's status checked
-        # in the BLACS tab status check before any transition to manual is called.
-        # However, if it's not the master pseudoclock, we need to check here instead!
-        if not self.is_master_pseudoclock:
-            # Wait until shot completes
-            while True:
-                run_status, clock_status = self.read_status()
-                if run_status == 0:
-                    break
-                if run_status in [3, 4, 5]:
-                    raise RuntimeError(
-                        f"Prawnblaster status returned run-status={run_status} during transition to manual"
-                    )
-                time.sleep(0.01)
-
         return True
 
     def shutdown(self):
         """Cleanly shuts down the connection to the PrawnBlaster hardware."""
 
-        self.conn.close()
+        self.transport.close()
 
     def abort_buffered(self):
         """Aborts a currently running buffered execution.
@@ -545,8 +607,7 @@ class PrawnBlasterWorker(Worker):
             # Only need to send abort signal if we have told the PrawnBlaster to wait
             # for a hardware trigger. Otherwise it's just been programmed with
             # instructions and there is nothing we need to do to abort.
-            self.conn.write(b"abort\r\n")
-            assert self.conn.readline().decode() == "ok\r\n"
+            self.send_command_ok("abort")
             # loop until abort complete
             while self.read_status()[0] != 5:
                 time.sleep(0.5)
@@ -26,6 +26,29 @@ from labscript import (
 )
 import numpy as np
 
+from labscript_devices.generate_code_cache import generate_code_cache
+from labscript_devices.table_digest import create_dataset_with_digest
+from labscript_devices.upload_image import create_upload_image
+
+# Protocol of the upload images of pulse programs, sent as the payload of `setb`:
+SETB_PROTOCOL = "prawnblaster-setb-1"
+
+
+def setb_payload(pulse_program):
+    """Packs a pulse program into the binary payload of the `setb` command.
+
+    Args:
+        pulse_program (numpy.ndarray): Structured array with `half_period` and
+            `reps` fields.
+
+    Returns:
+        bytes: Little-endian 32-bit `half_period`, `reps` pairs.
+    """
+    program_array = np.empty((len(pulse_program), 2), dtype="<u4")
+    program_array[:, 0] = pulse_program["half_period"]
+    program_array[:, 1] = pulse_program["reps"]
+    return program_array.tobytes()
+
 
 class _PrawnBlasterPseudoclock(Pseudoclock):
     """Customized Clockline for use with the PrawnBlaster.
@@ -184,6 +207,7 @@ class PrawnBlaster(PseudoclockDevice):
         clock_frequency=100e6,
         external_clock_pin=None,
         use_wait_monitor=True,
+        cache_generate_code=False,
     ):
         """PrawnBlaster Pseudoclock labscript device.
 
@@ -215,6 +239,10 @@ class PrawnBlaster(PseudoclockDevice):
                 using `clock_frequency`.
             use_wait_monitor (bool, optional): Configure the PrawnBlaster to
                 perform its own wait monitoring.
+            cache_generate_code (bool, optional): Reuse the pulse programs from
+                a previous shot compiled in the same process if the clocks and
+                waits are identical. See
+                :mod:`labscript_devices.generate_code_cache`.
 
         """
 
@@ -254,6 +282,8 @@ class PrawnBlaster(PseudoclockDevice):
         # Wait monitor can only be used if this is the master pseudoclock
         self.use_wait_monitor = use_wait_monitor and self.is_master_pseudoclock
 
+        self.cache_generate_code = cache_generate_code
+
         # Set the BLACS connections
         self.BLACS_connection = com_port
 
@@ -377,102 +407,120 @@ class PrawnBlaster(PseudoclockDevice):
         """
 
         PseudoclockDevice.generate_code(self, hdf5_file)
-        group = self.init_device_group(hdf5_file)
 
-        current_wait_index = 0
-        wait_table = sorted(compiler.wait_table)
+        def generate():
+            group = self.init_device_group(hdf5_file)
 
-        # For each pseudoclock
-        for i, pseudoclock in enumerate(self.pseudoclocks):
             current_wait_index = 0
-
-            # Compress clock instructions with the same half_period
-            reduced_instructions = []
-            for instruction in pseudoclock.clock:
-                if instruction == "WAIT":
-                    # If we're using the internal wait monitor, set the timeout
-                    if self.use_wait_monitor:
-                        # Get the wait timeout value
-                        wait_timeout = compiler.wait_table[
-                            wait_table[current_wait_index]
-                        ][1]
-                        current_wait_index += 1
-                        # The following half_period and reps indicates a wait instruction
-                        reduced_instructions.append(
-                            {
-                                "half_period": round(
-                                    wait_timeout / (self.clock_resolution / 2)
-                                ),
-                                "reps": 0,
-                            }
-                        )
-                        continue
-                    # Else, set an indefinite wait and wait for a trigger from something else.
+            wait_table = sorted(compiler.wait_table)
+
+            # For each pseudoclock
+            for i, pseudoclock in enumerate(self.pseudoclocks):
+                current_wait_index = 0
+
+                # Compress clock instructions with the same half_period
+                reduced_instructions = []
+                for instruction in pseudoclock.clock:
+                    if instruction == "WAIT":
+                        # If we're using the internal wait monitor, set the timeout
+                        if self.use_wait_monitor:
+                            # Get the wait timeout value
+                            wait_timeout = compiler.wait_table[
+                                wait_table[current_wait_index]
+                            ][1]
+                            current_wait_index += 1
+                            # The following half_period and reps indicates a wait instruction
+                            reduced_instructions.append(
+                                {
+                                    "half_period": round(
+                                        wait_timeout / (self.clock_resolution / 2)
+                                    ),
+                                    "reps": 0,
+                                }
+                            )
+                            continue
+                        # Else, set an indefinite wait and wait for a trigger from something else.
+                        else:
+                            # Two waits in a row are an indefinite wait
+                            reduced_instructions.append(
+                                {
+                                    "half_period": 2 ** 32 - 1,
+                                    "reps": 0,
+                                }
+                            )
+                            reduced_instructions.append(
+                                {
+                                    "half_period": 2 ** 32 - 1,
+                                    "reps": 0,
+                                }
+                            )
+
+                    # Normal instruction
+                    reps = instruction["reps"]
+                    # half_period is in quantised units:
+                    half_period = int(round(instruction["step"] / self.clock_resolution))
+                    if (
+                        # If there is a previous instruction
+                        reduced_instructions
+                        # And it's not a wait
+                        and reduced_instructions[-1]["reps"] != 0
+                        # And the half_periods match
+                        and reduced_instructions[-1]["half_period"] == half_period
+                        # And the sum of the previous reps and current reps won't push it over the limit
+                        and (reduced_instructions[-1]["reps"] + reps) < (2 ** 32 - 1)
+                    ):
+                        # Combine instructions!
+                        reduced_instructions[-1]["reps"] += reps
                     else:
-                        # Two waits in a row are an indefinite wait
-                        reduced_instructions.append(
-                            {
-                                "half_period": 2 ** 32 - 1,
-                                "reps": 0,
-                            }
-                        )
+                        # New instruction
                         reduced_instructions.append(
-                            {
-                                "half_period": 2 ** 32 - 1,
-                                "reps": 0,
-                            }
+                            {"half_period": half_period, "reps": reps}
                         )
 
-                # Normal instruction
-                reps = instruction["reps"]
-                # half_period is in quantised units:
-                half_period = int(round(instruction["step"] / self.clock_resolution))
-                if (
-                    # If there is a previous instruction
-                    reduced_instructions
-                    # And it's not a wait
-                    and reduced_instructions[-1]["reps"] != 0
-                    # And the half_periods match
-                    and reduced_instructions[-1]["half_period"] == half_period
-                    # And the sum of the previous reps and current reps won't push it over the limit
-                    and (reduced_instructions[-1]["reps"] + reps) < (2 ** 32 - 1)
-                ):
-                    # Combine instructions!
-                    reduced_instructions[-1]["reps"] += reps
-                else:
-                    # New instruction
-                    reduced_instructions.append(
-                        {"half_period": half_period, "reps": reps}
+                # Only add this if there is room in the instruction table. The PrawnBlaster
+                # firmware has extre room at the end for an instruction that is always 0
+                # and cannot be set over serial!
+                if len(reduced_instructions) != self.max_instructions:
+                    # The following half_period and reps indicates a stop instruction:
+                    reduced_instructions.append({"half_period": 0, "reps": 0})
+
+                # Check we have not exceeded the maximum number of supported instructions
+                # for this number of speudoclocks
+                if len(reduced_instructions) > self.max_instructions:
+                    raise LabscriptError(
+                        f"{self.description} {self.name}.clocklines[{i}] has too many instructions. It has {len(reduced_instructions)} and can only support {self.max_instructions}"
                     )
 
-            # Only add this if there is room in the instruction table. The PrawnBlaster
-            # firmware has extre room at the end for an instruction that is always 0
-            # and cannot be set over serial!
-            if len(reduced_instructions) != self.max_instructions:
-                # The following half_period and reps indicates a stop instruction:
-                reduced_instructions.append({"half_period": 0, "reps": 0})
-
-            # Check we have not exceeded the maximum number of supported instructions
-            # for this number of speudoclocks
-            if len(reduced_instructions) > self.max_instructions:
-                raise LabscriptError(
-                    f"{self.description} {self.name}.clocklines[{i}] has too many instructions. It has {len(reduced_instructions)} and can only support {self.max_instructions}"
+                # Store these instructions to the h5 file:
+                dtypes = [("half_period", int), ("reps", int)]
+                pulse_program = np.zeros(len(reduced_instructions), dtype=dtypes)
+                for j, instruction in enumerate(reduced_instructions):
+                    pulse_program[j]["half_period"] = instruction["half_period"]
+                    pulse_program[j]["reps"] = instruction["reps"]
+                create_dataset_with_digest(
+                    group,
+                    f"PULSE_PROGRAM_{i}",
+                    pulse_program,
+                    compression=config.compression,
+                )
+                # And the bytes sent to program them in one go:
+                create_upload_image(
+                    group, f"UPLOAD_IMAGE_{i}", setb_payload(pulse_program), SETB_PROTOCOL
                 )
 
-            # Store these instructions to the h5 file:
-            dtypes = [("half_period", int), ("reps", int)]
-            pulse_program = np.zeros(len(reduced_instructions), dtype=dtypes)
-            for j, instruction in enumerate(reduced_instructions):
-                pulse_program[j]["half_period"] = instruction["half_period"]
-                pulse_program[j]["reps"] = instruction["reps"]
-            group.create_dataset(
-                f"PULSE_PROGRAM_{i}", compression=config.compression, data=pulse_program
+            # This is needed so the BLACS worker knows whether or not to be a wait monitor
+            self.set_property(
+                "is_master_pseudoclock",
+                self.is_master_pseudoclock,
+                location="device_properties",
             )
+            self.set_property("stop_time", self.stop_time, location="device_properties")
 
-        # This is needed so the BLACS worker knows whether or not to be a wait monitor
-        self.set_property(
-            "is_master_pseudoclock",
+        inputs = [
+            [pseudoclock.clock for pseudoclock in self.pseudoclocks],
+            compiler.wait_table,
+            self.use_wait_monitor,
             self.is_master_pseudoclock,
-            location="device_properties",
-        )
-        self.set_property("stop_time", self.stop_time, location="device_properties")
+            self.stop_time,
+        ]
+        generate_code_cache.run(self, hdf5_file, inputs, generate)
@@ -16,6 +16,8 @@ import h5py
 import numpy as np
 
 import labscript_utils.properties as properties
+from labscript_devices.trace_cache import cached_traces
+from labscript_devices.clock_ticks import get_clock_ticks
 
 
 class PrawnBlasterParser(object):
@@ -30,6 +32,7 @@ class PrawnBlasterParser(object):
         self.name = device.name
         self.device = device
 
+    @cached_traces
     def get_traces(self, add_trace, clock=None):
         """Reads the shot file and extracts hardware instructions to produce
         runviewer traces.
@@ -44,14 +47,7 @@ class PrawnBlasterParser(object):
         """
 
         if clock is not None:
-            times, clock_value = clock[0], clock[1]
-            clock_indices = np.where((clock_value[1:] - clock_value[:-1]) == 1)[0] + 1
-            # If initial clock value is 1, then this counts as a rising edge
-            # (clock should be 0 before experiment) but this is not picked up
-            # by the above code. So we insert it!
-            if clock_value[0] == 1:
-                clock_indices = np.insert(clock_indices, 0, 0)
-            clock_ticks = times[clock_indices]
+            clock_ticks = get_clock_ticks(clock)
 
         # get the pulse program
         pulse_programs = []
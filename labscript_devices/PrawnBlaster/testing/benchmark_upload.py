@@ -0,0 +1,116 @@
+"""Benchmark of programming a PrawnBlaster.
+
+Runs PrawnBlasterWorker.transition_to_buffered for a scan of shots against an
+emulated PrawnBlaster on a pseudoterminal, which responds to each command after
+a fixed latency, emulating the round trip time of its USB serial link. Each shot
+changes a few percent of the instructions of a long pulse program, so that they
+are programmed one at a time with `set` commands. Prints the mean time per shot
+and the latency of each command, with and without pipelining commands ahead of
+their responses. Requires a Unix-like system. Run with:
+
+    python benchmark_upload.py [n_shots] [latency]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from labscript import *
+from labscript_devices.DummyIntermediateDevice import DummyIntermediateDevice
+from labscript_devices.PrawnBlaster.labscript_devices import PrawnBlaster
+from labscript_devices.PrawnBlaster.blacs_workers import PrawnBlasterWorker
+from labscript_devices.serial_emulator import SerialDeviceEmulator
+
+N_SHOTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+# Time between the emulated PrawnBlaster receiving a command and responding:
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 1e-3
+N_PULSES = 2000
+# Pulses whose durations change between shots:
+N_CHANGED = 50
+
+
+class PrawnBlasterEmulator(SerialDeviceEmulator):
+    """Responds to the commands used by the worker, storing the instructions of
+    pseudoclock 0"""
+
+    def __init__(self, *args, **kwargs):
+        SerialDeviceEmulator.__init__(self, *args, **kwargs)
+        self.instructions = {}
+
+    def handle_command(self, command):
+        name, *args = command.split()
+        if name == 'status':
+            return 'run-status:0 clock-status:0\r\n'
+        elif name == 'version':
+            return 'version: 1.2.0\r\n'
+        elif name == 'board':
+            return 'board: pico1\r\n'
+        elif name == 'setb':
+            pseudoclock, start, n = (int(arg) for arg in args)
+            self.send('ready\r\n')
+            program = np.frombuffer(self.read_bytes(8 * n), dtype='<u4').reshape(n, 2)
+            for i, (half_period, reps) in enumerate(program, start):
+                self.instructions[i] = (half_period, reps)
+        elif name == 'set':
+            pseudoclock, i, half_period, reps = (int(arg) for arg in args)
+            self.instructions[i] = (half_period, reps)
+        return 'ok\r\n'
+
+
+def compile_shot(path, shot):
+    labscript_init(path, new=True, overwrite=True)
+    PrawnBlaster('prawn', com_port='emulated')
+    DummyIntermediateDevice('intermediatedevice', parent_device=prawn.clocklines[0])
+    DigitalOut('do', intermediatedevice, 'do0')
+    start()
+    t = 0
+    rng = np.random.default_rng(shot)
+    changed = set(rng.choice(N_PULSES, N_CHANGED, replace=False))
+    for i in range(N_PULSES):
+        # Pulse durations differ between shots for the changed pulses, and never
+        # equal the gaps between pulses, so that the instructions are not merged:
+        duration = 1e-5 * (20 + (i in changed) * (1 + shot % 3))
+        do.go_high(t)
+        t += duration
+        do.go_low(t)
+        t += 1e-5 * (1 + i % 7)
+    stop(t + 1e-3)
+    labscript_cleanup()
+
+
+def run(emulator, paths, window):
+    worker = PrawnBlasterWorker.__new__(PrawnBlasterWorker)
+    worker.com_port = emulator.port
+    worker.num_pseudoclocks = 1
+    worker.out_pins = [9]
+    worker.in_pins = [0]
+    worker.pico_board = 'pico1'
+    worker.pipeline_window = window
+    worker.init()
+    # The first shot programs the full table in binary and is not timed:
+    worker.transition_to_buffered('prawn', paths[0], {}, fresh=True)
+    worker.transport.latencies.clear()
+    start_time = time.perf_counter()
+    for path in paths[1:]:
+        worker.transition_to_buffered('prawn', path, {}, fresh=False)
+    time_per_shot = (time.perf_counter() - start_time) / (len(paths) - 1)
+    report = worker.transport.latency_report()
+    worker.shutdown()
+    return time_per_shot, report
+
+
+with tempfile.TemporaryDirectory() as tempdir:
+    paths = [os.path.join(tempdir, 'shot_%d.h5' % shot) for shot in range(N_SHOTS + 1)]
+    for shot, path in enumerate(paths):
+        compile_shot(path, shot)
+
+    print(
+        '%d shots, %d of %d pulses changed per shot, %.1f ms latency'
+        % (N_SHOTS, N_CHANGED, N_PULSES, 1e3 * LATENCY)
+    )
+    for window in [1, PrawnBlasterWorker.pipeline_window]:
+        with PrawnBlasterEmulator(latency=LATENCY) as emulator:
+            time_per_shot, report = run(emulator, paths, window)
+        print('window %d: %.1f ms/shot' % (window, 1e3 * time_per_shot))
+        print('    ' + report.replace('\n', '\n    '))
@@ -18,17 +18,25 @@ import numpy as np
 import re
 import time
 
+from labscript_devices.table_digest import TableCache
+from labscript_devices.serial_transport import SerialTransport, SerialTransportError
+from labscript_devices.worker_timing import timed
+
 class PrawnDOInterface(object):
 
     min_version = (1, 2, 0)
     """Minimum compatible firmware version tuple"""
 
+    pipeline_window = 32
+    """Number of commands sent ahead of their responses by :meth:`send_commands_ok`"""
+
     def __init__(self, com_port, pico_board):
         global serial; import serial
         global struct; import struct
 
         self.timeout = 0.2
         self.conn = serial.Serial(com_port, 1000000, timeout=self.timeout)
+        self.transport = SerialTransport(self.conn, window=self.pipeline_window)
         self.pico_board = pico_board
         
         version = self.get_version()
@@ -76,10 +84,7 @@ class PrawnDOInterface(object):
     def _read_full_buffer(self):
         '''Used to get any extra lines from device after a failed send_command'''
 
-        resp = self.conn.readlines()
-        str_resp = ''.join([st.decode() for st in resp])
-
-        return str_resp
+        return self.transport.readlines()
         
     def send_command(self, command, readlines=False):
         '''Sends the supplied string command and checks for a response.
@@ -94,15 +99,7 @@ class PrawnDOInterface(object):
         Returns:
             str: String response from the PrawnDO
         '''
-        command += '\r\n'
-        self.conn.write(command.encode())
-
-        if readlines:
-            str_resp = self._read_full_buffer()
-        else:
-            str_resp = self.conn.readline().decode()
-
-        return str_resp
+        return self.transport.query(command, n_lines=None if readlines else 1)
     
     def send_command_ok(self, command):
         '''Sends the supplied string command and confirms 'ok' response.
@@ -114,11 +111,26 @@ class PrawnDOInterface(object):
             LabscriptError: If response is not `ok\\r\\n`
         '''
 
-        resp = self.send_command(command)
-        if resp != 'ok\r\n':
-            # get complete error message
-            resp += self._read_full_buffer()
-            raise LabscriptError(f"Command '{command:s}' failed. Got response '{repr(resp)}'")
+        self.send_commands_ok([command])
+
+    def send_commands_ok(self, commands):
+        '''Sends the supplied string commands and confirms an 'ok' response to each.
+
+        Commands are sent without waiting for the response to the previous
+        command, up to :attr:`pipeline_window` commands ahead.
+
+        Args:
+            commands (iterable of str): String commands to send.
+
+        Raises:
+            LabscriptError: If any response is not `ok\\r\\n`
+        '''
+        try:
+            for command in commands:
+                self.transport.send(command, expect='ok\r\n')
+            self.transport.flush()
+        except SerialTransportError as e:
+            raise LabscriptError(str(e))
     
     def status(self):
         '''Reads the status of the PrawnDO
@@ -167,25 +179,24 @@ class PrawnDOInterface(object):
             pulse_program (numpy.ndarray): Structured array of program to send.
                 Must have first column as bit sets (<u2) and second as reps (<u4).
         '''
-        self.conn.write('adm 0 {:x}\n'.format(len(pulse_program)).encode())
-        resp = self.conn.readline().decode()
-        if resp != 'ready\r\n':
-            resp += self._read_full_buffer()
-            raise LabscriptError(f'adm command failed, got response {repr(resp)}')
-        self.conn.write(pulse_program.tobytes())
-        resp = self.conn.readline().decode()
-        if resp != 'ok\r\n':
-            resp += self._read_full_buffer()
-            raise LabscriptError(f'Program not written successfully, got response {repr(resp)}')
+        try:
+            self.transport.query('adm 0 {:x}'.format(len(pulse_program)), expect='ready\r\n')
+        except SerialTransportError as e:
+            raise LabscriptError(f'adm command failed: {e}')
+        try:
+            self.transport.send_data(pulse_program.tobytes(), expect='ok\r\n').result()
+        except SerialTransportError as e:
+            raise LabscriptError(f'Program not written successfully: {e}')
 
     def close(self):
-        self.conn.close()
+        self.transport.close()
 
 class PrawnDOWorker(Worker):
     def init(self):
         self.intf = PrawnDOInterface(self.com_port, self.pico_board)        
 
         self.smart_cache = {'do_table':None, 'reps':None}
+        self.table_cache = TableCache()
 
     def _dict_to_int(self, d):
         """Converts dictionary of outputs to an integer mask.
@@ -266,75 +277,85 @@ class PrawnDOWorker(Worker):
 
         return self._int_to_dict(resp_i)
 
+    @timed
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
 
         if fresh:
             self.smart_cache = {'pulse_program':None}
 
-        with h5py.File(h5file, 'r') as hdf5_file:
+        with self.timing.span('read_shot_file'), h5py.File(h5file, 'r') as hdf5_file:
             group = hdf5_file['devices'][device_name]
             if 'pulse_program' not in group:
                 # if no output commanded, return
                 return
             self.device_properties = labscript_utils.properties.get(
                 hdf5_file, device_name, "device_properties")
-            pulse_program = group['pulse_program'][()]
-
-        # configure clock from device properties
-        ext = self.device_properties['external_clock']
-        freq = self.device_properties['clock_frequency']
-        self.intf.send_command_ok(f"clk {ext:d} {freq:.0f}")
-
-        # check if it is more efficient to fully refresh
-        if not fresh and self.smart_cache['pulse_program'] is not None:
-
-            # get more convenient handle to smart cache array
-            curr_program = self.smart_cache['pulse_program']
-
-            # if arrays aren't of same shape, only compare up to smaller array size
-            n_curr = len(curr_program)
-            n_new = len(pulse_program)
-            if n_curr > n_new:
-                # technically don't need to reprogram current elements beyond end of new elements
-                new_inst = np.sum(curr_program[:n_new] != pulse_program)
-            elif n_curr < n_new:
-                n_diff = n_new - n_curr
-                val_diffs = np.sum(curr_program != pulse_program[:n_curr])
-                new_inst = val_diffs + n_diff
-            else:
-                new_inst = np.sum(curr_program != pulse_program)
-
-            if new_inst / n_new > 0.1:
-                fresh = True
-
-        # if fresh or not smart cache, program full table as a batch
-        # this is faster than going line by line
-        if fresh or self.smart_cache['pulse_program'] is None:
-            self.intf.send_command_ok('cls') # clear old program
-            self.intf.adm_batch(pulse_program)
-            self.smart_cache['pulse_program'] = pulse_program
-        else:
-            # only program table lines that have changed
-            n_cache = len(self.smart_cache['pulse_program'])
-            for i, instr in enumerate(pulse_program):
-                if i >= n_cache:
-                    print(f'programming step {i}')
-                    self.intf.send_command_ok(f'set {i:x} {instr[0]:x} {instr[1]:x}')
-                    self.smart_cache['pulse_program'][i] = instr
-
-                elif (self.smart_cache['pulse_program'][i] != instr):
-
-                    print(f'programming step {i}')
-                    self.intf.send_command_ok(f'set {i:x} {instr[0]:x} {instr[1]:x}')
-                    self.smart_cache['pulse_program'][i] = instr
+            # not re-read if unchanged since it was last programmed
+            pulse_program, changed = self.table_cache.read(group['pulse_program'], fresh)
+
+        with self.timing.span('program'):
+            # configure clock from device properties
+            ext = self.device_properties['external_clock']
+            freq = self.device_properties['clock_frequency']
+            self.intf.send_command_ok(f"clk {ext:d} {freq:.0f}")
+
+            # skip programming if identical to the program already on the device
+            if changed:
+                # check if it is more efficient to fully refresh
+                if not fresh and self.smart_cache['pulse_program'] is not None:
+
+                    # get more convenient handle to smart cache array
+                    curr_program = self.smart_cache['pulse_program']
+
+                    # if arrays aren't of same shape, only compare up to smaller array size
+                    n_curr = len(curr_program)
+                    n_new = len(pulse_program)
+                    if n_curr > n_new:
+                        # technically don't need to reprogram current elements beyond end of new elements
+                        new_inst = np.sum(curr_program[:n_new] != pulse_program)
+                    elif n_curr < n_new:
+                        n_diff = n_new - n_curr
+                        val_diffs = np.sum(curr_program != pulse_program[:n_curr])
+                        new_inst = val_diffs + n_diff
+                    else:
+                        new_inst = np.sum(curr_program != pulse_program)
+
+                    if new_inst / n_new > 0.1:
+                        fresh = True
+
+                # if fresh or not smart cache, program full table as a batch
+                # this is faster than going line by line
+                if fresh or self.smart_cache['pulse_program'] is None:
+                    self.intf.send_command_ok('cls') # clear old program
+                    self.intf.adm_batch(pulse_program)
+                    self.smart_cache['pulse_program'] = pulse_program
+                else:
+                    # only program table lines that have changed
+                    n_cache = len(self.smart_cache['pulse_program'])
+                    updated = [
+                        i
+                        for i, instr in enumerate(pulse_program)
+                        if i >= n_cache or self.smart_cache['pulse_program'][i] != instr
+                    ]
+                    print(f'programming {len(updated)} steps')
+                    self.intf.send_commands_ok(
+                        f'set {i:x} {pulse_program[i][0]:x} {pulse_program[i][1]:x}'
+                        for i in updated
+                    )
+                    # update the smart cache once all lines are confirmed
+                    for i in updated:
+                        self.smart_cache['pulse_program'][i] = pulse_program[i]
+            self.table_cache.programmed()
 
         final_values = self._int_to_dict(pulse_program[-1][0])
 
         # start program, waiting for beginning trigger from parent
-        self.intf.send_command_ok('run')
+        with self.timing.span('arm'):
+            self.intf.send_command_ok('run')
 
         return final_values
 
+    @timed
     def transition_to_manual(self):
         """Transition to manual mode after buffered execution completion.
         
@@ -23,6 +23,8 @@ from labscript import (
 )
 import numpy as np
 
+from labscript_devices.table_digest import create_dataset_with_digest
+
 class _PrawnDOPseudoclock(Pseudoclock):
     """Dummy pseudoclock for use with PrawnDO.
     
@@ -312,7 +314,7 @@ class PrawnDO(PseudoclockDevice):
         pulse_program = np.zeros(len(reps), dtype=dtype)
         pulse_program['bit_sets'] = bit_sets
         pulse_program['reps'] = reps
-        group.create_dataset('pulse_program', data=pulse_program)
+        create_dataset_with_digest(group, 'pulse_program', pulse_program)
 
 
 class _PrawnDOIntermediateDevice(IntermediateDevice):
@@ -13,6 +13,8 @@
 
 from labscript_devices import BLACS_tab, runviewer_parser
 from labscript_devices.PulseBlaster import PulseBlaster, PulseBlasterParser
+from labscript_devices.table_digest import create_dataset_with_digest, TableCache
+from labscript_devices.generate_code_cache import generate_code_cache
 from labscript import PseudoclockDevice, config
 
 import numpy as np
@@ -39,7 +41,7 @@ class PulseBlaster_No_DDS(PulseBlaster):
         
         # Okay now write it to the file: 
         group = hdf5_file['/devices/'+self.name]  
-        group.create_dataset('PULSE_PROGRAM', compression=config.compression,data = pb_inst_table)         
+        create_dataset_with_digest(group, 'PULSE_PROGRAM', pb_inst_table, compression=config.compression)
         self.set_property('stop_time', self.stop_time, location='device_properties')
         
     def generate_code(self, hdf5_file):
@@ -47,9 +49,14 @@ class PulseBlaster_No_DDS(PulseBlaster):
         self.init_device_group(hdf5_file)
         PseudoclockDevice.generate_code(self, hdf5_file)
         dig_outputs, ignore = self.get_direct_outputs()
-        pb_inst = self.convert_to_pb_inst(dig_outputs, [], {}, {}, {})
         self._check_wait_monitor_ok()
-        self.write_pb_inst_to_h5(pb_inst, hdf5_file) 
+
+        def generate():
+            pb_inst = self.convert_to_pb_inst(dig_outputs, [], {}, {}, {})
+            self.write_pb_inst_to_h5(pb_inst, hdf5_file)
+
+        inputs = self._generate_code_inputs(dig_outputs, [])
+        generate_code_cache.run(self, hdf5_file, inputs, generate)
         
 
 from blacs.tab_base_classes import Worker, define_state
@@ -242,6 +249,9 @@ class PulseblasterNoDDSWorker(Worker):
         self.pb_read_status = pb_read_status
         self.smart_cache = {'pulse_program':None,'ready_to_go':False,
                             'initial_values':None}
+        # Digests of the tables last programmed, so that unchanged tables need
+        # not be read from the shot file:
+        self.table_cache = TableCache()
                             
         # An event for checking when all waits (if any) have completed, so that
         # we can tell the difference between a wait and the end of an experiment.
@@ -330,16 +340,20 @@ class PulseblasterNoDDSWorker(Worker):
                                                  + hdf5_file['waits'][:]['timeout'].sum()
                                                  + group.attrs['time_based_stop_workaround_extra_time'])
             
-            # Now for the pulse program:
-            pulse_program = group['PULSE_PROGRAM'][2:]
+            # Now for the pulse program. If it is unchanged since it was last
+            # programmed, this is the previously read copy and it is not re-read:
+            pulse_program, pulse_program_changed = self.table_cache.read(group['PULSE_PROGRAM'], fresh)
+            pulse_program = pulse_program[2:]
+            pulse_program_changed = fresh or pulse_program_changed and (
+                len(self.smart_cache['pulse_program']) != len(pulse_program) or
+                (self.smart_cache['pulse_program'] != pulse_program).any()
+            )
             
             #Let's get the final state of the pulseblaster. z's are the args we don't need:
             flags,z,z,z = pulse_program[-1]
             
             if fresh or (self.smart_cache['initial_values'] != initial_values) or \
-                (len(self.smart_cache['pulse_program']) != len(pulse_program)) or \
-                (self.smart_cache['pulse_program'] != pulse_program).any() or \
-                not self.smart_cache['ready_to_go']:
+                pulse_program_changed or not self.smart_cache['ready_to_go']:
                 # Enter programming mode
                 pb_start_programming(PULSE_PROGRAM)
             
@@ -374,8 +388,7 @@ class PulseblasterNoDDSWorker(Worker):
                 # Line one is a continue with the current front panel values:
                 pb_inst_pbonly(initial_flags, CONTINUE, 0, 100)
                 # Now the rest of the program:
-                if fresh or len(self.smart_cache['pulse_program']) != len(pulse_program) or \
-                (self.smart_cache['pulse_program'] != pulse_program).any():
+                if pulse_program_changed:
                     self.smart_cache['pulse_program'] = pulse_program
                     for args in pulse_program:
                         pb_inst_pbonly(*args)
@@ -415,7 +428,8 @@ class PulseblasterNoDDSWorker(Worker):
             return_flags = str(bin(flags)[2:]).rjust(self.num_DO,'0')[::-1]
             for i in range(self.num_DO):
                 return_values['flag %d'%i] = return_flags[i]
-                
+
+            self.table_cache.programmed()
             return return_values
             
     def check_status(self):
@@ -19,6 +19,7 @@ import numpy as np
 from labscript_utils import dedent
 
 from labscript_devices.IMAQdxCamera.blacs_workers import IMAQdxCameraWorker
+from labscript_devices.IMAQdxCamera.pixel_formats import PACKED_FORMATS, PackedFrame
 
 # Don't import API yet so as not to throw an error, allow worker to run as a dummy
 # device, or for subclasses to import this module to inherit classes without requiring API
@@ -46,6 +47,10 @@ class Pylon_Camera(object):
         self.nodeMap = self.camera.GetNodeMap()
         self._abort_acquisition = False
         self.exception_on_failed_shot = True
+        # Whether to return frames in packed pixel formats without unpacking them:
+        self.keep_packed = False
+        self.pixel_format = None
+        self.shape = None
 
 
     def set_attributes(self, attributes_dict):
@@ -132,6 +137,8 @@ class Pylon_Camera(object):
         """Configure acquisition by calling StartGrabbing with appropriate
         grab strategy: LatestImageOnly for continuous, OneByOne otherwise.
         """
+        self.pixel_format = self.get_attribute('PixelFormat')
+        self.shape = (self.get_attribute('Height'), self.get_attribute('Width'))
         self.camera.MaxNumBuffer = bufferCount
         if continuous:
             self.camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
@@ -144,7 +151,11 @@ class Pylon_Camera(object):
         result = self.camera.RetrieveResult(self.timeout,
                                         pylon.TimeoutHandling_ThrowException)
         if result.GrabSucceeded():
-            img = result.Array
+            if self.keep_packed and self.pixel_format in PACKED_FORMATS:
+                data = np.frombuffer(result.GetBuffer(), dtype=np.uint8).copy()
+                img = PackedFrame(data, self.pixel_format, self.shape)
+            else:
+                img = result.Array
             result.Release()
             return img
         else:
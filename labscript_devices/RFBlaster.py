@@ -11,11 +11,71 @@
 #                                                                   #
 #####################################################################
 import os
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from labscript import PseudoclockDevice, Pseudoclock, ClockLine, IntermediateDevice, DDS, config, startupinfo, LabscriptError, set_passed_properties
 import numpy as np
 from labscript_devices import BLACS_tab, runviewer_parser
+from labscript_devices.generate_code_cache import generate_code_cache
+from labscript_devices.table_digest import compute_digest
 from labscript_utils.setup_logging import setup_logging
 
+# Assembly and binary code of recently compiled DDS programs, keyed by a digest
+# of their diff tables, so that caspr is not run again for programs that are
+# unchanged since a previous shot compiled in the same process:
+_binary_cache = OrderedDict()
+_BINARY_CACHE_SIZE = 16
+
+
+def _binary_cache_key(caspr, diff_tables):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(caspr.encode('utf8'))
+    for diff_table in diff_tables:
+        h.update(compute_digest(diff_table).encode('utf8'))
+    return h.hexdigest()
+
+
+def _compile_dds_program(caspr, rfjuice_folder, compileD, diff_tables):
+    """Compile the diff tables of one DDS to assembly and then, using caspr, to
+    machine code. Returns the assembly code and the binary data."""
+    import tempfile
+    from subprocess import Popen, PIPE
+    # Create temporary files, get their paths, and close them:
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        temp_assembly_filepath = f.name
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        temp_binary_filepath = f.name
+    
+    try:
+        # Compile to assembly:
+        with open(temp_assembly_filepath,'w') as assembly_file:
+            for i, dtab in enumerate(diff_tables):
+                compileD(dtab, assembly_file, init=(i == 0),
+                         jump_to_start=(i == 0),
+                         jump_from_end=False,
+                         close_end=(i == len(diff_tables) - 1),
+                         local_loop_pre = str(i),
+                         set_defaults = (i==0))
+        with open(temp_assembly_filepath,) as assembly_file:
+            assembly_code = assembly_file.read()
+        # compile to binary:
+        compilation = Popen([caspr,temp_assembly_filepath,temp_binary_filepath],
+                             stdout=PIPE, stderr=PIPE, cwd=rfjuice_folder,startupinfo=startupinfo)
+        stdout, stderr = compilation.communicate()
+        if compilation.returncode:
+            print(stdout)
+            raise LabscriptError('RFBlaster compilation exited with code %d\n\n'%compilation.returncode +
+                                 'Stdout was:\n %s\n'%stdout + 'Stderr was:\n%s\n'%stderr)
+        with open(temp_binary_filepath,'rb') as binary_file:
+            binary_data = binary_file.read()
+    finally:
+        # Delete the temporary files:
+        os.remove(temp_assembly_filepath)
+        os.remove(temp_binary_filepath)
+    return assembly_code, binary_data
+
+
 # Define a RFBlasterPseudoclock that only accepts one child clockline
 class RFBlasterPseudoclock(Pseudoclock):    
     def add_device(self, device):
@@ -39,9 +99,13 @@ class RFBlaster(PseudoclockDevice):
     wait_day = trigger_delay
     
     @set_passed_properties()
-    def __init__(self, name, ip_address, trigger_device=None, trigger_connection=None):
+    def __init__(self, name, ip_address, trigger_device=None, trigger_connection=None, cache_generate_code=False):
         PseudoclockDevice.__init__(self, name, trigger_device, trigger_connection)
         self.BLACS_connection = ip_address
+        # If cache_generate_code=True, the compiled binaries are reused from a previous
+        # shot compiled in the same process if the table data and triggers are identical.
+        # See labscript_devices.generate_code_cache.
+        self.cache_generate_code = cache_generate_code
         
         # create Pseudoclock and clockline
         self._pseudoclock = RFBlasterPseudoclock('%s_pseudoclock'%name, self, 'clock') # possibly a better connection name than 'clock'?
@@ -82,8 +146,6 @@ class RFBlaster(PseudoclockDevice):
         from rfblaster.rfjuice.cython.make_diff_table import make_diff_table
         from rfblaster.rfjuice.cython.compile import compileD
         # from rfblaster.rfjuice.compile import compileD
-        import tempfile
-        from subprocess import Popen, PIPE
         
         # Generate clock and save raw instructions to the h5 file:
         PseudoclockDevice.generate_code(self, hdf5_file)
@@ -98,85 +160,77 @@ class RFBlaster(PseudoclockDevice):
             data['freq%s'%connection] = dds.frequency.raw_output
             data['amp%s'%connection] = dds.amplitude.raw_output
             data['phase%s'%connection] = dds.phase.raw_output
-        group = hdf5_file['devices'].create_group(self.name)
-        group.create_dataset('TABLE_DATA',compression=config.compression, data=data)
+
+        def generate():
+            group = hdf5_file['devices'].create_group(self.name)
+            group.create_dataset('TABLE_DATA',compression=config.compression, data=data)
         
-        # Quantise the data and save it to the h5 file:
-        quantised_dtypes = [('time',np.int64),
-                            ('amp0',np.int32), ('freq0',np.int32), ('phase0',np.int32),
-                            ('amp1',np.int32), ('freq1',np.int32), ('phase1',np.int32)]
+            # Quantise the data and save it to the h5 file:
+            quantised_dtypes = [('time',np.int64),
+                                ('amp0',np.int32), ('freq0',np.int32), ('phase0',np.int32),
+                                ('amp1',np.int32), ('freq1',np.int32), ('phase1',np.int32)]
 
-        quantised_data = np.zeros(len(times),dtype=quantised_dtypes)
-        quantised_data['time'] = np.array(c.tT*1e6*data['time']+0.5)
-        for dds in range(2):
-            # TODO: bounds checking
-            # Adding 0.5 to each so that casting to integer rounds:
-            quantised_data['freq%d'%dds] = np.array(c.fF*1e-6*data['freq%d'%dds] + 0.5)
-            quantised_data['amp%d'%dds]  = np.array((2**c.bitsA - 1)*data['amp%d'%dds] + 0.5)
-            quantised_data['phase%d'%dds] = np.array(c.pP*data['phase%d'%dds] + 0.5)
-        group.create_dataset('QUANTISED_DATA',compression=config.compression, data=quantised_data)
-        # Generate some assembly code and compile it to machine code:
-        assembly_group = group.create_group('ASSEMBLY_CODE')
-        binary_group = group.create_group('BINARY_CODE')
-        diff_group = group.create_group('DIFF_TABLES')
-        # When should the RFBlaster wait for a trigger?
-        quantised_trigger_times = np.array([c.tT*1e6*t + 0.5 for t in self.trigger_times], dtype=np.int64)
-        for dds in range(2):
-            abs_table = np.zeros((len(times), 4),dtype=np.int64)
-            abs_table[:,0] = quantised_data['time']
-            abs_table[:,1] = quantised_data['amp%d'%dds]
-            abs_table[:,2] = quantised_data['freq%d'%dds]
-            abs_table[:,3] = quantised_data['phase%d'%dds]
+            quantised_data = np.zeros(len(times),dtype=quantised_dtypes)
+            quantised_data['time'] = np.array(c.tT*1e6*data['time']+0.5)
+            for dds in range(2):
+                # TODO: bounds checking
+                # Adding 0.5 to each so that casting to integer rounds:
+                quantised_data['freq%d'%dds] = np.array(c.fF*1e-6*data['freq%d'%dds] + 0.5)
+                quantised_data['amp%d'%dds]  = np.array((2**c.bitsA - 1)*data['amp%d'%dds] + 0.5)
+                quantised_data['phase%d'%dds] = np.array(c.pP*data['phase%d'%dds] + 0.5)
+            group.create_dataset('QUANTISED_DATA',compression=config.compression, data=quantised_data)
+            # Generate some assembly code and compile it to machine code:
+            assembly_group = group.create_group('ASSEMBLY_CODE')
+            binary_group = group.create_group('BINARY_CODE')
+            diff_group = group.create_group('DIFF_TABLES')
+            # When should the RFBlaster wait for a trigger?
+            quantised_trigger_times = np.array([c.tT*1e6*t + 0.5 for t in self.trigger_times], dtype=np.int64)
+            diff_tables = {}
+            for dds in range(2):
+                abs_table = np.zeros((len(times), 4),dtype=np.int64)
+                abs_table[:,0] = quantised_data['time']
+                abs_table[:,1] = quantised_data['amp%d'%dds]
+                abs_table[:,2] = quantised_data['freq%d'%dds]
+                abs_table[:,3] = quantised_data['phase%d'%dds]
             
-            # split up the table into chunks delimited by trigger times:
-            abs_tables = []
-            for i, t in enumerate(quantised_trigger_times):
-                subtable = abs_table[abs_table[:,0] >= t]
-                try:
-                    next_trigger_time = quantised_trigger_times[i+1]
-                except IndexError:
-                    # No next trigger time
-                    pass
-                else:
-                    subtable = subtable[subtable[:,0] < next_trigger_time]
-                subtable[:,0] -= t
-                abs_tables.append(subtable)
+                # split up the table into chunks delimited by trigger times.
+                # Times are sorted, so each chunk is a contiguous slice:
+                starts = np.searchsorted(abs_table[:,0], quantised_trigger_times, side='left')
+                stops = np.append(starts[1:], len(abs_table))
+                abs_tables = []
+                for t, start, stop in zip(quantised_trigger_times, starts, stops):
+                    subtable = abs_table[start:stop].copy()
+                    subtable[:,0] -= t
+                    abs_tables.append(subtable)
 
-            # convert to diff tables:
-            diff_tables = [make_diff_table(tab) for tab in abs_tables]
-            # Create temporary files, get their paths, and close them:
-            with tempfile.NamedTemporaryFile(delete=False) as f:
-                temp_assembly_filepath = f.name
-            with tempfile.NamedTemporaryFile(delete=False) as f:
-                temp_binary_filepath = f.name
-                
-            try:
-                # Compile to assembly:
-                with open(temp_assembly_filepath,'w') as assembly_file:
-                    for i, dtab in enumerate(diff_tables):
-                        compileD(dtab, assembly_file, init=(i == 0),
-                                 jump_to_start=(i == 0),
-                                 jump_from_end=False,
-                                 close_end=(i == len(diff_tables) - 1),
-                                 local_loop_pre = str(i),
-                                 set_defaults = (i==0))
+                # convert to diff tables:
+                diff_tables[dds] = [make_diff_table(tab) for tab in abs_tables]
+
+            # Compile the programs of both DDSs concurrently, unless they are
+            # unchanged since a previous shot:
+            programs = {}
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = {}
+                for dds in range(2):
+                    key = _binary_cache_key(caspr, diff_tables[dds])
+                    if key in _binary_cache:
+                        _binary_cache.move_to_end(key)
+                        programs[dds] = _binary_cache[key]
+                    else:
+                        futures[dds] = key, executor.submit(
+                            _compile_dds_program, caspr, rfjuice_folder, compileD, diff_tables[dds]
+                        )
+                for dds, (key, future) in futures.items():
+                    programs[dds] = _binary_cache[key] = future.result()
+                    while len(_binary_cache) > _BINARY_CACHE_SIZE:
+                        _binary_cache.popitem(last=False)
+
+            for dds in range(2):
+                assembly_code, binary_data = programs[dds]
                 # Save the assembly to the h5 file:
-                with open(temp_assembly_filepath,) as assembly_file:
-                    assembly_code = assembly_file.read()
-                    assembly_group.create_dataset('DDS%d'%dds, data=assembly_code)
-                    for i, diff_table in enumerate(diff_tables):
-                        diff_group.create_dataset('DDS%d_difftable%d'%(dds,i), compression=config.compression, data=diff_table)
-                # compile to binary:
-                compilation = Popen([caspr,temp_assembly_filepath,temp_binary_filepath],
-                                     stdout=PIPE, stderr=PIPE, cwd=rfjuice_folder,startupinfo=startupinfo)
-                stdout, stderr = compilation.communicate()
-                if compilation.returncode:
-                    print(stdout)
-                    raise LabscriptError('RFBlaster compilation exited with code %d\n\n'%compilation.returncode +
-                                         'Stdout was:\n %s\n'%stdout + 'Stderr was:\n%s\n'%stderr)
-                # Save the binary to the h5 file:
-                with open(temp_binary_filepath,'rb') as binary_file:
-                    binary_data = binary_file.read()
+                assembly_group.create_dataset('DDS%d'%dds, data=assembly_code)
+                for i, diff_table in enumerate(diff_tables[dds]):
+                    diff_group.create_dataset('DDS%d_difftable%d'%(dds,i), compression=config.compression, data=diff_table)
                 # has to be numpy.string_ (string_ in this namespace,
                 # imported from pylab) as python strings get stored
                 # as h5py as 'variable length' strings, which 'cannot
@@ -184,12 +238,9 @@ class RFBlaster(PseudoclockDevice):
                 # must contain nulls sometimes. So this crashes if we
                 # don't convert to a numpy 'fixes length' string:
                 binary_group.create_dataset('DDS%d'%dds, data=np.bytes_(binary_data))
-            finally:
-                # Delete the temporary files:
-                os.remove(temp_assembly_filepath)
-                os.remove(temp_binary_filepath)
-                # print 'assembly:', temp_assembly_filepath
-                # print 'binary for dds %d on %s:'%(dds,self.name), temp_binary_filepath
+
+        inputs = [data, self.trigger_times]
+        generate_code_cache.run(self, hdf5_file, inputs, generate)
 
                 
 class RFBlasterDirectOutputs(IntermediateDevice):
@@ -261,7 +312,7 @@ class RFBlasterTab(DeviceTab):
 
         # Set the capabilities of this device
         self.supports_remote_value_check(True)
-        self.supports_smart_programming(False) 
+        self.supports_smart_programming(True) 
     
     def get_child_from_connection_table(self, parent_device_name, port):
         # This is a direct output, let's search for it on the internal intermediate device called 
@@ -340,6 +391,12 @@ class RFBlasterWorker(Worker):
         self.ip = m.group(1)
         self.netlogger = setup_logging('rfBlaster_%s' % self.ip)
         self.netlogger.info('init: Started logging')
+        # A keep-alive session, so that each request need not open a new connection:
+        global requests; import requests
+        self.session = requests.Session()
+        # Digests of the binaries last uploaded to each channel, so that unchanged
+        # binaries are not uploaded again:
+        self.uploaded_digests = {}
         self.http_request() # See if the RFBlaster answers
         self._last_program_manual_values = {}
 
@@ -363,6 +420,8 @@ class RFBlasterWorker(Worker):
 
     def program_manual(self,values):
         self._last_program_manual_values = values
+        # Setting static values may replace the uploaded programs:
+        self.uploaded_digests = {}
         form = MultiPartForm()
         for i in range(self.num_DDS):
             # Program the frequency, amplitude and phase
@@ -382,6 +441,7 @@ class RFBlasterWorker(Worker):
             finalfreq = zeros(self.num_DDS)
             finalamp = zeros(self.num_DDS)
             finalphase = zeros(self.num_DDS)
+            digests = {}
             for i in range(self.num_DDS):
                 #Find the final value from the human-readable part of the h5 file to use for
                 #the front panel values at the end
@@ -391,10 +451,16 @@ class RFBlasterWorker(Worker):
                                                  'gate':True
                                                 }
                 data = group['BINARY_CODE/DDS%d'%i][()]
-                form.add_file_content("pulse_ch%d"%i, "output_ch%d.bin"%i, data)
+                digests[i] = compute_digest(data)
+                # Only upload the binaries that differ from those already uploaded:
+                if fresh or self.uploaded_digests.get(i) != digests[i]:
+                    form.add_file_content("pulse_ch%d"%i, "output_ch%d.bin"%i, data)
                 
         form.add_field("upload_and_run", "Upload and start")
+        # Forget the previous binaries until the upload succeeds:
+        self.uploaded_digests = {}
         self.http_request(form)
+        self.uploaded_digests = digests
         return self.final_values
                  
     def abort_transition_to_buffered(self):
@@ -402,6 +468,7 @@ class RFBlasterWorker(Worker):
         form = MultiPartForm()
         #tell the rfblaster to stop
         form.add_field("halt","Halt execution")
+        self.uploaded_digests = {}
         self.http_request(form)
         return True
     
@@ -409,6 +476,7 @@ class RFBlasterWorker(Worker):
         form = MultiPartForm()
         # Tell the rfblaster to stop
         form.add_field("halt", "Halt execution")
+        self.uploaded_digests = {}
         self.http_request(form)
         return True
      
@@ -417,8 +485,8 @@ class RFBlasterWorker(Worker):
         return True
      
     def http_request(self, form=None): 
-        """Make a HTTP request to the RFBlaster, optionally submitting a form"""
-        import requests
+        """Make a HTTP request to the RFBlaster, optionally submitting a form. The
+        connection is kept alive between requests."""
         from urllib.request import urlopen, Request
         from urllib.error import URLError, HTTPError 
     
@@ -433,13 +501,13 @@ class RFBlasterWorker(Worker):
                     # ... rather than a dict. No matter. it seems requests sucks this up anyway.
                     # However we need to rearrange the file data into a nested tuple for requests. No big deal:
                     filelist = [(field_name, (filename, bytes(body), content_type)) for field_name, filename, content_type, body in form.files]
-                    r = requests.post(self.address, data=form.form_fields, files=filelist) # Needs to actually send the form
+                    r = self.session.post(self.address, data=form.form_fields, files=filelist) # Needs to actually send the form
                 else:
-                    r = requests.get(self.address)
+                    r = self.session.get(self.address)
                 r.raise_for_status() 
                 self.netlogger.info('Connected!')
                 break
-            except (URLError, HTTPError, TimeoutError, ConnectionError) as e:
+            except (URLError, HTTPError, TimeoutError, ConnectionError, requests.ConnectionError) as e:
                 self.netlogger.warning(str(e))
                 if self._connection_attempt < self.retries:
                     self.netlogger.info('Connection failed. Trying again (%i more attempts remain).' % (self.retries - self._connection_attempt))
@@ -447,6 +515,7 @@ class RFBlasterWorker(Worker):
                 elif not self._kloned_attempted:
                     self._kloned_attempted = True
                     self.restart_kloned()
+                    self.uploaded_digests = {}
                     self._connection_attempt = 1
                 else:
                     self.netlogger.error(str(e))   
@@ -484,6 +553,5 @@ class RFBlasterWorker(Worker):
         return self.get_web_values(self.http_request())
         
     def shutdown(self):
-        # TODO: implement this?
-        pass
+        self.session.close()
 
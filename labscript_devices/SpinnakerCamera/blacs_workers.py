@@ -21,6 +21,7 @@ from enum import IntEnum
 from time import sleep, perf_counter
 
 from labscript_devices.IMAQdxCamera.blacs_workers import IMAQdxCameraWorker
+from labscript_devices.IMAQdxCamera.pixel_formats import PACKED_FORMATS, PackedFrame
 
 class Spinnaker_Camera(object):
     def __init__(self, serial_number):
@@ -56,6 +57,8 @@ class Spinnaker_Camera(object):
         # Set the abort acquisition thingy:
         self._abort_acquisition = False
         self.exception_on_failed_shot = True
+        # Whether to return frames in packed pixel formats without unpacking them:
+        self.keep_packed = False
 
     def get_attribute_names(self, visibility):
         names = []
@@ -216,7 +219,14 @@ class Spinnaker_Camera(object):
         """Spinnaker image buffers require significant formatting.
         This returns what one would expect from a camera.
         configure_acquisition must be called first to set image format parameters."""
-        if self.pix_fmt.startswith('Mono'):
+        if self.pix_fmt in PACKED_FORMATS:
+            frame = PackedFrame(
+                np.frombuffer(img, dtype=np.uint8).copy(),
+                self.pix_fmt,
+                (self.height, self.width),
+            )
+            return frame if self.keep_packed else frame.unpack()
+        elif self.pix_fmt.startswith('Mono'):
             if self.pix_fmt.endswith('8'):
                 dtype = 'uint8'
             else:
@@ -2,6 +2,57 @@ import pyvisa
 import numpy as np
 import time
 
+# keys of the waveform preamble, in the order they are queried
+PREAMBLE_KEYS = [
+    'BYT_NR',                                 # data width for the outgoing waveform
+    'BIT_NR',                                 # number of bits per waveform point (8 or 16)
+    'ENCDG',                                  # type of encoding (ASCII or binary)
+    'BN_FMT',                                 # format of binary data (redundant for ASCII transfer) 
+    'BYT_OR',                                 # first transmitted byte of binray data (LSB or MSB) 
+    'NR_PT',                                  # number of points transmitted in response to a CURVe? query 
+    'WFID',                                   # acquisition parameters 
+    'PT_FMT',                                 # point format: {ENV: min/max pairs, Y: single points}
+    'XINCR',                                  # horizontal increment
+    'PT_OFF',                                 # trigger offset
+    'XZERO',                                  # time coordinate of the first point
+    'XUNIT',                                  # horizontal units
+    'YMULT',                                  # vertical scale factor per digitizing level
+    'YZERO',                                  # vertical offset
+    'YOFF',                                   # vertical position in digitizing levels
+    'YUNIT'                                   # vertical units
+    ]
+
+
+def parse_preamble(values):
+    """Create a dictionary of the waveform preamble from the responses to the
+    queries of PREAMBLE_KEYS"""
+    wfmp = {}
+    for key, x in zip(PREAMBLE_KEYS, values):
+        x = str(x)
+        if x[0] == '"':                             # is it an enclosed string?
+            x = x.split('"')[1]
+        elif str.isdigit(x):                        # is it an integer
+            x = int(x)
+        else:
+            try: x = float(x)                       # try floating point number
+            except: pass
+        wfmp[key] = x
+    return wfmp
+
+
+def waveform_times(wfmp, n_points):
+    """Reconstruct the times of the n_points points of a waveform from XINCR,
+    PT_OFF and XZERO of its preamble"""
+    n = np.arange(n_points)
+    return wfmp['XINCR'] * (n - wfmp['PT_OFF']) + wfmp['XZERO']
+
+
+def scale_waveform(wfmp, raw):
+    """Convert the raw digitizer codes of a waveform to values in YUNIT, using
+    YMULT, YOFF and YZERO of its preamble"""
+    return wfmp['YMULT'] * (raw - wfmp['YOFF']) + wfmp['YZERO']
+
+
 class TekScope:
     def __init__(self, addr='USB?*::INSTR', 
                  timeout=1, termination='\n'):
@@ -67,42 +118,8 @@ class TekScope:
             container=np.array
             )
 
-        # create a dictionary for the header information
-        keys = [
-            'BYT_NR',                                 # data width for the outgoing waveform
-            'BIT_NR',                                 # number of bits per waveform point (8 or 16)
-            'ENCDG',                                  # type of encoding (ASCII or binary)
-            'BN_FMT',                                 # format of binary data (redundant for ASCII transfer) 
-            'BYT_OR',                                 # first transmitted byte of binray data (LSB or MSB) 
-            'NR_PT',                                  # number of points transmitted in response to a CURVe? query 
-            'WFID',                                   # acquisition parameters 
-            'PT_FMT',                                 # point format: {ENV: min/max pairs, Y: single points}
-            'XINCR',                                  # horizontal increment
-            'PT_OFF',                                 # trigger offset
-            'XZERO',                                  # time coordinate of the first point
-            'XUNIT',                                  # horizontal units
-            'YMULT',                                  # vertical scale factor per digitizing level
-            'YZERO',                                  # vertical offset
-            'YOFF',                                   # vertical position in digitizing levels
-            'YUNIT'                                   # vertical units
-            ]
-
-        # wfstr = self.dev.query(preamble_string + '?').split(';')    # waveform transmission and formatting parameters
-        self.dev.write(';:'.join([preamble_string + ':' + k  + '?' for k in keys]))
-        wfstr = self.dev.read().split(';')
-
-        # create a dictionary of the waveform preamble
-        wfmp = {}
-        for key, x in zip(keys, wfstr):
-            x = str(x)
-            if x[0] == '"':                             # is it an enclosed string?
-                x = x.split('"')[1]
-            elif str.isdigit(x):                        # is it an integer
-                x = int(x)
-            else:
-                try: x = float(x)                       # try floating point number
-                except: pass
-            wfmp[key] = x
+        self.dev.write(';:'.join([preamble_string + ':' + k  + '?' for k in PREAMBLE_KEYS]))
+        wfmp = parse_preamble(self.dev.read().split(';'))
 
         # return the times and voltages
         n = np.arange(0, wfmp['NR_PT'] / wfmp['BYT_NR'])
@@ -110,6 +127,68 @@ class TekScope:
         y = wfmp['YMULT'] * (raw - wfmp['YOFF']) + wfmp['YZERO']
         return wfmp, t, y
 
+    def waveforms(self, channels, preamble_string='WFMO', int16=False):
+        """Download the waveforms of several channels from the oscilloscope in a
+        single transaction. The transfer is configured once, the preambles of all
+        channels are read with one compound query, and the data of all channels
+        with one multi-source CURVe? query. The raw digitizer codes are returned
+        without conversion, as int8, or int16 if int16 is True.
+
+        Returns:
+            tuple: `(wfmp, raw)`, dictionaries of the preamble and raw codes of
+            each channel. Use :func:`scale_waveform` and :func:`waveform_times` to
+            convert them to values and times.
+        """
+        channels = list(channels)
+        if not channels:
+            # nothing to query, and an empty query would not be answered
+            return {}, {}
+        record_length = int(self.dev.query('HOR:RECO?')) # determine how many points exist
+        # configure the data transfer for all channels at once
+        self.dev.write(
+            ';:'.join(
+                [
+                    'DAT:ENC RIB',                      # binary format (signed, MSB)
+                    preamble_string + ':BYT_N ' + ('2' if int16 else '1'),
+                    'DAT:START 1',
+                    'DAT:STOP ' + str(record_length),
+                ]
+            )
+        )
+
+        # query the preambles of all channels in one compound command
+        queries = []
+        for channel in channels:
+            queries.append('DAT:SOU ' + channel)
+            queries.extend([preamble_string + ':' + k + '?' for k in PREAMBLE_KEYS])
+        self.dev.write(';:'.join(queries))
+        values = self.dev.read().split(';')
+        wfmp = {}
+        for i, channel in enumerate(channels):
+            n = len(PREAMBLE_KEYS)
+            wfmp[channel] = parse_preamble(values[i * n : (i + 1) * n])
+
+        # transfer the data of all channels; each is returned as a separate
+        # IEEE 488.2 definite length block, separated by semicolons
+        self.dev.write('DAT:SOU ' + ','.join(channels))
+        self.dev.write('CURV?')
+        dtype = '>i2' if int16 else 'i1'
+        raw = {}
+        for channel in channels:
+            raw[channel] = np.frombuffer(self._read_block(), dtype=dtype)
+        self.dev.read_bytes(len(self.dev.read_termination))
+        return wfmp, raw
+
+    def _read_block(self):
+        """Read an IEEE 488.2 definite length binary block, skipping any
+        separator preceding it"""
+        c = self.dev.read_bytes(1)
+        while c != b'#':
+            c = self.dev.read_bytes(1)
+        n_digits = int(self.dev.read_bytes(1))
+        n_bytes = int(self.dev.read_bytes(n_digits))
+        return self.dev.read_bytes(n_bytes, break_on_termchar=False)
+
     def get_screenshot(self, verbose=False):
         if verbose:
             print('Downloading screen image...')
@@ -4,12 +4,13 @@ import h5py
 
 from blacs.tab_base_classes import Worker
 import labscript_utils.properties
+from labscript_devices.sidecar_files import open_data_file
 
 
 class TekScopeWorker(Worker):
     def init(self):
-        global TekScope
-        from .TekScope import TekScope
+        global TekScope, scale_waveform, waveform_times
+        from .TekScope import TekScope, scale_waveform, waveform_times
 
         self.scope = TekScope(self.addr, termination=self.termination)
         manufacturer, model, sn, revision = self.scope.idn.split(',')
@@ -39,33 +40,48 @@ class TekScopeWorker(Worker):
         return {}
 
     def transition_to_manual(self):
-        channels = self.scope.channels()
-        wfmp = {}
-        vals = {}
-        wtype = [('t', 'float')]
+        channels = [ch for ch, enabled in self.scope.channels().items() if enabled]
         print('Downloading...')
-        for ch, enabled in channels.items():
-            if enabled:
-                wfmp[ch], t, vals[ch] = self.scope.waveform(
-                    ch,
-                    int16=self.scope_params.get('int16', False),
-                    preamble_string=self.preamble_string,
-                )
-                wtype.append((ch, 'float'))
-                print(wfmp[ch]['WFID'])
+        wfmp, raw = self.scope.waveforms(
+            channels,
+            int16=self.scope_params.get('int16', False),
+            preamble_string=self.preamble_string,
+        )
+        for ch in channels:
+            print(wfmp[ch]['WFID'])
 
-        # Collate all data in a structured array
-        data = np.empty(len(t), dtype=wtype)
-        data['t'] = t
-        for ch in vals:
-            data[ch] = vals[ch]
+        # Collate all data in a structured array, either of the raw digitizer
+        # codes, or of the times and scaled values
+        if self.scope_params.get('raw_data', False):
+            wtype = [(ch, raw[ch].dtype) for ch in channels]
+        else:
+            wtype = [('t', 'float')] + [(ch, 'float') for ch in channels]
+        n_points = min(len(raw[ch]) for ch in channels) if channels else 0
+        data = np.empty(n_points, dtype=wtype)
+        for ch in channels:
+            if self.scope_params.get('raw_data', False):
+                data[ch] = raw[ch][:n_points]
+            else:
+                data[ch] = scale_waveform(wfmp[ch], raw[ch][:n_points])
+        if channels and not self.scope_params.get('raw_data', False):
+            data['t'] = waveform_times(wfmp[channels[0]], n_points)
 
         # Open the file after download so as not to hog the file lock
-        with h5py.File(self.h5file, 'r+') as hdf_file:
+        with open_data_file(
+            self.h5file,
+            self.device_name,
+            sidecar=self.scope_params.get('sidecar_data_files', False),
+        ) as hdf_file:
             grp = hdf_file.require_group('/data/traces')
             print('Saving traces...')
             dset = grp.create_dataset(self.device_name, data=data)
-            dset.attrs.update(wfmp[ch])
+            if channels:
+                dset.attrs.update(wfmp[channels[-1]])
+            # Each channel's preamble, including its scaling:
+            for ch in channels:
+                for key, value in wfmp[ch].items():
+                    dset.attrs[ch + '_' + key] = value
+            dset.attrs['raw_data'] = self.scope_params.get('raw_data', False)
         
         print('Done!')
         return True
@@ -8,18 +8,27 @@ class TekScope(Device):
 
           device_properties (set per shot)
           timeout: in seconds for response to queries over visa interface
-          int16: download waveform pts as 16 bit integers (returns 1/2 as many pts) 
+          int16: download waveform pts as 16 bit integers
+          raw_data: save the raw 8 or 16 bit digitizer codes of each channel instead
+            of times and values as floats. Each channel's preamble is saved as
+            attributes of the dataset prefixed with its name, e.g. 'CH1_YMULT';
+            values are YMULT * (code - YOFF) + YZERO and the times of point n are
+            XINCR * (n - PT_OFF) + XZERO.
+          sidecar_data_files: save the traces to a file of their own next to the
+            shot file, linked into the shot file, so that writing them does not
+            hold up other devices saving data to the shot file. See
+            labscript_devices.sidecar_files.
     """
     description = 'Tekstronix oscilloscope'
 
     @set_passed_properties(
         property_names = {
             'connection_table_properties': ['termination', 'preamble_string'],
-            'device_properties': ['timeout', 'int16']}
+            'device_properties': ['timeout', 'int16', 'raw_data', 'sidecar_data_files']}
         )
     def __init__(self, name, addr, 
                  termination='\n', preamble_string='WFMP',
-                 timeout=5, int16=False,
+                 timeout=5, int16=False, raw_data=False, sidecar_data_files=False,
                  **kwargs):
         Device.__init__(self, name, None, addr, **kwargs)
         self.name = name
@@ -0,0 +1,213 @@
+#####################################################################
+#                                                                   #
+# /camera_server_connection.py                                      #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Long-lived connections from BLACS to camera servers.
+
+The :class:`~labscript_devices.Camera.CameraWorker` talks to a camera server
+either over zeromq, with the protocol described in
+`labscript_utils.camera_server`, or over plain TCP sockets with one
+``\\r\\n``-terminated message per request. Rather than connecting anew for every
+request, the worker keeps one connection per server open between shots:
+
+* :class:`ZMQServerConnection` uses a DEALER socket, so that the two messages
+  of a transition, the shot file path or ``'done'`` followed by the empty
+  string, can be sent back to back without waiting for the server's ``'ok'``
+  in between. ZMTP heartbeats detect a dead connection, and zeromq reconnects
+  automatically.
+* :class:`SocketServerConnection` keeps its TCP socket open with keepalive
+  probes, and reconnects if the server has closed it since the last request,
+  so servers that only handle one request per connection still work.
+
+If a request fails, times out or gets an unexpected reply, the connection is
+closed, so that late replies to it cannot be mistaken for replies to the next
+request, and is reopened by the next request.
+"""
+
+import select
+import socket
+import time
+
+import zmq
+
+
+class ZMQServerConnection(object):
+    """Connection to a camera server speaking the zeromq protocol.
+
+    Args:
+        host (str): Hostname of the server.
+        port (int): Port of the server.
+        heartbeat_interval (float, optional): Interval between heartbeats, in
+            seconds.
+        heartbeat_timeout (float, optional): Time after which the connection
+            is dropped and reestablished if no heartbeat is answered, in
+            seconds.
+    """
+
+    def __init__(self, host, port, heartbeat_interval=1, heartbeat_timeout=5):
+        self.host = host
+        self.port = int(port)
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.sock = None
+
+    def connect(self):
+        """Open the connection, if it is not already open. zeromq connects in
+        the background, so this does not block."""
+        if self.sock is not None:
+            return
+        sock = zmq.Context.instance().socket(zmq.DEALER)
+        sock.setsockopt(zmq.LINGER, 0)
+        # Don't queue messages until the connection is established, so that
+        # sending to an unreachable server times out:
+        sock.setsockopt(zmq.IMMEDIATE, 1)
+        sock.setsockopt(zmq.HEARTBEAT_IVL, int(1000 * self.heartbeat_interval))
+        sock.setsockopt(zmq.HEARTBEAT_TIMEOUT, int(1000 * self.heartbeat_timeout))
+        sock.connect('tcp://%s:%d' % (self.host, self.port))
+        self.sock = sock
+
+    def close(self):
+        """Close the connection, discarding any replies not yet received."""
+        if self.sock is not None:
+            self.sock.close(linger=0)
+            self.sock = None
+
+    def send(self, message, timeout=5):
+        self.connect()
+        if not self.sock.poll(int(1000 * timeout), zmq.POLLOUT):
+            raise TimeoutError('Could not send data to server: timed out')
+        # An empty delimiter frame, as a REQ socket would add:
+        self.sock.send_multipart([b'', message.encode('utf8')])
+
+    def recv(self, timeout=5):
+        if not self.sock.poll(int(1000 * timeout), zmq.POLLIN):
+            raise TimeoutError('No response from server: timed out')
+        return self.sock.recv_multipart()[-1].decode('utf8')
+
+    def request(self, messages, replies, timeouts):
+        """Send messages to the server without waiting for replies in between,
+        then receive and check the replies in turn.
+
+        Args:
+            messages (list): The messages to send.
+            replies (list): The expected replies, in order.
+            timeouts (list): For each reply, the time to wait for it, in
+                seconds. The first is also the time allowed for sending.
+
+        Raises:
+            Exception: If a reply is not as expected. The connection is closed
+                if anything goes wrong.
+        """
+        try:
+            for message in messages:
+                self.send(message, timeouts[0])
+            for reply, timeout in zip(replies, timeouts):
+                response = self.recv(timeout)
+                if response != reply:
+                    raise Exception('invalid response from server: ' + str(response))
+        except:
+            self.close()
+            raise
+
+
+class SocketServerConnection(object):
+    """Connection to a camera server speaking the TCP socket protocol.
+
+    Args:
+        host (str): Hostname of the server.
+        port (int): Port of the server.
+        keepalive_interval (float, optional): Interval between TCP keepalive
+            probes on the otherwise idle connection, in seconds, where the
+            operating system allows setting it.
+    """
+
+    def __init__(self, host, port, keepalive_interval=5):
+        assert port, 'No port number supplied.'
+        assert host, 'No hostname supplied.'
+        assert str(int(port)) == str(port), 'Port must be an integer.'
+        self.host = host
+        self.port = int(port)
+        self.keepalive_interval = keepalive_interval
+        self.sock = None
+        self.buffer = b''
+
+    def _peer_closed(self):
+        # Whether the server has closed the connection, or sent something
+        # unsolicited, since the last request. Either way it can't be reused:
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        return bool(readable)
+
+    def connect(self, timeout):
+        """Open the connection, if it is not already open and usable."""
+        if self.sock is not None and self._peer_closed():
+            self.close()
+        if self.sock is None:
+            sock = socket.create_connection((self.host, self.port), timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            interval = max(1, int(self.keepalive_interval))
+            for option in ['TCP_KEEPIDLE', 'TCP_KEEPINTVL']:
+                if hasattr(socket, option):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), interval)
+            self.sock = sock
+            self.buffer = b''
+
+    def close(self):
+        """Close the connection, discarding any replies not yet received."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.buffer = b''
+
+    def send(self, message, timeout=120):
+        self.connect(timeout)
+        self.sock.settimeout(timeout)
+        self.sock.sendall(b'%s\r\n' % message.encode('utf8'))
+
+    def recv(self, timeout=120):
+        """Return the next line received from the server, or whatever it has
+        sent so far if that is not a complete line, such as an error message."""
+        deadline = time.monotonic() + timeout
+        while b'\r\n' not in self.buffer:
+            if self.buffer and not select.select([self.sock], [], [], 0)[0]:
+                break
+            self.sock.settimeout(max(0, deadline - time.monotonic()))
+            if hasattr(socket, 'TCP_QUICKACK'):
+                # Acknowledge immediately, or a server that sends its replies
+                # in separate writes without TCP_NODELAY stalls on our delayed
+                # acknowledgement of the first before sending the second:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            try:
+                data = self.sock.recv(1024)
+            except socket.timeout:
+                raise TimeoutError('No response from server: timed out')
+            if not data:
+                if self.buffer:
+                    break
+                raise ConnectionError('Server closed the connection')
+            self.buffer += data
+        if b'\r\n' in self.buffer:
+            line, self.buffer = self.buffer.split(b'\r\n', 1)
+            return line.decode('utf8')
+        response, self.buffer = self.buffer, b''
+        return response.decode('utf8')
+
+    def request(self, messages, replies, timeouts):
+        """Send messages to the server, then receive and check the replies in
+        turn. The arguments are as for :meth:`ZMQServerConnection.request`."""
+        try:
+            for message in messages:
+                self.send(message, timeouts[0])
+            for reply, timeout in zip(replies, timeouts):
+                response = self.recv(timeout)
+                if reply not in response:
+                    raise Exception('invalid response from server: ' + response)
+        except:
+            self.close()
+            raise
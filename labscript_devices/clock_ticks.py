@@ -0,0 +1,69 @@
+#####################################################################
+#                                                                   #
+# /clock_ticks.py                                                   #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Times of the rising edges of clock traces, for runviewer parsers.
+
+Runviewer passes every device on a clock line the same `(times, values)` clock
+trace. :func:`get_clock_ticks` computes the times of its rising edges once, and
+returns the same read-only array to every parser it is called from for as long
+as the clock trace exists, rather than each parser computing and keeping its
+own copy::
+
+    clock_ticks = get_clock_ticks(clock)
+"""
+
+import weakref
+
+import numpy as np
+
+# Rising edge times, keyed by the ids of the clock's times and values arrays:
+_ticks = {}
+
+
+def _compute_clock_ticks(times, clock_value):
+    clock_indices = np.where((clock_value[1:] - clock_value[:-1]) == 1)[0] + 1
+    # If initial clock value is 1, then this counts as a rising edge (clock should
+    # be 0 before experiment) but this is not picked up by the above code. So we
+    # insert it!
+    if clock_value[0] == 1:
+        clock_indices = np.insert(clock_indices, 0, 0)
+    clock_ticks = times[clock_indices]
+    clock_ticks.flags.writeable = False
+    return clock_ticks
+
+
+def get_clock_ticks(clock):
+    """Return the times of the rising edges of a clock trace.
+
+    Args:
+        clock (tuple): The clock trace `(times, values)` passed to a parser's
+            `get_traces`, where values are 0 or 1.
+
+    Returns:
+        numpy.ndarray: Read-only array of the times of the rising edges,
+        including the first time if the clock starts high.
+    """
+    times, clock_value = clock[0], clock[1]
+    key = (id(times), id(clock_value))
+    if key in _ticks:
+        times_ref, value_ref, clock_ticks = _ticks[key]
+        # Ids can be reused once the arrays they belonged to are garbage:
+        if times_ref() is times and value_ref() is clock_value:
+            return clock_ticks
+    clock_ticks = _compute_clock_ticks(times, clock_value)
+    try:
+        refs = weakref.ref(times), weakref.ref(clock_value)
+    except TypeError:
+        # Not arrays, so they can't be remembered:
+        return clock_ticks
+    _ticks[key] = refs + (clock_ticks,)
+    # Forget the ticks along with the clock trace:
+    weakref.finalize(times, _ticks.pop, key, None)
+    return clock_ticks
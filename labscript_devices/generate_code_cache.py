@@ -0,0 +1,272 @@
+#####################################################################
+#                                                                   #
+# /generate_code_cache.py                                           #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Compile-time cache of the output of devices' `generate_code()` methods.
+
+In a parameter scan, many devices produce identical instructions shot after
+shot. Devices that support it can be instantiated with
+`cache_generate_code=True`, in which case the datasets, groups and attributes
+they write to their group in the shot file, and the properties they set, are
+remembered along with a digest of everything their instructions were computed
+from (their outputs' raw_output arrays, clock times and properties). When a
+later shot compiled in the same process has the same digest, the remembered
+output is written to the shot file instead of being computed again.
+
+Since runmanager compiles all shots of a sequence in a single long-lived
+process, the cache persists over a sequence. Whether each shot was a hit or a
+miss is stored as the attribute :data:`CACHE_ATTR` of the device's group, and
+:data:`generate_code_cache` keeps counts of hits and misses for each device::
+
+    from labscript_devices.generate_code_cache import generate_code_cache
+    print(generate_code_cache.report())
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import labscript_utils.h5_lock, h5py
+
+from labscript import Device
+
+CACHE_ATTR = 'generate_code_cache'
+
+
+def _update_hash(h, obj):
+    """Recursively feed a description of obj's type and contents to the hash
+    object h. Devices are identified by their name and connection, so that
+    inputs from different shots can be compared."""
+    if isinstance(obj, Device):
+        h.update(b'D')
+        _update_hash(h, (obj.name, getattr(obj, 'connection', None)))
+    elif obj is None or isinstance(obj, (bool, int, str, bytes, np.bool_, np.integer)):
+        h.update(type(obj).__name__.encode('utf8'))
+        h.update(repr(obj).encode('utf8'))
+    elif isinstance(obj, (float, np.floating)):
+        h.update(b'f')
+        h.update(repr(float(obj)).encode('utf8'))
+    elif isinstance(obj, (np.ndarray, np.generic)):
+        obj = np.ascontiguousarray(obj)
+        if obj.dtype.hasobject:
+            h.update(b'O')
+            _update_hash(h, (obj.shape, obj.ravel().tolist()))
+        else:
+            h.update(b'A')
+            h.update(repr((obj.dtype.descr, obj.shape)).encode('utf8'))
+            h.update(obj.tobytes())
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'L%d' % len(obj))
+        for item in obj:
+            _update_hash(h, item)
+    elif isinstance(obj, dict):
+        h.update(b'M%d' % len(obj))
+        for key, value in sorted(obj.items(), key=lambda item: repr(item[0])):
+            _update_hash(h, key)
+            _update_hash(h, value)
+    elif isinstance(obj, (set, frozenset)):
+        h.update(b'S%d' % len(obj))
+        for item in sorted(obj, key=repr):
+            _update_hash(h, item)
+    else:
+        msg = "Cannot compute a generate_code() cache key from object of type %s"
+        raise TypeError(msg % type(obj))
+
+
+def _snapshot(obj):
+    """Return a copy of an h5py dataset or group and its contents, which
+    :func:`_restore` can write to another file."""
+    attrs = dict(obj.attrs)
+    if isinstance(obj, h5py.Dataset):
+        kwargs = {'dtype': obj.dtype}
+        if obj.compression is not None:
+            kwargs['compression'] = obj.compression
+            kwargs['compression_opts'] = obj.compression_opts
+        return ('dataset', obj[()], kwargs, attrs)
+    children = [(name, _snapshot(child)) for name, child in obj.items()]
+    return ('group', children, attrs)
+
+
+def _restore(parent, name, snapshot):
+    if snapshot[0] == 'dataset':
+        _, data, kwargs, attrs = snapshot
+        obj = parent.create_dataset(name, data=data, **kwargs)
+    else:
+        _, children, attrs = snapshot
+        obj = parent.create_group(name)
+        for child_name, child in children:
+            _restore(obj, child_name, child)
+    for key, value in attrs.items():
+        obj.attrs[key] = value
+
+
+class _CachedOutput(object):
+    """The new contents of a device's group, and the properties set on the
+    device, during a call to its generate_code()."""
+
+    def __init__(self, items, attrs, properties):
+        self.items = items
+        self.attrs = attrs
+        self.properties = properties
+
+    @classmethod
+    def capture(cls, device, hdf5_file, generate):
+        group_name = '/devices/' + device.name
+        group = hdf5_file.get(group_name)
+        names_before = set(group) if group is not None else set()
+        attrs_before = set(group.attrs) if group is not None else set()
+        properties_before = {
+            location: dict(properties)
+            for location, properties in getattr(device, '_properties', {}).items()
+        }
+
+        generate()
+
+        items = []
+        attrs = {}
+        group = hdf5_file.get(group_name)
+        if group is not None:
+            for name, obj in group.items():
+                if name not in names_before:
+                    items.append((name, _snapshot(obj)))
+            for key, value in group.attrs.items():
+                if key not in attrs_before:
+                    attrs[key] = value
+        properties = []
+        for location, props in getattr(device, '_properties', {}).items():
+            before = properties_before.get(location, {})
+            for name, value in props.items():
+                if name not in before or before[name] is not value:
+                    properties.append((name, value, location))
+        return cls(items, attrs, properties)
+
+    def replay(self, device, hdf5_file):
+        group = hdf5_file.require_group('/devices/' + device.name)
+        for name, snapshot in self.items:
+            _restore(group, name, snapshot)
+        for key, value in self.attrs.items():
+            group.attrs[key] = value
+        for name, value, location in self.properties:
+            device.set_property(name, value, location=location, overwrite=True)
+
+
+class GenerateCodeCache(object):
+    """Cache of the output of devices' generate_code() methods, keyed by a
+    digest of their inputs.
+
+    A single instance, :data:`generate_code_cache`, is shared by all devices.
+    Entries are kept separately for each device name, with the least recently
+    used ones discarded once there are more than :attr:`max_entries_per_device`.
+    """
+
+    max_entries_per_device = 8
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = {}
+        self.misses = {}
+
+    def key(self, device, inputs):
+        """Compute the cache key of a device's generate_code() output.
+
+        Args:
+            device (labscript.Device): The device.
+            inputs: Everything the device's output depends on, other than its
+                class, name and properties, which are always included. May be
+                any nesting of lists, tuples, dicts and sets of numbers, strings,
+                numpy arrays and labscript devices.
+
+        Returns:
+            str: Hexadecimal digest.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        cls = type(device)
+        _update_hash(h, cls.__module__ + '.' + cls.__qualname__)
+        _update_hash(h, device.name)
+        _update_hash(h, getattr(device, '_properties', {}))
+        _update_hash(h, inputs)
+        return h.hexdigest()
+
+    def run(self, device, hdf5_file, inputs, generate):
+        """Call `generate()` to write a device's instructions to the shot file,
+        or, if the device was instantiated with `cache_generate_code=True` and
+        its inputs are the same as for a previous call, write the output of that
+        call instead.
+
+        Args:
+            device (labscript.Device): The device whose instructions are being
+                generated. All output of `generate()` must be written to its group
+                in the shot file, or set as properties of the device.
+            hdf5_file (h5py.File): The shot file.
+            inputs: Everything `generate()` depends on, see :meth:`key`.
+            generate (callable): Function that generates and writes the
+                instructions.
+        """
+        if not getattr(device, 'cache_generate_code', False):
+            generate()
+            return
+        key = self.key(device, inputs)
+        entries = self._entries.setdefault(device.name, OrderedDict())
+        self.hits.setdefault(device.name, 0)
+        self.misses.setdefault(device.name, 0)
+        output = entries.get(key)
+        if output is None:
+            self.misses[device.name] += 1
+            output = _CachedOutput.capture(device, hdf5_file, generate)
+            entries[key] = output
+            while len(entries) > self.max_entries_per_device:
+                entries.popitem(last=False)
+            result = 'miss'
+        else:
+            self.hits[device.name] += 1
+            entries.move_to_end(key)
+            output.replay(device, hdf5_file)
+            result = 'hit'
+        group = hdf5_file.get('/devices/' + device.name)
+        if group is not None:
+            group.attrs[CACHE_ATTR] = result
+
+    @property
+    def hit_rate(self):
+        """float: Fraction of lookups so far that were hits, over all devices,
+        or `None` if there have been none."""
+        hits = sum(self.hits.values())
+        lookups = hits + sum(self.misses.values())
+        if not lookups:
+            return None
+        return hits / lookups
+
+    def report(self):
+        """Return a summary of the hits and misses for each device.
+
+        Returns:
+            str: One line per device, and a total.
+        """
+        lines = []
+        for name in sorted(self.hits):
+            hits, misses = self.hits[name], self.misses[name]
+            lines.append(
+                '%s: %d hits, %d misses (%.0f%%)'
+                % (name, hits, misses, 100 * hits / (hits + misses))
+            )
+        hit_rate = self.hit_rate
+        if hit_rate is None:
+            lines.append('generate_code cache: no lookups')
+        else:
+            lines.append('generate_code cache: %.0f%% hit rate' % (100 * hit_rate))
+        return '\n'.join(lines)
+
+    def clear(self):
+        """Discard all cached output and reset the counts of hits and misses."""
+        self._entries.clear()
+        self.hits.clear()
+        self.misses.clear()
+
+
+generate_code_cache = GenerateCodeCache()
@@ -0,0 +1,149 @@
+#####################################################################
+#                                                                   #
+# /serial_emulator.py                                               #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Emulation of serial devices on pseudoterminals, for testing and benchmarking
+workers without hardware.
+
+A :class:`SerialDeviceEmulator` subclass implements :meth:`handle_command`, which
+is called with each line received and returns the response. Once started, the
+emulator's :attr:`~SerialDeviceEmulator.port` can be opened with
+:class:`serial.Serial` in place of the device's port::
+
+    class EchoEmulator(SerialDeviceEmulator):
+        def handle_command(self, command):
+            return command + '\\r\\n'
+
+    with EchoEmulator(latency=1e-3) as emulator:
+        conn = serial.Serial(emulator.port, timeout=1)
+
+Responses can be delayed by a fixed `latency`, emulating the round trip time of
+a USB or serial link, without delaying the processing of subsequent commands.
+Pseudoterminals are only available on Unix-like systems.
+"""
+
+import os
+import select
+import threading
+import time
+import queue
+
+
+class SerialDeviceEmulator(object):
+    """Base class of emulated serial devices.
+
+    Args:
+        latency (float, optional): Time in seconds between receiving the end of a
+            command and sending its response.
+        command_time (float, optional): Time in seconds the emulated device
+            spends processing each command, during which it does not read
+            further commands.
+    """
+
+    def __init__(self, latency=0, command_time=0):
+        self.latency = latency
+        self.command_time = command_time
+        self.port = None
+        self.n_commands = 0
+        self._master = None
+        self._slave = None
+        self._buffer = b''
+        self._responses = queue.Queue()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def handle_command(self, command):
+        """Handle a command received by the device.
+
+        Args:
+            command (str): The command, with the line terminator removed.
+
+        Returns:
+            str: The response, including any line terminator, or `None` for no
+            response.
+        """
+        raise NotImplementedError
+
+    def read_bytes(self, n):
+        """Read n bytes of binary data, for use by :meth:`handle_command` to
+        receive a payload following a command."""
+        while len(self._buffer) < n:
+            self._receive()
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def send(self, response):
+        """Send data not in response to a command, such as a notification that a
+        run has finished."""
+        self._responses.put((time.perf_counter(), response.encode('utf8')))
+
+    def start(self):
+        import tty
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        for target in [self._mainloop, self._response_loop]:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        self._stopping.set()
+        self._responses.put(None)
+        for thread in self._threads:
+            thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _receive(self):
+        while not self._stopping.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if ready:
+                self._buffer += os.read(self._master, 65536)
+                return
+        raise EOFError
+
+    def _readline(self):
+        while b'\n' not in self._buffer:
+            self._receive()
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.rstrip(b'\r').decode('utf8')
+
+    def _mainloop(self):
+        try:
+            while True:
+                command = self._readline()
+                received_time = time.perf_counter()
+                if self.command_time:
+                    time.sleep(self.command_time)
+                response = self.handle_command(command)
+                self.n_commands += 1
+                if response is not None:
+                    self._responses.put((received_time + self.latency, response.encode('utf8')))
+        except EOFError:
+            pass
+
+    def _response_loop(self):
+        while True:
+            item = self._responses.get()
+            if item is None:
+                return
+            due_time, data = item
+            delay = due_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            os.write(self._master, data)
@@ -0,0 +1,277 @@
+#####################################################################
+#                                                                   #
+# /serial_transport.py                                              #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Pipelined command transport for devices with line-based serial protocols.
+
+Devices such as the PrawnBlaster, PrawnDO, PineBlaster and NovaTech DDS9m are
+programmed by sending commands terminated by a newline, each answered by a line
+such as ``ok``. Waiting for each response before sending the next command makes
+every command cost a full round trip. A :class:`SerialTransport` instead writes
+up to `window` commands ahead of their responses, which it matches to the
+commands in the order they were sent::
+
+    transport = SerialTransport(serial.Serial(port, 115200, timeout=1), window=32)
+    for i, instruction in enumerate(program):
+        transport.send('set %d %d' % (i, instruction), expect='ok\\r\\n')
+    transport.flush()
+
+The time between sending each command and reading its response is recorded
+per command name, see :meth:`SerialTransport.latency_histogram` and
+:meth:`SerialTransport.latency_report`. Devices can be emulated on a
+pseudoterminal for testing without hardware, see
+:mod:`labscript_devices.serial_emulator`.
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+# Bin edges of latency histograms, in seconds:
+LATENCY_BINS = np.logspace(-6, 1, 71)
+
+
+class SerialTransportError(RuntimeError):
+    """A device did not give the expected response to a command"""
+
+
+class PendingResponse(object):
+    """The response to a command sent with :meth:`SerialTransport.send`, which
+    may not have been read yet."""
+
+    def __init__(self, transport, command, expect, n_lines):
+        self.transport = transport
+        self.command = command
+        self.expect = expect
+        self.n_lines = n_lines
+        self.sent_time = None
+        self.done = False
+        self.response = None
+        # The exception raised for this command, if it failed or its response
+        # was discarded:
+        self.error = None
+
+    def result(self):
+        """Read responses until this one has been read, and return it.
+
+        Returns:
+            str: The response, including line terminators. If the command was
+            sent with `n_lines` > 1, or `None`, the lines are concatenated.
+
+        Raises:
+            SerialTransportError: If the response was not the expected one, or
+                was discarded because of the failure of an earlier command or a
+                call to :meth:`SerialTransport.discard_pending`.
+        """
+        if not self.done:
+            self.transport._read_until(self)
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class SerialTransport(object):
+    """Sends commands to a device over a serial connection, writing up to
+    `window` commands before reading their responses.
+
+    Args:
+        conn (serial.Serial): Open serial connection to the device. Its timeout
+            sets how long to wait for each response.
+        window (int, optional): Maximum number of commands whose responses have
+            not yet been read. With the default of 1, each command waits for the
+            response to the previous one. The device must be able to buffer the
+            commands sent ahead of it.
+        terminator (str, optional): Appended to each command.
+        encoding (str, optional): Encoding of commands and responses.
+        latency_samples (int, optional): Number of latency measurements kept
+            for each command name.
+    """
+
+    def __init__(self, conn, window=1, terminator='\r\n', encoding='utf8', latency_samples=10000):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.conn = conn
+        self.window = window
+        self.terminator = terminator
+        self.encoding = encoding
+        self._pending = deque()
+        self._lock = threading.RLock()
+        self.latencies = defaultdict(lambda: deque(maxlen=latency_samples))
+
+    def send(self, command, expect=None, n_lines=1):
+        """Send a command, without waiting for its response unless `window`
+        commands are already awaiting theirs.
+
+        Args:
+            command (str or bytes): Command to send, without terminator.
+            expect (str, optional): Expected response. If the response differs,
+                :class:`SerialTransportError` is raised when it is read, whether
+                by :meth:`PendingResponse.result`, :meth:`flush`, or a later
+                :meth:`send`.
+            n_lines (int, optional): Number of lines in the response. If `None`,
+                lines are read until the connection times out.
+
+        Returns:
+            PendingResponse: The response, once read.
+        """
+        if isinstance(command, str):
+            data = (command + self.terminator).encode(self.encoding)
+        else:
+            data = command + self.terminator.encode(self.encoding)
+            command = command.decode(self.encoding)
+        return self._send(data, command, expect, n_lines)
+
+    def send_data(self, data, expect=None, n_lines=1):
+        """Send binary data that the device responds to, such as a payload
+        following a command, without a terminator. Its latencies are recorded
+        under the name ``'<data>'``. See :meth:`send`."""
+        return self._send(bytes(data), '<data>', expect, n_lines)
+
+    def _send(self, data, command, expect, n_lines):
+        pending = PendingResponse(self, command, expect, n_lines)
+        with self._lock:
+            # Responses read until the timeout can't be pipelined:
+            if n_lines is None:
+                self.flush()
+            while len(self._pending) >= self.window or (
+                self._pending and self._pending[-1].n_lines is None
+            ):
+                self._read_next()
+            pending.sent_time = time.perf_counter()
+            self.conn.write(data)
+            self._pending.append(pending)
+        return pending
+
+    def query(self, command, expect=None, n_lines=1):
+        """Send a command and return its response. See :meth:`send`."""
+        return self.send(command, expect=expect, n_lines=n_lines).result()
+
+    def write(self, data):
+        """Write raw data, such as a binary payload following a command, in order
+        with any commands sent."""
+        with self._lock:
+            self.conn.write(data)
+
+    def flush(self):
+        """Read the responses to all commands sent.
+
+        Returns:
+            list: Responses read, in the order their commands were sent.
+        """
+        responses = []
+        with self._lock:
+            while self._pending:
+                responses.append(self._read_next().response)
+        return responses
+
+    def readline(self):
+        """Read a line not in response to a command, such as a notification that
+        the device has finished, after reading the responses to all commands sent.
+
+        Returns:
+            str: The line, or an empty string if the connection timed out.
+        """
+        with self._lock:
+            self.flush()
+            return self.conn.readline().decode(self.encoding)
+
+    def readlines(self):
+        """Read lines until the connection times out, after reading the responses
+        to all commands sent. Useful to obtain the rest of an error message.
+
+        Returns:
+            str: The lines, concatenated.
+        """
+        with self._lock:
+            self.flush()
+            return ''.join(line.decode(self.encoding) for line in self.conn.readlines())
+
+    def discard_pending(self):
+        """Forget the commands awaiting responses and discard any input, for
+        example after an error."""
+        with self._lock:
+            self._drop_pending('its response was discarded')
+            self.conn.reset_input_buffer()
+
+    def close(self):
+        self.conn.close()
+
+    def _drop_pending(self, reason):
+        # Forget the commands awaiting responses, failing them so that their
+        # results raise rather than waiting for responses that won't be read:
+        while self._pending:
+            pending = self._pending.popleft()
+            pending.done = True
+            pending.error = SerialTransportError(
+                f"No response read to command '{pending.command}': {reason}"
+            )
+
+    def _read_until(self, pending):
+        with self._lock:
+            while not pending.done:
+                self._read_next()
+
+    def _read_next(self):
+        pending = self._pending.popleft()
+        if pending.n_lines is None:
+            lines = self.conn.readlines()
+        else:
+            lines = [self.conn.readline() for _ in range(pending.n_lines)]
+        pending.response = ''.join(line.decode(self.encoding) for line in lines)
+        pending.done = True
+        name = pending.command.split(' ', 1)[0]
+        self.latencies[name].append(time.perf_counter() - pending.sent_time)
+        if pending.expect is not None and pending.response != pending.expect:
+            # Get the complete error message and forget responses to commands that
+            # may have been sent after the failed one:
+            response = pending.response + ''.join(
+                line.decode(self.encoding) for line in self.conn.readlines()
+            )
+            msg = f"Command '{pending.command}' failed. Got response {repr(response)}"
+            pending.error = SerialTransportError(msg)
+            self._drop_pending(f"earlier command '{pending.command}' failed")
+            raise pending.error
+        return pending
+
+    def latency_histogram(self, name):
+        """Return a histogram of the latencies of a command, from sending it to
+        reading its response.
+
+        Args:
+            name (str): First word of the command.
+
+        Returns:
+            tuple: `(counts, bin_edges)`, as returned by :func:`numpy.histogram`,
+            with bin edges in seconds given by :data:`LATENCY_BINS`.
+        """
+        return np.histogram(np.array(self.latencies[name]), bins=LATENCY_BINS)
+
+    def latency_report(self):
+        """Return a summary of the latencies of each command.
+
+        Returns:
+            str: One line per command name.
+        """
+        lines = []
+        for name in sorted(self.latencies):
+            latencies = np.array(self.latencies[name])
+            if not len(latencies):
+                continue
+            lines.append(
+                '%s: %d commands, median %.3f ms, 99th percentile %.3f ms'
+                % (
+                    name,
+                    len(latencies),
+                    1e3 * np.median(latencies),
+                    1e3 * np.percentile(latencies, 99),
+                )
+            )
+        return '\n'.join(lines)
@@ -0,0 +1,97 @@
+#####################################################################
+#                                                                   #
+# /sidecar_files.py                                                 #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Per-device sidecar files for data acquired during a shot.
+
+At the end of a shot, every acquisition worker opens the shot file to save its
+data, and `labscript_utils.h5_lock` serialises their access to it, so the
+slowest writer delays all the others. Devices with the `sidecar_data_files`
+device property set write their data with :func:`open_data_file` to a file of
+their own next to the shot file instead, concurrently with other workers. Once
+it is written, the shot file is locked only for as long as it takes to add an
+external link to each dataset, at the same path as the dataset in the sidecar
+file, and to copy the attributes of the groups containing them. Analysis code
+reads the data from the shot file as before::
+
+    with open_data_file(h5_filepath, device_name, sidecar=True) as f:
+        f.require_group('/data/traces').create_dataset(label, data=data)
+
+Sidecar files are named ``<shot name>.<device name>.h5`` and are linked by file
+name relative to the shot file, so they must be kept in the same directory as
+the shot file if it is moved or copied.
+"""
+
+import os
+from contextlib import contextmanager
+
+import labscript_utils.h5_lock, h5py
+
+
+def sidecar_path(h5_filepath, device_name):
+    """Return the path of a device's sidecar file for a shot file."""
+    return '%s.%s.h5' % (os.path.splitext(h5_filepath)[0], device_name)
+
+
+@contextmanager
+def open_data_file(h5_filepath, device_name, sidecar=False):
+    """Context manager opening the file to which a device saves its acquired
+    data.
+
+    Args:
+        h5_filepath (str): Path of the shot file.
+        device_name (str): Name of the device.
+        sidecar (bool, optional): Whether to write to the device's sidecar file,
+            which is linked into the shot file on exit, rather than to the shot
+            file itself.
+
+    Yields:
+        h5py.File: The shot file opened in ``'r+'`` mode, or the newly created
+        sidecar file.
+    """
+    if not sidecar:
+        with h5py.File(h5_filepath, 'r+') as f:
+            yield f
+        return
+    path = sidecar_path(h5_filepath, device_name)
+    with h5py.File(path, 'w') as f:
+        yield f
+    link_sidecar(h5_filepath, path)
+
+
+def link_sidecar(h5_filepath, sidecar_filepath):
+    """Add external links to the datasets of a sidecar file to the shot file,
+    and copy the attributes of the groups containing them.
+
+    Args:
+        h5_filepath (str): Path of the shot file.
+        sidecar_filepath (str): Path of the sidecar file, which must be in the
+            same directory as the shot file.
+    """
+    filename = os.path.basename(sidecar_filepath)
+    groups = []
+    datasets = []
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            datasets.append(name)
+        else:
+            groups.append((name, dict(obj.attrs)))
+
+    # Read the structure of the sidecar file before locking the shot file:
+    with h5py.File(sidecar_filepath, 'r') as sidecar:
+        sidecar.visititems(visit)
+
+    with h5py.File(h5_filepath, 'r+') as f:
+        for name, attrs in groups:
+            group = f.require_group(name)
+            for key, value in attrs.items():
+                group.attrs[key] = value
+        for name in datasets:
+            f[name] = h5py.ExternalLink(filename, '/' + name)
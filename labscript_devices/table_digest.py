@@ -0,0 +1,117 @@
+#####################################################################
+#                                                                   #
+# /table_digest.py                                                  #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Content digests of device tables in shot files.
+
+At compile time, :func:`create_dataset_with_digest` stores a digest of each
+table's contents as an attribute of its dataset. In BLACS, workers read tables
+through a :class:`TableCache`, which compares this attribute with the digest of
+the table they last programmed, and only reads and decodes the dataset if it
+differs. Tables in shot files compiled without digests are always read.
+"""
+
+import hashlib
+
+import numpy as np
+
+DIGEST_ATTR = 'digest'
+
+
+def compute_digest(data):
+    """Compute a digest of the contents, shape and datatype of an array.
+
+    The digest is stable across processes and platforms for arrays with the
+    same dtype, so it can be stored in a shot file and compared with digests
+    computed in later compilations.
+
+    Args:
+        data (array_like): Array to compute the digest of.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    data = np.ascontiguousarray(data)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(data.dtype.descr).encode('utf8'))
+    h.update(repr(data.shape).encode('utf8'))
+    h.update(data.tobytes())
+    return h.hexdigest()
+
+
+def create_dataset_with_digest(group, name, data, **kwargs):
+    """Create a dataset and store the digest of its contents as an attribute.
+
+    Args:
+        group (h5py.Group): Group in which to create the dataset.
+        name (str): Name of the dataset.
+        data (array_like): Contents of the dataset.
+        **kwargs: Passed to :meth:`h5py.Group.create_dataset`.
+
+    Returns:
+        h5py.Dataset: The created dataset.
+    """
+    data = np.asarray(data)
+    dataset = group.create_dataset(name, data=data, **kwargs)
+    dataset.attrs[DIGEST_ATTR] = compute_digest(data)
+    return dataset
+
+
+class TableCache(object):
+    """Cache of the tables most recently programmed by a BLACS worker.
+
+    Tables are keyed by the name of their dataset within the shot file. A table
+    only counts as unchanged once the worker has called :meth:`programmed`
+    after reading it, so that a failed transition to buffered does not cause
+    the next shot to skip programming.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._digests = {}
+        self._pending = {}
+
+    def read(self, dataset, fresh=False):
+        """Read a dataset, unless it is unchanged since it was last programmed.
+
+        Args:
+            dataset (h5py.Dataset): Dataset to read.
+            fresh (bool, optional): If `True`, always read the dataset.
+
+        Returns:
+            tuple: `(data, changed)`. If `changed` is `False`, `data` is the
+            array read from a previous shot file, which is identical to the
+            contents of `dataset`. It must not be modified.
+        """
+        name = dataset.name
+        digest = dataset.attrs.get(DIGEST_ATTR, None)
+        if (
+            not fresh
+            and digest is not None
+            and name in self._tables
+            and self._digests.get(name) == digest
+        ):
+            return self._tables[name], False
+        self._digests.pop(name, None)
+        data = dataset[()]
+        self._tables[name] = data
+        if digest is not None:
+            self._pending[name] = digest
+        return data, True
+
+    def programmed(self):
+        """Mark all tables read since the last call as successfully programmed."""
+        self._digests.update(self._pending)
+        self._pending.clear()
+
+    def clear(self):
+        """Forget all tables, so that the next reads are treated as changed."""
+        self._tables.clear()
+        self._digests.clear()
+        self._pending.clear()
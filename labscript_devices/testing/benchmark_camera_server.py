@@ -0,0 +1,116 @@
+"""Benchmark of the latency of camera server requests from the CameraWorker.
+
+Starts local stand-in camera servers that do nothing on each transition, one
+speaking the zeromq protocol of labscript_utils.camera_server and one the TCP
+socket protocol, and times transition_to_buffered followed by
+transition_to_manual, both as the CameraWorker used to make the requests, with
+a new request-reply exchange or TCP connection per message, and over the
+long-lived connections of labscript_devices.camera_server_connection. Latencies
+to a local server are a lower bound on those over the network, where each round
+trip saved counts for more. Run with:
+
+    python benchmark_camera_server.py [n_shots]
+"""
+import contextlib
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import numpy as np
+import zprocess
+from labscript_utils.camera_server import CameraServer
+
+from labscript_devices.camera_server_connection import (
+    ZMQServerConnection,
+    SocketServerConnection,
+)
+
+N_SHOTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+H5_FILE = 'shot.h5'
+
+
+class StandInSocketHandler(socketserver.StreamRequestHandler):
+    # Handles any number of requests on a connection until the client closes it:
+    def handle(self):
+        for line in self.rfile:
+            request = line.strip().decode('utf8')
+            if request == 'hello':
+                self.wfile.write(b'hello\r\n')
+            elif request in [H5_FILE, 'done']:
+                self.wfile.write(b'ok\r\n')
+                self.wfile.write(b'done\r\n')
+            elif request == 'abort':
+                self.wfile.write(b'done\r\n')
+
+
+class StandInSocketServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def zmq_per_request(port):
+    # As the CameraWorker did, with one request-reply exchange per message:
+    for message in [H5_FILE, 'done']:
+        assert zprocess.zmq_get_string(port, 'localhost', data=message) == 'ok'
+        assert zprocess.zmq_get_string(port, 'localhost', timeout=10) == 'done'
+
+
+def socket_per_request(port):
+    # As the CameraWorker did, with one TCP connection per transition:
+    for message in [H5_FILE, 'done']:
+        with socket.create_connection(('localhost', port), 120) as s:
+            s.send(b'%s\r\n' % message.encode('utf8'))
+            response = s.recv(1024).decode('utf8')
+            if 'done' not in response:
+                response += s.recv(1024).decode('utf8')
+            assert 'ok' in response and 'done' in response
+
+
+def long_lived(connection, pipelined):
+    for message in [H5_FILE, 'done']:
+        messages = [message, ''] if pipelined else [message]
+        connection.request(messages, ['ok', 'done'], [5, 10])
+
+
+def measure(function, *args):
+    for _ in range(10):
+        function(*args)
+    latencies = []
+    for _ in range(N_SHOTS):
+        start_time = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - start_time)
+    return 1e6 * np.array(latencies)
+
+
+def report(name, latencies):
+    print(
+        '%-36s median %6.0f us, 99th percentile %6.0f us'
+        % (name, np.median(latencies), np.percentile(latencies, 99))
+    )
+
+
+if __name__ == '__main__':
+    print('transition_to_buffered + transition_to_manual, %d shots' % N_SHOTS)
+    # The stand-in zeromq server prints every request:
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        zmq_server = CameraServer(None)
+        zmq_latencies = measure(zmq_per_request, zmq_server.port)
+        connection = ZMQServerConnection('localhost', zmq_server.port)
+        pipelined_latencies = measure(long_lived, connection, True)
+        connection.close()
+        zmq_server.shutdown()
+    report('zmq, request-reply per message', zmq_latencies)
+    report('zmq, long-lived pipelined', pipelined_latencies)
+
+    socket_server = StandInSocketServer(('localhost', 0), StandInSocketHandler)
+    threading.Thread(target=socket_server.serve_forever, daemon=True).start()
+    port = socket_server.server_address[1]
+    report('sockets, connection per transition', measure(socket_per_request, port))
+    connection = SocketServerConnection('localhost', port)
+    report('sockets, long-lived', measure(long_lived, connection, False))
+    connection.close()
+    socket_server.shutdown()
@@ -0,0 +1,81 @@
+"""Benchmark of compiling RFBlaster shots.
+
+Compiles a scan of shots in which one DDS of an RFBlaster is ramped to a
+different final frequency each shot and the other is unchanged, with the
+RFBlaster's `caspr` assembler replaced by a stub that sleeps for a fixed time
+and writes the assembly back out as the "binary". Prints the time taken to
+compile each shot and the number of times caspr was run. Requires the rfblaster
+package, for its assembly compiler. Run with:
+
+    python benchmark_rfblaster.py [n_shots] [caspr_time]
+"""
+import os
+import sys
+import stat
+import tempfile
+import time
+
+import rfblaster
+from labscript import *
+from labscript_devices.RFBlaster import RFBlaster
+
+N_SHOTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+# Time taken by the stub caspr for each program, in seconds:
+CASPR_TIME = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+STUB_CASPR = """\
+import shutil, sys, time
+time.sleep({caspr_time!r})
+shutil.copyfile(sys.argv[1], sys.argv[2])
+with open({log!r}, 'a') as f:
+    f.write(sys.argv[1] + '\\n')
+"""
+
+
+def make_stub_caspr(tempdir):
+    """Write a stub caspr executable that logs its invocations to a file"""
+    log = os.path.join(tempdir, 'caspr.log')
+    script = os.path.join(tempdir, 'caspr_stub.py')
+    with open(script, 'w') as f:
+        f.write(STUB_CASPR.format(caspr_time=CASPR_TIME, log=log))
+    if os.name == 'nt':
+        executable = os.path.join(tempdir, 'caspr_stub.bat')
+        with open(executable, 'w') as f:
+            f.write('@"%s" "%s" %%*\n' % (sys.executable, script))
+    else:
+        executable = os.path.join(tempdir, 'caspr_stub')
+        with open(executable, 'w') as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, script))
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+    return executable, log
+
+
+def compile_shot(path, final_frequency):
+    labscript_init(path, new=True, overwrite=True)
+    RFBlaster('blaster', ip_address='0.0.0.0')
+    DDS('dds0', blaster.direct_outputs, 'dds 0')
+    DDS('dds1', blaster.direct_outputs, 'dds 1')
+    start()
+    t = 0
+    t += dds0.frequency.ramp(t, duration=0.1, initial=10e6, final=final_frequency, samplerate=100e3)
+    t += dds1.frequency.ramp(t, duration=0.1, initial=20e6, final=30e6, samplerate=100e3)
+    stop(t + 1e-3)
+    labscript_cleanup()
+
+
+with tempfile.TemporaryDirectory() as tempdir:
+    rfblaster.caspr, log = make_stub_caspr(tempdir)
+    compile_times = []
+    for shot in range(N_SHOTS):
+        path = os.path.join(tempdir, 'shot_%d.h5' % shot)
+        start_time = time.perf_counter()
+        compile_shot(path, final_frequency=11e6 + 1e5 * shot)
+        compile_times.append(time.perf_counter() - start_time)
+    with open(log) as f:
+        n_caspr_runs = len(f.readlines())
+
+    print('%d shots, stub caspr taking %.2f s' % (N_SHOTS, CASPR_TIME))
+    print('first shot:      %.3f s' % compile_times[0])
+    if N_SHOTS > 1:
+        print('subsequent mean: %.3f s' % (sum(compile_times[1:]) / (N_SHOTS - 1)))
+    print('caspr runs:      %d' % n_caspr_runs)
@@ -0,0 +1,125 @@
+"""Benchmark of uploading programs to an RFBlaster.
+
+Runs RFBlasterWorker.transition_to_buffered for a scan of shots against a local
+HTTP server standing in for the RFBlaster's web server. One channel's binary
+changes every shot and the other's does not. The server takes a fixed time to
+handle each connection and each request, plus a time per byte uploaded.
+Prints the mean time per shot, the bytes uploaded and the connections opened,
+both for uploading every binary over a new connection each shot, as the worker
+used to, and with smart programming over a keep-alive connection. Run with:
+
+    python benchmark_rfblaster_upload.py [n_shots] [binary_size]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import labscript_utils.h5_lock, h5py
+
+from labscript_devices.RFBlaster import RFBlasterWorker
+
+N_SHOTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+BINARY_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+# Time taken by the stand-in server to accept a connection, handle a request,
+# and receive each byte, in seconds:
+CONNECTION_TIME = 0.02
+REQUEST_TIME = 0.01
+TIME_PER_BYTE = 1e-7
+
+PAGE = ''.join(
+    '<input name="%s_ch%d_in" value="0.0">' % (register, channel)
+    for register in 'fap'
+    for channel in range(2)
+).encode('utf8')
+
+stats = {'connections': 0, 'bytes': 0}
+
+
+class RFBlasterStandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; don't delay the body:
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        stats['connections'] += 1
+        time.sleep(CONNECTION_TIME)
+
+    def respond(self):
+        time.sleep(REQUEST_TIME)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        n_bytes = int(self.headers['Content-Length'])
+        self.rfile.read(n_bytes)
+        stats['bytes'] += n_bytes
+        time.sleep(TIME_PER_BYTE * n_bytes)
+        self.respond()
+
+    def log_message(self, *args):
+        pass
+
+
+def make_shot_file(path, shot):
+    rng = np.random.default_rng(0)
+    binaries = [rng.bytes(BINARY_SIZE), rng.bytes(BINARY_SIZE)]
+    # The binary of channel 0 changes every shot:
+    binaries[0] = shot.to_bytes(4, 'little') + binaries[0][4:]
+    dtypes = [('time', float)] + [
+        (name % i, float) for i in range(2) for name in ['amp%d', 'freq%d', 'phase%d']
+    ]
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices/rfblaster')
+        group.create_dataset('TABLE_DATA', data=np.zeros(2, dtype=dtypes))
+        for i, binary in enumerate(binaries):
+            group.create_dataset('BINARY_CODE/DDS%d' % i, data=np.bytes_(binary))
+
+
+def run(worker, paths, smart):
+    stats['connections'] = stats['bytes'] = 0
+    start_time = time.perf_counter()
+    for path in paths:
+        if not smart:
+            # Each request opens a new connection:
+            worker.session.close()
+        worker.transition_to_buffered('rfblaster', path, {}, fresh=not smart)
+    return (time.perf_counter() - start_time) / len(paths), dict(stats)
+
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), RFBlasterStandIn)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+with tempfile.TemporaryDirectory() as tempdir:
+    paths = [os.path.join(tempdir, 'shot_%d.h5' % shot) for shot in range(N_SHOTS)]
+    for shot, path in enumerate(paths):
+        make_shot_file(path, shot)
+
+    worker = RFBlasterWorker.__new__(RFBlasterWorker)
+    worker.address = 'http://127.0.0.1:%d' % server.server_address[1]
+    worker.num_DDS = 2
+    worker.init()
+
+    print('%d shots, %d byte binaries' % (N_SHOTS, BINARY_SIZE))
+    for smart in [False, True]:
+        time_per_shot, result = run(worker, paths, smart)
+        print(
+            '%-22s %.1f ms/shot, %.1f MB uploaded, %d connections'
+            % (
+                'smart, keep-alive:' if smart else 'full upload each shot:',
+                1e3 * time_per_shot,
+                result['bytes'] / 1e6,
+                result['connections'],
+            )
+        )
+    worker.shutdown()
+server.shutdown()
@@ -0,0 +1,99 @@
+"""Benchmark of saving acquired data from several workers at the end of a shot.
+
+Starts a number of processes standing in for acquisition workers, which each
+save the same amount of data to a shot file at the same time, as at the end of a
+shot. Data is compressed as camera images are, so that writing it takes time.
+Prints the mean time from the start of the end of the shot until the last
+worker is done, and the mean time each worker spends waiting for and holding
+the lock on the shot file, both writing to the shot file directly and with
+sidecar files, see labscript_devices.sidecar_files. Sidecar files only reduce
+the total time if the workers can write concurrently, that is, given more than
+one CPU core for compression and storage that is not itself the bottleneck.
+Run with:
+
+    python benchmark_sidecar_files.py [n_workers] [megabytes_per_worker] [n_shots]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import labscript_utils.h5_lock, h5py
+
+from labscript_devices.sidecar_files import open_data_file
+
+N_WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+MEGABYTES = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+N_SHOTS = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+
+def worker(device_name, sidecar, shots, done):
+    rng = np.random.default_rng()
+    data = rng.integers(0, 4096, int(MEGABYTES * 2 ** 19), dtype=np.uint16)
+    while True:
+        path = shots.get()
+        if path is None:
+            return
+        open_time = time.perf_counter()
+        with open_data_file(path, device_name, sidecar=sidecar) as f:
+            group = f.require_group('/images/' + device_name)
+            group.attrs['camera'] = device_name
+            group.create_dataset('frame', data=data, compression='gzip')
+            written_time = time.perf_counter()
+        end_time = time.perf_counter()
+        # The shot file is locked, or waited for, for the whole block, or only
+        # for linking the sidecar file into it once written:
+        locked_time = end_time - (written_time if sidecar else open_time)
+        done.put((end_time, locked_time))
+
+
+def run(tempdir, sidecar):
+    ctx = multiprocessing.get_context('spawn')
+    queues = [ctx.Queue() for _ in range(N_WORKERS)]
+    done = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker, args=('device_%d' % i, sidecar, queue, done))
+        for i, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+    latencies = []
+    locked_times = []
+    for shot in range(N_SHOTS):
+        path = os.path.join(tempdir, 'shot_%d_%d.h5' % (sidecar, shot))
+        with h5py.File(path, 'w') as f:
+            f.create_group('data')
+        start_time = time.perf_counter()
+        for queue in queues:
+            queue.put(path)
+        results = [done.get() for _ in queues]
+        latencies.append(max(end_time for end_time, _ in results) - start_time)
+        locked_times.extend(locked_time for _, locked_time in results)
+        with h5py.File(path, 'r') as f:
+            for i in range(N_WORKERS):
+                assert f['/images/device_%d/frame' % i].shape == (int(MEGABYTES * 2 ** 19),)
+    for queue in queues:
+        queue.put(None)
+    for process in processes:
+        process.join()
+    return np.array(latencies), np.array(locked_times)
+
+
+if __name__ == '__main__':
+    print(
+        '%d workers saving %.1f MB each, %d shots' % (N_WORKERS, MEGABYTES, N_SHOTS)
+    )
+    with tempfile.TemporaryDirectory() as tempdir:
+        for sidecar in [False, True]:
+            latencies, locked_times = run(tempdir, sidecar)
+            print(
+                '%s: end of shot mean %.0f ms, max %.0f ms; shot file locked %.1f ms'
+                % (
+                    'sidecar files' if sidecar else 'shot file',
+                    1e3 * latencies.mean(),
+                    1e3 * latencies.max(),
+                    1e3 * locked_times.mean(),
+                )
+            )
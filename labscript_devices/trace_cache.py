@@ -0,0 +1,326 @@
+#####################################################################
+#                                                                   #
+# /trace_cache.py                                                   #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""On-disk cache of the traces produced by runviewer parsers.
+
+Runviewer parsers rebuild their traces from the device's tables every time a
+shot is loaded. Decorating a parser's `get_traces` with :func:`cached_traces`
+saves the traces it produces to a file next to the shot file, named
+``<shot name>.<device name>.traces``, and on subsequent loads replays them from
+that file, memory-mapped, instead of calling the parser::
+
+    class MyParser(object):
+        @cached_traces
+        def get_traces(self, add_trace, clock=None):
+            ...
+
+The cache is opt-in, enabled by setting ``cache_traces = True`` in the
+``[runviewer]`` section of the labconfig, or by setting :data:`enabled`. A
+cached file is only used if its key matches, which is a digest of:
+
+* the contents of the device's group in the shot file, using the digests
+  stored by :mod:`labscript_devices.table_digest` where present,
+* the rows of the device and its descendants in the shot file's connection
+  table, which hold their connection table properties,
+* any other groups or datasets of the shot file the parser reads, named by its
+  ``trace_cache_paths`` class attribute, for example
+  ``trace_cache_paths = ['waits']``,
+* the clock passed to the parser, and the device's children in the connection
+  table,
+* the source files of the parser class and its base classes,
+
+so it is invalidated by recompiling the shot or editing the parser. If the
+cache file cannot be written, for example because the shot is on a read-only
+drive, the parser's traces are returned uncached.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import struct
+
+import labscript_utils.h5_lock, h5py
+import numpy as np
+
+from labscript_devices.table_digest import DIGEST_ATTR, compute_digest
+
+MAGIC = b'RVTRACES'
+ALIGNMENT = 64
+
+enabled = None
+"""Whether the cache is enabled. If `None`, the labconfig is read to find out."""
+
+_parser_digests = {}
+
+
+def cache_enabled():
+    """Return whether the trace cache is enabled."""
+    global enabled
+    if enabled is None:
+        try:
+            from labscript_utils.labconfig import LabConfig
+
+            enabled = LabConfig().getboolean('runviewer', 'cache_traces', fallback=False)
+        except Exception:
+            enabled = False
+    return enabled
+
+
+def cache_path(h5_filepath, device_name):
+    """Return the path of the trace cache file of a device for a shot file."""
+    return '%s.%s.traces' % (os.path.splitext(h5_filepath)[0], device_name)
+
+
+def _parser_digest(parser_class):
+    # Digest of the source files of the parser class and its bases:
+    if parser_class not in _parser_digests:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(parser_class.__qualname__.encode('utf8'))
+        for cls in parser_class.__mro__:
+            if cls is object:
+                continue
+            try:
+                with open(inspect.getsourcefile(cls), 'rb') as f:
+                    h.update(f.read())
+            except (TypeError, OSError):
+                h.update(cls.__module__.encode('utf8'))
+        _parser_digests[parser_class] = h.hexdigest()
+    return _parser_digests[parser_class]
+
+
+def _connection_tree(device):
+    # The parts of the connection table entry for the device that parsers use:
+    return (
+        device.name,
+        device.device_class,
+        device.parent_port,
+        [_connection_tree(child) for _, child in sorted(device.child_list.items())],
+    )
+
+
+def _descendant_names(device):
+    names = [device.name]
+    for _, child in sorted(device.child_list.items()):
+        names.extend(_descendant_names(child))
+    return names
+
+
+def _update_with_connection_table(h, hdf5_file, names):
+    # The rows of the named devices, in the order of the connection table:
+    if 'connection table' not in hdf5_file:
+        return
+    table = hdf5_file['connection table'][()]
+    table_names = [
+        name.decode('utf8') if isinstance(name, bytes) else name for name in table['name']
+    ]
+    names = set(names)
+    for name, row in zip(table_names, table):
+        if name in names:
+            h.update(repr(row.tolist()).encode('utf8'))
+
+
+def _update_with_group(h, group):
+    def update_with_attrs(obj):
+        for name in sorted(obj.attrs):
+            h.update(name.encode('utf8'))
+            h.update(repr(obj.attrs[name]).encode('utf8'))
+
+    def visit(name, obj):
+        h.update(name.encode('utf8'))
+        update_with_attrs(obj)
+        if isinstance(obj, h5py.Dataset):
+            if DIGEST_ATTR not in obj.attrs:
+                h.update(compute_digest(obj[()]).encode('utf8'))
+
+    update_with_attrs(group)
+    if isinstance(group, h5py.Dataset):
+        visit('', group)
+    else:
+        group.visititems(visit)
+
+
+def compute_key(parser, clock):
+    """Return the key identifying the traces of a parser for its shot and
+    clock.
+
+    Args:
+        parser: Runviewer parser instance, with `path` and `device` attributes,
+            and optionally `trace_cache_paths`, see above.
+        clock (tuple): The clock passed to the parser's `get_traces`, or
+            `None`.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(_parser_digest(type(parser)).encode('utf8'))
+    h.update(repr(_connection_tree(parser.device)).encode('utf8'))
+    if clock is not None:
+        for array in clock:
+            h.update(compute_digest(array).encode('utf8'))
+    with h5py.File(parser.path, 'r') as f:
+        _update_with_group(h, f['devices'][parser.device.name])
+        _update_with_connection_table(h, f, _descendant_names(parser.device))
+        for path in getattr(parser, 'trace_cache_paths', []):
+            h.update(path.encode('utf8'))
+            if path in f:
+                _update_with_group(h, f[path])
+    return h.hexdigest()
+
+
+def _arrays_index(traces, returned):
+    # Collect the arrays of all traces, each distinct array once, since traces
+    # often share their array of times:
+    arrays = []
+    ids = {}
+
+    def index(trace):
+        indices = []
+        for array in trace:
+            if id(array) not in ids:
+                ids[id(array)] = len(arrays)
+                arrays.append(np.ascontiguousarray(array))
+            indices.append(ids[id(array)])
+        return indices
+
+    trace_entries = [
+        [name, index(trace), parent, connection]
+        for name, trace, parent, connection in traces
+    ]
+    returned_entries = [[name, index(trace)] for name, trace in returned.items()]
+    for array in arrays:
+        if array.dtype.hasobject or array.dtype.names is not None:
+            raise TypeError('cannot cache traces of dtype %s' % array.dtype)
+    return arrays, trace_entries, returned_entries
+
+
+def write_cache(path, key, traces, returned):
+    """Write traces to a cache file.
+
+    Args:
+        path (str): Path of the cache file.
+        key (str): Key of the traces, see :func:`compute_key`.
+        traces (list): `(name, trace, parent_device_name, connection)` for each
+            trace passed to `add_trace` by the parser, where each trace is a
+            tuple of arrays.
+        returned (dict): The traces returned by the parser.
+    """
+    arrays, trace_entries, returned_entries = _arrays_index(traces, returned)
+    array_entries = []
+    offset = 0
+    for array in arrays:
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        array_entries.append([array.dtype.str, list(array.shape), offset])
+        offset += array.nbytes
+    header = json.dumps(
+        {
+            'key': key,
+            'arrays': array_entries,
+            'traces': trace_entries,
+            'returned': returned_entries,
+        }
+    ).encode('utf8')
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+    # Write to a temporary file and move it into place, so that readers never
+    # see a partly written file, and ones with the old file mapped keep it:
+    temp_path = path + '.%d.tmp' % os.getpid()
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for array, (_, _, array_offset) in zip(arrays, array_entries):
+                f.seek(data_start + array_offset)
+                f.write(array.tobytes())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def read_cache(path, key):
+    """Read traces from a cache file, memory-mapped.
+
+    Args:
+        path (str): Path of the cache file.
+        key (str): Key of the traces wanted, see :func:`compute_key`.
+
+    Returns:
+        tuple: `(traces, returned)` as passed to :func:`write_cache`, or `None`
+        if there is no cache file with the given key.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            (header_length,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_length).decode('utf8'))
+    except (OSError, ValueError, struct.error):
+        return None
+    if header['key'] != key:
+        return None
+    data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+    if os.path.getsize(path) > data_start:
+        data = np.memmap(path, dtype=np.uint8, mode='r', offset=data_start)
+    else:
+        data = np.zeros(0, dtype=np.uint8)
+    arrays = []
+    for dtype, shape, offset in header['arrays']:
+        dtype = np.dtype(dtype)
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        arrays.append(data[offset : offset + nbytes].view(dtype).reshape(shape))
+    traces = [
+        (name, tuple(arrays[i] for i in indices), parent, connection)
+        for name, indices, parent, connection in header['traces']
+    ]
+    returned = {
+        name: tuple(arrays[i] for i in indices) for name, indices in header['returned']
+    }
+    return traces, returned
+
+
+def cached_traces(get_traces):
+    """Decorator caching the traces of a runviewer parser's `get_traces`
+    method on disk, if the cache is enabled, see :func:`cache_enabled`. The
+    clock is the argument following `add_trace`, whatever its name."""
+    signature = inspect.signature(get_traces)
+    clock_name = list(signature.parameters)[2]
+
+    @functools.wraps(get_traces)
+    def wrapper(self, add_trace, *args, **kwargs):
+        if not cache_enabled():
+            return get_traces(self, add_trace, *args, **kwargs)
+        arguments = signature.bind(self, add_trace, *args, **kwargs).arguments
+        clock = arguments.get(clock_name)
+        path = cache_path(self.path, self.device.name)
+        key = compute_key(self, clock)
+        cached = read_cache(path, key)
+        if cached is not None:
+            traces, returned = cached
+            for name, trace, parent, connection in traces:
+                add_trace(name, trace, parent, connection)
+            return returned
+
+        traces = []
+
+        def recording_add_trace(name, trace, parent_device_name, connection):
+            traces.append((name, trace, parent_device_name, connection))
+            add_trace(name, trace, parent_device_name, connection)
+
+        returned = get_traces(self, recording_add_trace, *args, **kwargs)
+        try:
+            write_cache(path, key, traces, returned)
+        except (OSError, TypeError, ValueError):
+            # Read-only location, or traces that can't be stored as arrays:
+            pass
+        return returned
+
+    return wrapper
+
@@ -0,0 +1,112 @@
+#####################################################################
+#                                                                   #
+# /trigger_index.py                                                 #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Sorted index of the triggers requested by devices sharing a trigger.
+
+Cameras check each requested exposure against the triggers already requested by
+themselves and by the other devices attached to the same trigger connection. A
+:class:`TriggerIndex`, shared by all devices attached to a trigger connection,
+keeps these triggers in sorted lists and a dictionary, so that these checks
+take logarithmic rather than linear time in the number of exposures.
+"""
+
+import weakref
+from bisect import bisect_left, insort
+
+_indices = weakref.WeakKeyDictionary()
+
+
+def _find_near(items, value, tolerance):
+    """Return an item of the sorted list of tuples items whose first element x
+    satisfies abs(x - value) < tolerance, or None if there is none."""
+    # Bisection gives a position close to the first item with x - value > -tolerance,
+    # which is then adjusted using the same arithmetic as the condition, so that the
+    # result is not sensitive to rounding at the boundaries. Since x - value is
+    # monotonic in x, if any item satisfies the condition, that one does:
+    i = bisect_left(items, (value - tolerance,))
+    while i > 0 and items[i - 1][0] - value > -tolerance:
+        i -= 1
+    while i < len(items) and not items[i][0] - value > -tolerance:
+        i += 1
+    if i < len(items) and abs(items[i][0] - value) < tolerance:
+        return items[i]
+    return None
+
+
+class TriggerIndex(object):
+    """Triggers requested by the devices attached to one trigger connection.
+
+    Use :meth:`get` to obtain the index shared by all devices attached to a
+    trigger connection, rather than instantiating this class directly.
+    """
+
+    def __init__(self):
+        # Devices are identified by name, so that the index does not keep them alive.
+        # (t, duration) -> names of devices that have requested that trigger:
+        self._requests = {}
+        # name -> sorted list of (start, duration) of the device's triggers:
+        self._starts = {}
+        # name -> sorted list of (end, start, duration) of the device's triggers:
+        self._ends = {}
+
+    @classmethod
+    def get(cls, trigger_device):
+        """Return the index shared by the devices attached to trigger_device,
+        creating it if it does not exist."""
+        try:
+            return _indices[trigger_device]
+        except KeyError:
+            index = _indices[trigger_device] = cls()
+            return index
+
+    def indexes(self, device):
+        """Whether the triggers of device are in the index"""
+        return device.name in self._starts
+
+    def add(self, device, t, duration):
+        """Record that device has requested a trigger at time t for the given
+        duration."""
+        self._requests.setdefault((t, duration), set()).add(device.name)
+        insort(self._starts.setdefault(device.name, []), (t, duration))
+        insort(self._ends.setdefault(device.name, []), (t + duration, t, duration))
+
+    def requested_by_other(self, device, t, duration):
+        """Whether a device other than the given one has requested a trigger at
+        time t with the given duration."""
+        names = self._requests.get((t, duration), ())
+        return len(names) > 1 or (len(names) == 1 and device.name not in names)
+
+    def has(self, device, t, duration):
+        """Whether device has requested a trigger at time t with the given
+        duration."""
+        return device.name in self._requests.get((t, duration), ())
+
+    def find_too_close(self, device, t, duration, minimum_recovery_time):
+        """Find a trigger of the device with its start less than
+        minimum_recovery_time from the end of the trigger at time t with the given
+        duration, or its end less than minimum_recovery_time from the start.
+
+        Returns:
+            tuple: `(other_t, other_duration)` of such a trigger, or `None` if there
+            is none.
+        """
+        if not minimum_recovery_time > 0:
+            return None
+        start = t
+        end = t + duration
+        other = _find_near(self._starts.get(device.name, []), end, minimum_recovery_time)
+        if other is not None:
+            other_start, other_duration = other
+            return other_start, other_duration
+        other = _find_near(self._ends.get(device.name, []), start, minimum_recovery_time)
+        if other is not None:
+            other_end, other_start, other_duration = other
+            return other_start, other_duration
+        return None
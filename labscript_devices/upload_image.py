@@ -0,0 +1,75 @@
+#####################################################################
+#                                                                   #
+# /upload_image.py                                                  #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Device upload images in shot files.
+
+Many devices are programmed by sending a byte stream built from a table in the
+shot file. Building it at compile time rather than in the BLACS worker moves the
+cost off the critical path between shots. :func:`create_upload_image` stores the
+bytes to send as a dataset alongside the table, with an attribute naming the
+protocol they are encoded for. Workers read it with :func:`read_upload_image`,
+which returns `None` if the shot file has no image or its protocol differs from
+the one the worker speaks, in which case the worker builds the bytes from the
+table as before. The table remains the reference for runviewer and analysis.
+
+Protocol names should identify the device and the firmware command the image is
+sent with, and be changed whenever the encoding changes, for example
+``'prawnblaster-setb-1'``.
+"""
+
+import numpy as np
+
+from labscript_devices.table_digest import create_dataset_with_digest
+
+PROTOCOL_ATTR = 'upload_protocol'
+
+
+def create_upload_image(group, name, data, protocol):
+    """Store the bytes to send to a device as a dataset.
+
+    The dataset has a digest of its contents, see
+    :mod:`labscript_devices.table_digest`.
+
+    Args:
+        group (h5py.Group): Group in which to create the dataset.
+        name (str): Name of the dataset.
+        data (bytes-like): Bytes to send to the device.
+        protocol (str): Name of the encoding of the bytes.
+
+    Returns:
+        h5py.Dataset: The created dataset, of dtype uint8.
+    """
+    image = np.frombuffer(bytes(data), dtype=np.uint8)
+    dataset = create_dataset_with_digest(group, name, image)
+    dataset.attrs[PROTOCOL_ATTR] = protocol
+    return dataset
+
+
+def read_upload_image(group, name, protocol):
+    """Read the bytes to send to a device, if the shot file has them.
+
+    Args:
+        group (h5py.Group): Group containing the dataset.
+        name (str): Name of the dataset.
+        protocol (str): Name of the encoding the caller expects.
+
+    Returns:
+        bytes: The bytes to send, or `None` if there is no such dataset or it
+        was encoded for a different protocol.
+    """
+    if name not in group:
+        return None
+    dataset = group[name]
+    stored_protocol = dataset.attrs.get(PROTOCOL_ATTR, None)
+    if isinstance(stored_protocol, bytes):
+        stored_protocol = stored_protocol.decode('utf8')
+    if stored_protocol != protocol:
+        return None
+    return dataset[()].tobytes()
@@ -0,0 +1,190 @@
+#####################################################################
+#                                                                   #
+# /worker_timing.py                                                 #
+#                                                                   #
+# This file is part of the module labscript_devices, in the         #
+# labscript suite (see http://labscriptsuite.org), and is           #
+# licensed under the Simplified BSD License. See the license.txt    #
+# file in the root of the project for the full license.             #
+#                                                                   #
+#####################################################################
+"""Timing of the phases of BLACS worker transitions.
+
+Decorating a worker's `transition_to_buffered` and `transition_to_manual` with
+:func:`timed` records how long each takes, and phases within them can be timed
+with :meth:`WorkerTiming.span`::
+
+    class MyWorker(Worker):
+        @timed
+        def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
+            with self.timing.span('read_shot_file'):
+                ...
+            with self.timing.span('program'):
+                ...
+
+        @timed
+        def transition_to_manual(self):
+            ...
+
+The durations recorded during each shot are logged at debug level once
+`transition_to_manual` has returned. The worker's :class:`WorkerTiming`, created as
+``self.timing`` when first needed, also keeps the durations of recent shots for
+:meth:`WorkerTiming.statistics`. Workers that open the shot file in
+`transition_to_manual` to save data can also write them there, within that file
+handle, with :meth:`WorkerTiming.save`::
+
+        @timed
+        def transition_to_manual(self):
+            with h5py.File(self.h5_file, 'r+') as f:
+                ...
+                self.timing.save(f)
+
+They are then saved as attributes of the group
+``devices/<device_name>/worker_timing/<worker class name>``, in seconds. The shot
+file is never opened just to save timing, as that would add another wait for its
+lock to the end of every shot. Nothing is saved or logged for shots that are
+aborted.
+"""
+
+import functools
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+TIMING_GROUP = 'worker_timing'
+
+
+class WorkerTiming(object):
+    """Durations of the named phases of the current shot and recent shots.
+
+    Args:
+        history (int, optional): Number of shots for which durations are kept
+            for :meth:`statistics`.
+        worker_name (str, optional): Name of the group the durations are saved
+            to, within the device's ``worker_timing`` group.
+    """
+
+    def __init__(self, history=100, worker_name=None):
+        self.spans = {}
+        # Start times of the phases in progress:
+        self.running = {}
+        self.history = defaultdict(lambda: deque(maxlen=history))
+        self.worker_name = worker_name
+        self.device_name = None
+        self.saved = False
+
+    def new_shot(self, device_name=None):
+        """Forget the durations recorded for the previous shot.
+
+        Args:
+            device_name (str, optional): Name of the device in the shot file.
+        """
+        self.spans = {}
+        self.device_name = device_name
+        self.saved = False
+
+    def record(self, name, duration):
+        """Add a duration to the named phase of the current shot. Phases
+        recorded more than once in a shot accumulate."""
+        self.spans[name] = self.spans.get(name, 0) + duration
+
+    @contextmanager
+    def span(self, name):
+        """Context manager recording the time spent in its body as the named
+        phase of the current shot, whether or not the body raises."""
+        start_time = time.perf_counter()
+        self.running[name] = start_time
+        try:
+            yield
+        finally:
+            del self.running[name]
+            self.record(name, time.perf_counter() - start_time)
+
+    def end_shot(self):
+        """Add the durations of the current shot to the history."""
+        for name, duration in self.spans.items():
+            self.history[name].append(duration)
+
+    def save(self, hdf5_file):
+        """Write the durations of the current shot to an open file, unless they
+        have already been saved. Phases still in progress are saved with their
+        durations so far.
+
+        Args:
+            hdf5_file (h5py.File): Open shot file, or the file a device saves
+                its data to, see
+                :func:`labscript_devices.sidecar_files.open_data_file`.
+        """
+        if self.saved or self.device_name is None or not self.spans:
+            return
+        group = hdf5_file.require_group('devices/%s/%s' % (self.device_name, TIMING_GROUP))
+        group = group.require_group(self.worker_name)
+        spans = dict(self.spans)
+        now = time.perf_counter()
+        for name, start_time in self.running.items():
+            spans[name] = spans.get(name, 0) + now - start_time
+        for name, duration in spans.items():
+            group.attrs[name] = duration
+        self.saved = True
+
+    def statistics(self):
+        """Return statistics of the durations of each phase over recent shots.
+
+        Returns:
+            dict: For each phase name, a dict with the number of shots `n`, and
+            the `mean`, `median` and `max` durations in seconds.
+        """
+        results = {}
+        for name, durations in self.history.items():
+            durations = np.array(durations)
+            results[name] = {
+                'n': len(durations),
+                'mean': durations.mean(),
+                'median': np.median(durations),
+                'max': durations.max(),
+            }
+        return results
+
+    def report(self):
+        """Return a one-line summary of the durations of the current shot,
+        longest first."""
+        spans = sorted(self.spans.items(), key=lambda item: -item[1])
+        return ', '.join('%s: %.1f ms' % (name, 1e3 * duration) for name, duration in spans)
+
+
+def timed(method):
+    """Decorator recording the duration of a worker method as a phase named
+    after it, in the worker's :class:`WorkerTiming` at ``self.timing``.
+
+    Decorating `transition_to_buffered` starts a new shot. Decorating
+    `transition_to_manual` ends the shot once it returns successfully, unless it
+    was called with `abort=True`: the durations are added to the history and
+    logged.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not hasattr(self, 'timing'):
+            self.timing = WorkerTiming(worker_name=type(self).__name__)
+        if name == 'transition_to_buffered':
+            self.timing.new_shot(args[0])
+        with self.timing.span(name):
+            result = method(self, *args, **kwargs)
+        if name == 'transition_to_manual':
+            aborted = args[0] if args else kwargs.get('abort', False)
+            if aborted or not result:
+                # Durations of aborted or failed shots are not representative:
+                self.timing.new_shot()
+                return result
+            self.timing.end_shot()
+            logger = getattr(self, 'logger', None)
+            if logger is not None:
+                logger.debug('Shot timing: %s' % self.timing.report())
+            # Save nothing in a transition_to_manual not preceded by a shot:
+            self.timing.new_shot()
+        return result
+
+    return wrapper